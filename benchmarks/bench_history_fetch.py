@@ -0,0 +1,88 @@
+"""
+Бенчмарк чтения истории в TaskRunner._scan_history.
+
+Сравнивает прежний цикл client.iter_messages (объект Message на каждое сообщение)
+с сырыми страницами GetHistoryRequest и предзагрузкой следующей страницы
+(config.HISTORY_RAW_FETCH). Сеть заменена клиентом, который отвечает
+сгенерированными ChannelMessages с задержкой RTT на запрос; лимиты request_layer
+для бенчмарка сняты.
+
+MESSAGES не превышает 3000: при большем limit iter_messages сам спит 1 с между
+страницами (wait_time), и сравнение свелось бы к этим паузам.
+
+Запуск из корня проекта: python -m benchmarks.bench_history_fetch
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+from telethon.tl.functions.messages import GetHistoryRequest
+from telethon.tl.types import InputPeerChannel, Message, PeerChannel, PeerUser, User
+from telethon.tl.types.messages import ChannelMessages
+
+import config
+import models
+from services.request_layer import TokenBucket, request_layer
+from services.task_runner import task_runner
+
+MESSAGES = 3000
+DISTINCT_USERS = 2000
+RTT_SEC = (0.0, 0.05)
+CHANNEL_ID = 777
+TOP_ID = MESSAGES + 1
+# Сообщения идут раз в минуту: даты нужны для подсчета активности отправителей
+FIRST_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeHistoryClient(TelegramClient):
+    """TelegramClient, у которого вместо сети — сгенерированная история канала."""
+
+    def __init__(self, rtt: float):
+        super().__init__(StringSession(), 1, "0" * 32)
+        self.rtt = rtt
+        self.requests = 0
+        self._users = [User(id=10_000 + i, first_name=f"User {i}", username=f"user_{i}", access_hash=i)
+                       for i in range(DISTINCT_USERS)]
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        if not isinstance(request, GetHistoryRequest):
+            raise NotImplementedError(type(request).__name__)
+        self.requests += 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+        upper = request.offset_id or TOP_ID
+        ids = range(upper - 1, max(request.min_id, upper - 1 - request.limit), -1)
+        messages = [Message(id=i, peer_id=PeerChannel(CHANNEL_ID), date=FIRST_DATE + timedelta(minutes=i), message="hello",
+                            from_id=PeerUser(self._users[i % DISTINCT_USERS].id)) for i in ids if i > 0]
+        senders = {m.from_id.user_id: self._users[m.id % DISTINCT_USERS] for m in messages}
+        return ChannelMessages(pts=1, count=MESSAGES, messages=messages, chats=[], topics=[],
+                               users=list(senders.values()))
+
+
+async def run_scan(raw: bool, rtt: float):
+    config.HISTORY_RAW_FETCH = raw
+    client = FakeHistoryClient(rtt)
+    entity = InputPeerChannel(channel_id=CHANNEL_ID, access_hash=0)
+    task = models.Task(admin_id=1, target_chat="@bench", message_limit=MESSAGES)
+    start = time.perf_counter()
+    total, _ = await task_runner._scan_history(task, client, entity, task.collected_users, task.activity,
+                                               limit=MESSAGES, account="bench")
+    elapsed = time.perf_counter() - start
+    return total, len(task.collected_users), client.requests, elapsed
+
+
+async def main():
+    # Снимаем ограничения скорости: измеряется только стоимость чтения и разбора.
+    request_layer.for_account("bench").buckets["history"] = TokenBucket(1e9, 1e9)
+    print(f"{'режим':>12} {'RTT, мс':>8} {'сообщ.':>7} {'польз.':>7} {'запросов':>9} {'время, с':>9} {'сообщ./с':>10}")
+    for rtt in RTT_SEC:
+        for raw, title in ((False, "iter_messages"), (True, "raw+prefetch")):
+            total, users, requests, elapsed = await run_scan(raw, rtt)
+            print(f"{title:>12} {rtt * 1000:8.0f} {total:7} {users:7} {requests:9} {elapsed:9.2f} "
+                  f"{total / elapsed:10.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""
+Бенчмарк генерации отчетов.
+
+1. XLSX: прежняя сборка Workbook в памяти против потоковой записи в write-only режиме (_build_xlsx),
+   время и пиковое потребление памяти (tracemalloc) для разных размеров задачи.
+2. Все форматы из REPORT_FORMATS на задаче в 10k строк: время генерации и размер файла.
+
+Запуск из корня проекта: python -m benchmarks.bench_report
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+from openpyxl.styles import Font
+
+from models import Task, UserStub
+from services.report_generator import HEADERS, SHEET_TITLE, REPORT_FORMATS, ReportSnapshot, _build_xlsx, _report_rows
+
+SIZES = (1000, 5000, 20000)
+FORMATS_ROWS = 10000
+
+
+def make_task(users: int) -> Task:
+    task = Task(admin_id=1, target_chat="@bench")
+    for i in range(1, users + 1):
+        task.collected_users.add(UserStub(
+            user_id=10_000_000 + i,
+            username=f"user_{i}",
+            first_name=f"Имя{i}",
+            last_name=f"Фамилия{i}",
+            phone=f"7900{i:07d}" if i % 3 == 0 else None,
+        ))
+        if i % 4 == 0:
+            task.invited_users.add(task.collected_users.get(10_000_000 + i))
+    return task
+
+
+def build_in_memory(snapshot: ReportSnapshot, path: str):
+    """Прежняя реализация make_report + _save_workbook."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = SHEET_TITLE
+    ws.append(HEADERS)
+    for col_idx in range(1, len(HEADERS) + 1):
+        ws.cell(row=1, column=col_idx).font = Font(bold=True)
+    for row in _report_rows(snapshot):
+        ws.append(row)
+    ws.auto_filter.ref = ws.dimensions
+    for col in ws.columns:
+        max_len = max(len(str(c.value)) if c.value is not None else 0 for c in col)
+        ws.column_dimensions[col[0].column_letter].width = max_len + 2
+    wb.save(path)
+
+
+def measure(builder, snapshot: ReportSnapshot, path: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    builder(snapshot, path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def bench_xlsx(tmp: str):
+    print(f"{'users':>7} {'in-memory, с':>14} {'in-memory, МБ':>14} {'streaming, с':>14} {'streaming, МБ':>14}")
+    for size in SIZES:
+        snapshot = ReportSnapshot.from_task(make_task(size))
+        old_time, old_peak = measure(build_in_memory, snapshot, os.path.join(tmp, f"old_{size}.xlsx"))
+        new_time, new_peak = measure(_build_xlsx, snapshot, os.path.join(tmp, f"new_{size}.xlsx"))
+        print(f"{size:>7} {old_time:14.2f} {old_peak:14.1f} {new_time:14.2f} {new_peak:14.1f}")
+
+
+def bench_formats(tmp: str):
+    snapshot = ReportSnapshot.from_task(make_task(FORMATS_ROWS))
+    print(f"\n{'format':>10} {'время, с':>10} {'размер, КБ':>12}  ({FORMATS_ROWS} строк)")
+    for key, report_format in REPORT_FORMATS.items():
+        path = os.path.join(tmp, f"formats.{report_format.extension}")
+        start = time.perf_counter()
+        report_format.build(snapshot, path)
+        elapsed = time.perf_counter() - start
+        print(f"{key:>10} {elapsed:10.3f} {os.path.getsize(path) / 1024:12.1f}")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_xlsx(tmp)
+        bench_formats(tmp)
+
+
+if __name__ == "__main__":
+    main()
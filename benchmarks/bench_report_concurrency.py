@@ -0,0 +1,72 @@
+"""
+Бенчмарк одновременной сборки отчетов через make_report.
+
+N задач по 10k пользователей одновременно строят XLSX-отчет: пул потоков
+(REPORT_WORKERS = 0) против пула процессов. Для каждого N выводится время до
+последнего готового отчета и максимальная задержка event loop — насколько бот
+«замирает», пока идёт сборка (тикер каждые 10 мс).
+
+Выигрыш пула процессов по общему времени виден только на нескольких ядрах;
+задержка event loop уменьшается и на одном.
+
+Запуск из корня проекта: python -m benchmarks.bench_report_concurrency
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+import config
+from benchmarks.bench_report import make_task
+from services import report_generator
+
+ROWS = 10000
+CONCURRENCY = (1, 3, 6)
+TICK_SEC = 0.01
+
+
+async def measure_loop_lag(stop: asyncio.Event) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SEC)
+        worst = max(worst, time.perf_counter() - start - TICK_SEC)
+    return worst
+
+
+async def run(tasks: int, workers: int):
+    config.REPORT_WORKERS = workers
+    report_generator.shutdown_report_pool()
+    batch = [make_task(ROWS) for _ in range(tasks)]
+    for task in batch:
+        task.report_format = "xlsx"
+
+    # Прогрев: запуск процессов пула не входит в замер.
+    warmup = await asyncio.gather(*(report_generator.make_report(make_task(10), f"warmup_{n}") for n in range(tasks)))
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(measure_loop_lag(stop))
+    start = time.perf_counter()
+    paths = await asyncio.gather(*(report_generator.make_report(task, f"bench_{n}") for n, task in enumerate(batch)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    worst_lag = await lag
+    for path in paths + warmup:
+        os.remove(path)
+    return elapsed, worst_lag
+
+
+async def main():
+    print(f"CPU: {os.cpu_count()}, строк в отчете: {ROWS}")
+    print(f"{'N':>3} {'потоки, с':>10} {'лаг, мс':>8} {'процессы, с':>12} {'лаг, мс':>8}")
+    for tasks in CONCURRENCY:
+        thread_time, thread_lag = await run(tasks, 0)
+        process_time, process_lag = await run(tasks, tasks)
+        print(f"{tasks:>3} {thread_time:10.2f} {thread_lag * 1000:8.0f} {process_time:12.2f} {process_lag * 1000:8.0f}")
+    report_generator.shutdown_report_pool()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        config.REPORTS_DIR = tmp
+        asyncio.run(main())
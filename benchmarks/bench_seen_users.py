@@ -0,0 +1,67 @@
+"""
+Микробенчмарк фильтра собранных ранее пользователей (services/seen_users.py).
+
+Для нескольких расчетных размеров фильтра: время добавления и проверки id, фактическая
+доля ложных срабатываний на заведомо новых id против заданной, размер файла и время
+сохранения/загрузки.
+
+Запуск из корня проекта: python -m benchmarks.bench_seen_users
+"""
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import config
+from services.seen_users import SeenUsers
+
+# Заполнение фильтра идёт по одному id, поэтому емкость SEEN_USERS_CAPACITY (десятки миллионов)
+# здесь не проверяется: доля ложных срабатываний от размера не зависит, размер файла растет линейно.
+CAPACITIES = (250_000, 1_000_000, 4_000_000)
+SAMPLE = 200_000
+
+
+async def run(capacity: int, tmp: str):
+    path = os.path.join(tmp, f"seen_{capacity}.bloom")
+    seen = SeenUsers(path=path, capacity=capacity, fp_rate=config.SEEN_USERS_FP_RATE)
+    await seen.load()
+    bloom = seen.filter
+
+    # Заполняем фильтр до расчетной емкости напрямую, последняя пачка — через remember() с записью на диск
+    rnd = random.Random(capacity)
+    fill_start = time.perf_counter()
+    for _ in range(capacity - SAMPLE):
+        bloom.add(rnd.getrandbits(40))
+    sample = [rnd.getrandbits(40) for _ in range(SAMPLE)]
+    start = time.perf_counter()
+    await seen.remember(sample)
+    add_time = time.perf_counter() - start
+    fill_time = time.perf_counter() - fill_start
+
+    fresh = [(1 << 41) + rnd.getrandbits(40) for _ in range(SAMPLE)]
+    start = time.perf_counter()
+    false_positives = sum(1 for user_id in fresh if user_id in seen)
+    check_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reloaded = SeenUsers(path=path, capacity=capacity)
+    await reloaded.load()
+    load_time = time.perf_counter() - start
+    assert all(user_id in reloaded for user_id in sample[:1000])
+
+    print(f"{capacity:>11} {os.path.getsize(path) / 1024 / 1024:9.1f} {bloom.num_hashes:4} "
+          f"{add_time / SAMPLE * 1e6:11.2f} {check_time / SAMPLE * 1e6:11.2f} "
+          f"{false_positives / SAMPLE:9.4f} {config.SEEN_USERS_FP_RATE:8.4f} {load_time:9.2f} {fill_time:9.1f}")
+
+
+async def main():
+    print(f"{'емкость':>11} {'файл, МБ':>9} {'k':>4} {'добав., мкс':>11} {'пров., мкс':>11} "
+          f"{'ложн.':>9} {'цель':>8} {'загр., с':>9} {'запол., с':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for capacity in CAPACITIES:
+            await run(capacity, tmp)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
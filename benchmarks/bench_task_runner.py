@@ -0,0 +1,246 @@
+"""
+Офлайн-бенчмарк задач целиком: TaskRunner._execute → _run_task_internal → make_report
+с настоящими AccountManager, ClientPool, request_layer и entity_cache.
+
+Telegram заменён SyntheticChannel/FakeTelegramClient (benchmarks/fakes.py): заданный объём
+истории и число отправителей, задержка ответа, FloodWait и зависшие запросы. Бот заменён
+FakeBot. Лимиты скорости request_layer сняты, отчеты собираются в потоке (REPORT_WORKERS = 0),
+кэши, фильтр собранных пользователей и отчеты пишутся во временный каталог.
+
+Для каждого сценария выводятся пропускная способность, длительность задач (p50/p95),
+задержка event loop (p50/p99) и пиковая память Python (tracemalloc, отдельный прогон,
+чтобы трассировка не искажала время).
+
+Результаты можно сохранить (--save base.json) и сравнить с ними позже (--compare base.json):
+при падении пропускной способности или росте памяти больше чем на REGRESSION_TOLERANCE
+скрипт завершается с кодом 1.
+
+Запуск из корня проекта: python -m benchmarks.bench_task_runner
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import config
+import models
+from benchmarks.fakes import FakeAccount, FakeBot, SyntheticChannel
+from services.account_manager import account_mgr
+from services.entity_cache import entity_cache
+from services.history_store import history_store
+from services.notifier import notifier
+from services.request_layer import request_layer
+from services.seen_users import seen_users
+from services.settings_manager import settings_mgr
+from services.task_runner import task_runner
+
+ADMIN_ID = 1
+TARGET = "@bench_channel"
+INVITE_CHANNEL = "@bench_invites"
+TICK_SEC = 0.01
+REGRESSION_TOLERANCE = 0.2
+UNLIMITED_RATE = {family: (1e9, 1e9) for family in config.REQUEST_RATE_LIMITS}
+WINDOW_CHANNEL = SyntheticChannel(messages=10000, senders=3000, latency=0.02, jitter=0.02)
+
+
+@dataclass
+class Scenario:
+    name: str
+    channel: SyntheticChannel
+    message_limit: int = 0
+    user_limit: int = 0
+    invite: bool = False
+    tasks: int = 1
+    accounts: int = 1
+    date_from: Optional[int] = None
+    date_to: Optional[int] = None
+    config: Dict[str, object] = field(default_factory=dict)
+
+
+SCENARIOS = [
+    Scenario("history", SyntheticChannel(messages=10000, senders=3000), message_limit=10000,
+             config={"HISTORY_SHARDING_ENABLED": False}),
+    Scenario("history_iter", SyntheticChannel(messages=3000, senders=2000), message_limit=3000,
+             config={"HISTORY_RAW_FETCH": False}),
+    Scenario("history_rtt", SyntheticChannel(messages=10000, senders=3000, latency=0.02, jitter=0.02),
+             message_limit=10000, config={"HISTORY_SHARDING_ENABLED": False}),
+    Scenario("sharded_rtt", SyntheticChannel(messages=10000, senders=3000, latency=0.02, jitter=0.02),
+             message_limit=10000, accounts=4),
+    # Сообщения 6001..8000 из 10000: окно дат переводится в min_id/max_id, остальная история не читается
+    Scenario("window_rtt", WINDOW_CHANNEL, date_from=int(WINDOW_CHANNEL.date(6001)),
+             date_to=int(WINDOW_CHANNEL.date(8001)), config={"HISTORY_SHARDING_ENABLED": False}),
+    Scenario("participants", SyntheticChannel(participants=5000, latency=0.02), user_limit=5000),
+    Scenario("concurrent", SyntheticChannel(messages=5000, senders=2000, latency=0.02, jitter=0.02),
+             message_limit=5000, tasks=3, accounts=3, config={"HISTORY_SHARDING_ENABLED": False}),
+    Scenario("faults", SyntheticChannel(messages=5000, senders=2000, latency=0.01, flood_rate=0.04,
+                                        timeout_rate=0.04),
+             message_limit=5000, config={"HISTORY_SHARDING_ENABLED": False, "REQUEST_TIMEOUT_SEC": 0.2}),
+    Scenario("invite", SyntheticChannel(participants=300, latency=0.01, privacy_rate=0.1),
+             user_limit=300, invite=True),
+]
+
+
+@dataclass
+class Result:
+    name: str
+    elapsed: float
+    messages: int
+    users: int
+    requests: int
+    faults: int
+    bot_calls: int
+    task_p50: float
+    task_p95: float
+    lag_p50_ms: float
+    lag_p99_ms: float
+    peak_mb: Optional[float] = None
+
+    @property
+    def throughput(self) -> float:
+        """Сообщений в секунду для сбора из истории, пользователей в секунду для сбора участников."""
+        return (self.messages or self.users) / self.elapsed
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@contextmanager
+def overrides(values: Dict[str, object]):
+    saved = {name: getattr(config, name) for name in values}
+    for name, value in values.items():
+        setattr(config, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+async def measure_loop_lag(stop: asyncio.Event, lags: List[float]):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SEC)
+        lags.append(time.perf_counter() - start - TICK_SEC)
+
+
+async def run_scenario(index: int, scenario: Scenario, run: str) -> Result:
+    bot = FakeBot()
+    notifier.use_bot(bot)
+    # Новые номера на каждый прогон: свежие ведра request_layer и промах кэша резолва, как при первом запуске.
+    accounts = [FakeAccount(f"+7999{index:02d}{n}{run}", scenario.channel, seed=n) for n in range(scenario.accounts)]
+    account_mgr.accounts = accounts
+    settings_mgr.settings["invite_channel"] = INVITE_CHANNEL if scenario.invite else None
+    tasks = [models.Task(admin_id=ADMIN_ID, target_chat=TARGET, message_limit=scenario.message_limit,
+                         user_limit=scenario.user_limit, invite_enabled=scenario.invite,
+                         date_from=scenario.date_from, date_to=scenario.date_to)
+             for _ in range(scenario.tasks)]
+
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.create_task(measure_loop_lag(stop, lags))
+    start = time.perf_counter()
+    with overrides({"REQUEST_RATE_LIMITS": UNLIMITED_RATE, "REPORT_WORKERS": 0, **scenario.config}):
+        await asyncio.gather(*(task_runner._execute(task) for task in tasks))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    await notifier.drain()
+
+    await account_mgr.pool.close_all()
+    for account in accounts:
+        request_layer.forget(account.phone)
+    failed = [task for task in tasks if task.status != "completed"]
+    if failed:
+        raise RuntimeError(f"{scenario.name}: задачи завершились со статусами {[t.status for t in failed]}")
+
+    clients = [client for account in accounts for client in account.clients]
+    durations = [task.duration() for task in tasks]
+    return Result(
+        name=scenario.name,
+        elapsed=elapsed,
+        messages=sum(task.messages_scanned for task in tasks),
+        users=sum(len(task.collected_users) for task in tasks),
+        requests=sum(sum(client.stats.requests.values()) for client in clients),
+        faults=sum(sum(client.stats.faults.values()) for client in clients),
+        bot_calls=len(bot.sent),
+        task_p50=percentile(durations, 0.5),
+        task_p95=percentile(durations, 0.95),
+        lag_p50_ms=percentile(lags, 0.5) * 1000,
+        lag_p99_ms=percentile(lags, 0.99) * 1000,
+    )
+
+
+async def run_all(names: Optional[List[str]]) -> List[Result]:
+    results = []
+    print(f"{'сценарий':>13} {'время, с':>9} {'сообщ.':>7} {'польз.':>7} {'ед./с':>9} {'запр.':>6} {'сбоев':>6} "
+          f"{'бот':>4} {'p50, с':>7} {'p95, с':>7} {'лаг p50':>8} {'лаг p99':>8} {'пик, МБ':>8}")
+    for index, scenario in enumerate(SCENARIOS):
+        if names and scenario.name not in names:
+            continue
+        result = await run_scenario(index, scenario, "a")
+        tracemalloc.start()
+        await run_scenario(index, scenario, "b")
+        result.peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        results.append(result)
+        print(f"{result.name:>13} {result.elapsed:9.2f} {result.messages:7} {result.users:7} "
+              f"{result.throughput:9.0f} {result.requests:6} {result.faults:6} {result.bot_calls:4} "
+              f"{result.task_p50:7.2f} {result.task_p95:7.2f} {result.lag_p50_ms:8.1f} {result.lag_p99_ms:8.1f} "
+              f"{result.peak_mb:8.1f}")
+    return results
+
+
+def compare(results: List[Result], baseline_path: str) -> bool:
+    """Сравнивает с сохраненными результатами; False — есть регрессия."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {item["name"]: Result(**item) for item in json.load(f)}
+    ok = True
+    print(f"\nСравнение с {baseline_path} (допуск {REGRESSION_TOLERANCE:.0%}):")
+    for result in results:
+        base = baseline.get(result.name)
+        if base is None:
+            print(f"{result.name:>13}: нет в базовой линии")
+            continue
+        speed = result.throughput / base.throughput - 1
+        memory = result.peak_mb / base.peak_mb - 1 if base.peak_mb else 0.0
+        regressed = speed < -REGRESSION_TOLERANCE or memory > REGRESSION_TOLERANCE
+        ok = ok and not regressed
+        print(f"{result.name:>13}: ед./с {speed:+.0%}, память {memory:+.0%}{'  РЕГРЕССИЯ' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк задач TaskRunner")
+    parser.add_argument("scenarios", nargs="*", help="имена сценариев (по умолчанию все)")
+    parser.add_argument("--save", metavar="PATH", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", metavar="PATH", help="сравнить с сохраненными результатами")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.REPORTS_DIR = tmp
+        entity_cache.path = os.path.join(tmp, "entity_cache.sqlite3")
+        history_store.path = os.path.join(tmp, "history.sqlite3")
+        seen_users.path = os.path.join(tmp, "seen_users.bloom")
+        results = asyncio.run(run_all(args.scenarios))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump([asdict(result) for result in results], f, ensure_ascii=False, indent=2)
+    if args.compare and not compare(results, args.compare):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Микробенчмарк дедупликации пользователей в циклах сбора TaskRunner.
+
+Сравнивает старую проверку через список (O(n) на сообщение) с UserCollection (O(1))
+при росте MAX_MSG_LIMIT / MAX_USER_LIMIT.
+
+Запуск из корня проекта: python -m benchmarks.bench_user_dedup
+"""
+import random
+import time
+
+import config
+from models import UserStub, UserCollection
+
+SCALES = (1, 2, 4, 8)
+
+
+def _messages(count: int, cardinality: int):
+    rnd = random.Random(count)
+    return [rnd.randrange(1, cardinality + 1) for _ in range(count)]
+
+
+def _run_list(sender_ids, user_limit: int) -> float:
+    collected = []
+    start = time.perf_counter()
+    for sender_id in sender_ids:
+        if sender_id not in [u.user_id for u in collected]:
+            collected.append(UserStub(user_id=sender_id))
+            if len(collected) >= user_limit:
+                break
+    return time.perf_counter() - start
+
+
+def _run_collection(sender_ids, user_limit: int) -> float:
+    collected = UserCollection()
+    start = time.perf_counter()
+    for sender_id in sender_ids:
+        if sender_id not in collected:
+            collected.add(UserStub(user_id=sender_id))
+            if len(collected) >= user_limit:
+                break
+    return time.perf_counter() - start
+
+
+def main():
+    print(f"{'messages':>10} {'users':>8} {'list, мкс/сообщ.':>18} {'index, мкс/сообщ.':>18}")
+    for scale in SCALES:
+        msg_limit = config.MAX_MSG_LIMIT * scale
+        user_limit = config.MAX_USER_LIMIT * scale
+        sender_ids = _messages(msg_limit, user_limit)
+        # Старый вариант квадратичный — на больших масштабах меряем только новый.
+        list_time = _run_list(sender_ids, user_limit) if scale <= 2 else None
+        index_time = _run_collection(sender_ids, user_limit)
+        list_cell = f"{list_time / msg_limit * 1e6:18.3f}" if list_time is not None else f"{'—':>18}"
+        print(f"{msg_limit:>10} {user_limit:>8} {list_cell} {index_time / msg_limit * 1e6:18.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Бенчмарк памяти на 100k пользователей: прежнее представление (dataclass с __dict__,
+три отдельных списка с копиями объектов) против колоночной UserTable с флагами.
+
+Запуск из корня проекта: python -m benchmarks.bench_user_memory
+"""
+import gc
+import random
+import tracemalloc
+from dataclasses import dataclass
+from typing import Optional
+
+from models import Task, UserStub
+
+USERS = 100_000
+FIRST_NAMES = ["Александр", "Мария", "Иван", "Анна", "Дмитрий", "Елена", "Rahul", "Priya", "Amit", "Neha"]
+LAST_NAMES = ["Иванов", "Петрова", "Sharma", "Patel", None]
+
+
+@dataclass
+class LegacyUserStub:
+    user_id: int
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    phone: Optional[str] = None
+
+
+def _fresh(value: Optional[str]) -> Optional[str]:
+    return value.encode().decode() if value else value
+
+
+def _source():
+    rnd = random.Random(42)
+    for i in range(USERS):
+        # Строки создаются заново, как при разборе ответов Telegram.
+        yield (
+            5_000_000_000 + i,
+            f"user{i}" if i % 2 else None,
+            _fresh(rnd.choice(FIRST_NAMES)),
+            _fresh(rnd.choice(LAST_NAMES)) if rnd.random() < 0.7 else None,
+            None,
+        )
+
+
+def build_legacy():
+    collected, invited, already = [], [], []
+    for n, row in enumerate(_source()):
+        collected.append(LegacyUserStub(*row))
+        if n % 2 == 0:
+            invited.append(LegacyUserStub(*row))
+        if n % 10 == 0:
+            already.append(LegacyUserStub(*row))
+    return collected, invited, already
+
+
+def build_table():
+    task = Task(admin_id=1)
+    for n, row in enumerate(_source()):
+        stub = UserStub(*row)
+        task.collected_users.add(stub)
+        if n % 2 == 0:
+            task.invited_users.add(stub)
+        if n % 10 == 0:
+            task.already_participants_list.add(stub)
+    return task
+
+
+def measure(builder):
+    gc.collect()
+    tracemalloc.start()
+    result = builder()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / 1024 / 1024
+
+
+def main():
+    legacy = measure(build_legacy)
+    table = measure(build_table)
+    print(f"{USERS} пользователей (50% приглашены, 10% уже участники), удерживаемая память:")
+    print(f"  списки dataclass:  {legacy:8.1f} МБ")
+    print(f"  UserTable:         {table:8.1f} МБ  ({legacy / table:.1f}x меньше)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Локальные заменители Telegram для бенчмарков: синтетический канал, TelegramClient без сети
+и Bot, который запоминает отправленное вместо обращений к Bot API.
+
+FakeTelegramClient наследует настоящий TelegramClient и подменяет только __call__,
+поэтому iter_messages, get_messages и get_entity проходят через код telethon,
+а request_layer, ClientPool и AccountManager работают без изменений.
+"""
+import asyncio
+import math
+import random
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+from telethon import TelegramClient, errors
+from telethon.sessions import StringSession
+from telethon.tl.functions.channels import GetParticipantsRequest, InviteToChannelRequest
+from telethon.tl.functions.contacts import ResolveUsernameRequest
+from telethon.tl.functions.messages import GetHistoryRequest
+from telethon.tl.types import (
+    Channel, ChannelParticipant, ChatPhotoEmpty, Message, MessageReplyHeader, PeerChannel, PeerUser, UpdatesTooLong,
+    User
+)
+from telethon.tl.types.channels import ChannelParticipants
+from telethon.tl.types.contacts import ResolvedPeer
+from telethon.tl.types.messages import ChannelMessages, InvitedUsers
+
+from services.account_manager import Account
+
+USER_ID_BASE = 10_000_000
+
+
+@dataclass
+class SyntheticChannel:
+    """
+    Канал с messages сообщениями от senders разных отправителей и participants участниками.
+    Каждый bot_every-й пользователь — бот (0 — без ботов). Сообщения идут раз в message_interval
+    секунд, последнее отправлено в end_date (unix-время); каждое reply_every-е сообщение — ответ.
+    Задержка ответа — latency + случайная доля jitter; доли flood_rate и timeout_rate запросов
+    завершаются FloodWait на flood_seconds или зависают до таймаута request_layer,
+    доля privacy_rate приглашений отклоняется настройками приватности.
+    """
+    messages: int = 10000
+    senders: int = 2000
+    participants: int = 5000
+    bot_every: int = 50
+    latency: float = 0.0
+    jitter: float = 0.0
+    flood_rate: float = 0.0
+    flood_seconds: int = 0
+    timeout_rate: float = 0.0
+    privacy_rate: float = 0.0
+    channel_id: int = 777
+    seed: int = 1
+    end_date: float = 1_700_000_000.0
+    message_interval: float = 60.0
+    reply_every: int = 4
+
+    def user(self, index: int) -> User:
+        return User(id=USER_ID_BASE + index, access_hash=index, first_name=f"User {index}",
+                    username=f"user_{index}", bot=bool(self.bot_every and index % self.bot_every == 0))
+
+    def sender_index(self, message_id: int) -> int:
+        return message_id % self.senders
+
+    def date(self, message_id: int) -> float:
+        return self.end_date - (self.messages - message_id) * self.message_interval
+
+    def first_id_at(self, timestamp: float) -> int:
+        """id первого сообщения, отправленного не раньше timestamp."""
+        return max(math.ceil(self.messages - (self.end_date - timestamp) / self.message_interval), 1)
+
+    def entity(self, username: str) -> Channel:
+        # Каждое имя — отдельный канал с устойчивым id, чтобы цель и канал приглашений различались.
+        channel_id = self.channel_id + sum(map(ord, username))
+        return Channel(id=channel_id, title=f"Bench {username}", photo=ChatPhotoEmpty(), date=None,
+                       access_hash=channel_id, username=username, megagroup=True)
+
+
+@dataclass
+class ClientStats:
+    requests: Counter = field(default_factory=Counter)
+    faults: Counter = field(default_factory=Counter)
+
+
+class FakeTelegramClient(TelegramClient):
+    """TelegramClient, который отвечает на запросы из SyntheticChannel, а не из сети."""
+
+    def __init__(self, channel: SyntheticChannel, seed: int = 0):
+        super().__init__(StringSession(), 1, "0" * 32)
+        self.channel = channel
+        self.stats = ClientStats()
+        self._rng = random.Random(channel.seed * 1_000_003 + seed)
+        self._connected = False
+        self._handlers = {
+            GetHistoryRequest: self._history,
+            GetParticipantsRequest: self._participants,
+            ResolveUsernameRequest: self._resolve,
+            InviteToChannelRequest: self._invite,
+        }
+
+    async def connect(self):
+        self._connected = True
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def disconnect(self):
+        self._connected = False
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        handler = self._handlers.get(type(request))
+        if handler is None:
+            raise NotImplementedError(type(request).__name__)
+        self.stats.requests[type(request).__name__] += 1
+        await self._network(request)
+        return handler(request)
+
+    async def _network(self, request):
+        channel = self.channel
+        roll = self._rng.random()
+        if roll < channel.timeout_rate:
+            self.stats.faults["timeout"] += 1
+            # Ответ не придёт: запрос снимет asyncio.wait_for в request_layer.
+            await asyncio.Event().wait()
+        delay = channel.latency + channel.jitter * self._rng.random()
+        if delay:
+            await asyncio.sleep(delay)
+        if roll < channel.timeout_rate + channel.flood_rate:
+            self.stats.faults["flood_wait"] += 1
+            raise errors.FloodWaitError(request, capture=channel.flood_seconds)
+
+    def _history(self, request: GetHistoryRequest) -> ChannelMessages:
+        channel = self.channel
+        upper = channel.messages + 1
+        for bound in (request.offset_id, request.max_id):
+            if bound:
+                upper = min(upper, bound)
+        if request.offset_date:
+            # Как в Telegram: offset_date отдаёт сообщения, отправленные раньше этой даты
+            offset_date = request.offset_date
+            timestamp = offset_date.timestamp() if isinstance(offset_date, datetime) else offset_date
+            upper = min(upper, channel.first_id_at(timestamp))
+        lower = max(request.min_id, upper - 1 - request.limit, 0)
+        peer = PeerChannel(getattr(request.peer, "channel_id", channel.channel_id))
+        messages, senders = [], {}
+        for message_id in range(upper - 1, lower, -1):
+            index = channel.sender_index(message_id)
+            user = senders.get(index)
+            if user is None:
+                user = senders[index] = channel.user(index)
+            date = datetime.fromtimestamp(channel.date(message_id), timezone.utc)
+            reply_to = None
+            if channel.reply_every and message_id % channel.reply_every == 0:
+                reply_to = MessageReplyHeader(reply_to_msg_id=message_id - 1)
+            messages.append(Message(id=message_id, peer_id=peer, date=date, message="hello",
+                                    from_id=PeerUser(user.id), reply_to=reply_to))
+        return ChannelMessages(pts=1, count=channel.messages, messages=messages, chats=[], topics=[],
+                               users=list(senders.values()))
+
+    def _participants(self, request: GetParticipantsRequest) -> ChannelParticipants:
+        channel = self.channel
+        end = min(request.offset + request.limit, channel.participants)
+        users = [channel.user(index) for index in range(request.offset, end)]
+        return ChannelParticipants(count=channel.participants, chats=[], users=users,
+                                   participants=[ChannelParticipant(user_id=u.id, date=None) for u in users])
+
+    def _resolve(self, request: ResolveUsernameRequest) -> ResolvedPeer:
+        entity = self.channel.entity(request.username)
+        return ResolvedPeer(peer=PeerChannel(entity.id), chats=[entity], users=[])
+
+    def _invite(self, request: InviteToChannelRequest) -> InvitedUsers:
+        if self._rng.random() < self.channel.privacy_rate:
+            raise errors.UserPrivacyRestrictedError(request)
+        return InvitedUsers(updates=UpdatesTooLong(), missing_invitees=[])
+
+
+class FakeAccount(Account):
+    """Аккаунт, клиенты которого — FakeTelegramClient; все выданные клиенты сохраняются для статистики."""
+
+    def __init__(self, phone: str, channel: SyntheticChannel, seed: int = 0):
+        super().__init__(phone=phone, api_id=1, api_hash="0" * 32, session_string="bench")
+        self.channel = channel
+        self.seed = seed
+        self.clients: List[FakeTelegramClient] = []
+
+    def client(self) -> FakeTelegramClient:
+        client = FakeTelegramClient(self.channel, seed=self.seed + len(self.clients))
+        self.clients.append(client)
+        return client
+
+
+@dataclass
+class SentMessage:
+    method: str
+    chat_id: int
+    text: Optional[str]
+
+
+class FakeBot:
+    """Заменяет aiogram.Bot в task_runner: запоминает сообщения, правки и документы."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: List[SentMessage] = []
+        self._message_ids = 0
+
+    async def _record(self, method: str, chat_id: int, text: Optional[str]) -> Tuple[int, int]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append(SentMessage(method, chat_id, text))
+        self._message_ids += 1
+        return chat_id, self._message_ids
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        chat_id, message_id = await self._record("send_message", chat_id, text)
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=message_id)
+
+    async def edit_message_text(self, text: str, chat_id: Optional[int] = None, message_id: Optional[int] = None,
+                                **kwargs):
+        await self._record("edit_message_text", chat_id, text)
+        return True
+
+    async def send_document(self, chat_id: int, document, caption: Optional[str] = None, **kwargs):
+        chat_id, message_id = await self._record("send_document", chat_id, caption)
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=message_id)
+
+    def count(self, method: str) -> int:
+        return sum(1 for message in self.sent if message.method == method)
@@ -15,13 +15,80 @@ os.makedirs(DATA_DIR, exist_ok=True)
 ACCOUNTS_FILE = os.path.join(DATA_DIR, "accounts.json")
 SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
 REPORTS_DIR = os.path.join(DATA_DIR, "reports")
+HISTORY_DB_FILE = os.path.join(DATA_DIR, "history.sqlite3")
+ENTITY_CACHE_DB_FILE = os.path.join(DATA_DIR, "entity_cache.sqlite3")
+STATE_DB_FILE = os.path.join(DATA_DIR, "state.sqlite3")
+SEEN_USERS_FILE = os.path.join(DATA_DIR, "seen_users.bloom")
 os.makedirs(REPORTS_DIR, exist_ok=True)
 
 INVITE_DELAY_SEC = 2
 MAX_CONCURRENT_SCRAPING_TASKS = 3
+MAX_QUEUED_TASKS = 100
+PROGRESS_UPDATE_INTERVAL_SEC = 5
+TASK_HISTORY_SIZE = 20
+TASK_CHECKPOINT_INTERVAL_SEC = 15
+# Процессы для сборки отчетов; 0 — собирать в потоках основного процесса
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", 2))
 MAX_MSG_LIMIT = 10000
 MAX_USER_LIMIT = 5000
+HISTORY_SHARDING_ENABLED = True
+MAX_HISTORY_SHARDS = 4
+SHARD_MIN_MESSAGES = 2000
+HISTORY_RAW_FETCH = True
+HISTORY_PAGE_SIZE = 100
 AUTH_TIMEOUT_SEC = 300
+CLIENT_IDLE_TIMEOUT_SEC = 600
+CLIENT_HEALTH_CHECK_SEC = 60
+ENTITY_CACHE_TTL_SEC = 7 * 24 * 3600
+ENTITY_CACHE_PURGE_INTERVAL_SEC = 3600
+# Фильтр пользователей из прошлых отчетов (режим «только новые»): расчетное число id и доля ложных
+# срабатываний. Файл занимает около 1,2 байта на id при 1%; после изменения параметров удалите SEEN_USERS_FILE.
+SEEN_USERS_CAPACITY = int(os.getenv("SEEN_USERS_CAPACITY", 20_000_000))
+SEEN_USERS_FP_RATE = float(os.getenv("SEEN_USERS_FP_RATE", 0.01))
+AUTH_STATUS_TTL_SEC = 300
+AUTH_PROBE_INTERVAL_SEC = 240
+# (запросов в секунду, размер пачки) на аккаунт для каждой группы методов
+REQUEST_RATE_LIMITS = {
+    "history": (2.0, 5),
+    "participants": (1.0, 3),
+    "invite": (1 / INVITE_DELAY_SEC, 1),
+    "resolve": (0.5, 3),
+    "default": (3.0, 5),
+}
+REQUEST_TIMEOUT_SEC = 30
+REQUEST_DEADLINE_SEC = 120
+REQUEST_MAX_BACKOFF_SEC = 4
+FLOOD_RATE_DECREASE = 0.5
+FLOOD_MIN_RATE_FACTOR = 0.05
+FLOOD_RATE_RECOVERY = 0.02
+CIRCUIT_BREAKER_FLOOD_SEC = 60
+CIRCUIT_BREAKER_FAILURES = 5
+CIRCUIT_BREAKER_COOLDOWN_SEC = 300
+# Исходящие сообщения бота. Bot API: около 30 сообщений в секунду всего и 1 в секунду в один чат
+# (запросов в секунду, размер пачки)
+BOT_API_RATE_LIMIT = (25.0, 25)
+BOT_API_CHAT_RATE_LIMIT = (1.0, 3)
+NOTIFY_COALESCE_SEC = 1.0
+NOTIFY_MAX_RETRIES = 3
+NOTIFY_MAX_RETRY_AFTER_SEC = 60
+NOTIFY_SEND_DEADLINE_SEC = 120
+NOTIFY_DRAIN_TIMEOUT_SEC = 10
+# Получение апдейтов: "polling" (по умолчанию) или "webhook" — aiohttp-сервер на WEBHOOK_HOST:WEBHOOK_PORT.
+# WEBHOOK_URL — публичный https-адрес, который регистрируется в Telegram; без него сервер принимает
+# только локальные POST-запросы (проверка без Telegram). WEBHOOK_SECRET общий для всех экземпляров бота,
+# если не задан — генерируется при запуске.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONCURRENT_UPDATES = 16
+WEBHOOK_MAX_PENDING_UPDATES = 256
+WEBHOOK_SHUTDOWN_TIMEOUT_SEC = 10
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
 
 ADMIN_IDS_ENV = os.getenv("ADMIN_IDS")
 if ADMIN_IDS_ENV:
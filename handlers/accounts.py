@@ -22,6 +22,7 @@ import asyncio
 
 import config
 from services.account_manager import account_mgr
+from services.request_layer import request_layer
 from models import AddAccountStates, \
     check_is_admin, validate_phone_number, validate_api_id, validate_api_hash # Обновлено: добавлены валидаторы
 
@@ -51,6 +52,15 @@ async def get_main_menu_content(user_id: int) -> Tuple[str, InlineKeyboardMarkup
     )
     return text, kb
 
+def auth_status_icon(acc) -> str:
+    """Иконка статуса из кэша авторизации, без обращения к Telegram."""
+    if request_layer.is_cooling_down(acc.phone):
+        return "⏸" # Аккаунт на паузе после FloodWait
+    status = account_mgr.cached_auth_status(acc)
+    if status is None:
+        return "⚠️" # Статус ещё не проверен или проверка не удалась
+    return "✅" if status else "❌"
+
 async def get_accounts_menu_content() -> Tuple[str, InlineKeyboardMarkup]:
     """
     Возвращает текст и клавиатуру для меню управления аккаунтами.
@@ -65,14 +75,7 @@ async def get_accounts_menu_content() -> Tuple[str, InlineKeyboardMarkup]:
         ])
     else:
         for i, acc in enumerate(accounts):
-            status = "✅"
-            try:
-                # Проверка
-                if not acc.is_busy and not await acc.is_authorized():
-                    status = "❌"
-            except Exception as e:
-                logger.warning(f"Ошибка проверки статуса аккаунта {acc.phone}: {e}")
-                status = "⚠️" # Не удалось проверить статус
+            status = auth_status_icon(acc)
             text += f"{i + 1}. {status} <code>{acc.phone}</code> (ID: <code>{acc.user_id or 'N/A'}</code>)\n"
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="➕ Добавить аккаунт", callback_data="add_acc")],
@@ -331,7 +334,7 @@ async def del_acc_confirm(message: types.Message, state: FSMContext):
 
     try:
         phone_to_delete = accounts[idx].phone
-        account_mgr.delete(idx)
+        await account_mgr.delete(idx)
         await message.answer(f"✅ Аккаунт <code>{phone_to_delete}</code> успешно удален.")
     except IndexError:
         await message.answer("Неверный номер аккаунта.")
@@ -352,13 +355,7 @@ async def list_accounts(c: types.CallbackQuery):
     else:
         text = "<b>Список аккаунтов:</b>\n"
         for i, acc in enumerate(accounts):
-            status = "✅"
-            try:
-                if not acc.is_busy and not await acc.is_authorized():
-                    status = "❌"
-            except Exception as e:
-                logger.warning(f"Ошибка проверки статуса аккаунта {acc.phone}: {e}")
-                status = "⚠️"
+            status = auth_status_icon(acc)
             text += f"{i + 1}. {status} <code>{acc.phone}</code> (ID: <code>{acc.user_id or 'N/A'}</code>)\n"
 
         await c.message.answer(text)
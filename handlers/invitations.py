@@ -51,7 +51,8 @@ async def process_invite_user_limit(message: types.Message, state: FSMContext):
         target_chat=None,
         message_limit=0,
         user_limit=user_limit,
-        invite_enabled=True
+        invite_enabled=True,
+        report_format=settings_mgr.get_report_format()
     )
 
     await state.clear()
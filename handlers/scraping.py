@@ -10,15 +10,17 @@ import config
 from services.task_runner import task_runner
 from services.settings_manager import settings_mgr
 from services.account_manager import account_mgr
-from models import ScrapingStates, Task, validate_target, validate_positive_int, check_is_admin
+from services.report_generator import REPORT_FORMATS
+from models import ScrapingStates, Task, validate_target, validate_positive_int, check_is_admin, parse_date_range
 import asyncio
+import time
 
 logger = logging.getLogger(__name__)
 
 @check_is_admin
 async def start_scraping_process(c: types.CallbackQuery, state: FSMContext):
     await c.message.answer(
-        "Шаг 1/4: Цель сбора\n"
+        "Шаг 1/6: Цель сбора\n"
         "Введите ссылку на Telegram чат/канал (например, https://t.me/durov или @durov)",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
@@ -35,16 +37,14 @@ async def process_target_chat(m: types.Message, state: FSMContext):
     client = None
     acc = None
     try:
-        acc = await account_mgr.get_free_account()
-        if not acc:
+        leased = await account_mgr.acquire_free()
+        if not leased:
             await processing_message.edit_text("❌ Нет доступных аккаунтов для проверки. Пожалуйста, добавьте аккаунт.")
             await state.clear()
             return
+        acc, client = leased
 
-        client = acc.client()
-        await client.start()
-
-        chat_entity = await validate_target(target_chat, client)
+        chat_entity = await validate_target(target_chat, client, acc.phone)
 
         if not chat_entity:
             await processing_message.edit_text("❌ Неверная ссылка на чат/канал или он недоступен. Попробуйте еще раз.")
@@ -61,7 +61,7 @@ async def process_target_chat(m: types.Message, state: FSMContext):
             [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
         ])
         await processing_message.edit_text(
-            "Шаг 2/4: Лимит сообщений\n"
+            "Шаг 2/6: Лимит сообщений\n"
             "Выберите количество последних сообщений, из которых собирать пользователей. "
             "Это поможет ограничить объем сбора. (0 - все доступные сообщения)",
             reply_markup=kb
@@ -70,13 +70,13 @@ async def process_target_chat(m: types.Message, state: FSMContext):
 
     except errors.RPCError as e:
         logger.error(f"Ошибка Telethon при обработке целевого чата: {e}")
+        if acc and isinstance(e, errors.AuthKeyUnregisteredError):
+            await account_mgr.invalidate_authorization(acc)
         await processing_message.edit_text(f"❌ Произошла ошибка Telegram API: {e}. Пожалуйста, попробуйте снова.")
     except Exception as e:
         logger.exception("Непредвиденная ошибка при обработке целевого чата:")
         await processing_message.edit_text("❌ Произошла непредвиденная ошибка. Пожалуйста, попробуйте снова.")
     finally:
-        if client and client.is_connected():
-            await client.disconnect()
         if acc:
             await account_mgr.release(acc)
 
@@ -84,7 +84,7 @@ async def process_target_chat(m: types.Message, state: FSMContext):
 async def process_message_limit_callback(c: types.CallbackQuery, state: FSMContext):
     if c.data == "msg_custom":
         await c.message.edit_text(
-            "Шаг 2/4: Лимит сообщений\n"
+            "Шаг 2/6: Лимит сообщений\n"
             "Введите свой лимит сообщений (число от 1 до 10000):",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
@@ -93,7 +93,7 @@ async def process_message_limit_callback(c: types.CallbackQuery, state: FSMConte
     else:
         message_limit = int(c.data.split('_')[1])
         await state.update_data(message_limit=message_limit)
-        await show_user_limit_options(c.message, state)
+        await show_period_options(c.message, state)
     await c.answer()
 
 @check_is_admin
@@ -103,6 +103,48 @@ async def process_message_limit_input(m: types.Message, state: FSMContext):
         return await m.answer(f"Пожалуйста, введите положительное число до {config.MAX_MSG_LIMIT}.")
     message_limit = int(message_limit_str)
     await state.update_data(message_limit=message_limit)
+    await show_period_options(m, state)
+
+async def show_period_options(message: types.Message, state: FSMContext):
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="За все время", callback_data="period_0")],
+        [InlineKeyboardButton(text="Последние сутки", callback_data="period_1")],
+        [InlineKeyboardButton(text="Последние 7 дней", callback_data="period_7")],
+        [InlineKeyboardButton(text="Последние 30 дней", callback_data="period_30")],
+        [InlineKeyboardButton(text="Указать даты", callback_data="period_custom")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
+    ])
+    await message.answer(
+        "Шаг 3/6: Период\n"
+        "Из сообщений какого периода собирать пользователей? Telegram отдаст только сообщения периода, "
+        "лимит сообщений считается внутри него (0 — все сообщения периода).",
+        reply_markup=kb
+    )
+    await state.set_state(ScrapingStates.step3)
+
+@check_is_admin
+async def process_period_callback(c: types.CallbackQuery, state: FSMContext):
+    if c.data == "period_custom":
+        await c.message.edit_text(
+            "Шаг 3/6: Период\n"
+            "Введите день или период по UTC: <code>01.05.2024</code> или <code>01.05.2024-07.05.2024</code>",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
+            ])
+        )
+    else:
+        days = int(c.data.split('_')[1])
+        await state.update_data(date_from=int(time.time()) - days * 86400 if days else None, date_to=None)
+        await show_user_limit_options(c.message, state)
+    await c.answer()
+
+@check_is_admin
+async def process_period_input(m: types.Message, state: FSMContext):
+    date_range = parse_date_range(m.text.strip())
+    if date_range is None:
+        return await m.answer("Пожалуйста, введите даты в формате ДД.ММ.ГГГГ или ДД.ММ.ГГГГ-ДД.ММ.ГГГГ.")
+    date_from, date_to = date_range
+    await state.update_data(date_from=date_from, date_to=date_to)
     await show_user_limit_options(m, state)
 
 async def show_user_limit_options(message: types.Message, state: FSMContext):
@@ -115,18 +157,18 @@ async def show_user_limit_options(message: types.Message, state: FSMContext):
         [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
     ])
     await message.answer(
-        "Шаг 3/4: Лимит пользователей\n"
+        "Шаг 4/6: Лимит пользователей\n"
         "Выберите максимальное количество пользователей для сбора. "
         "Это предотвратит сбор слишком большого количества данных. (0 - собрать всех)",
         reply_markup=kb
     )
-    await state.set_state(ScrapingStates.step3)
+    await state.set_state(ScrapingStates.step4)
 
 @check_is_admin
 async def process_user_limit_callback(c: types.CallbackQuery, state: FSMContext):
     if c.data == "usr_custom":
         await c.message.edit_text(
-            "Шаг 3/4: Лимит пользователей\n"
+            "Шаг 4/6: Лимит пользователей\n"
             "Введите свой лимит пользователей (число от 1 до 5000):",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
@@ -154,16 +196,15 @@ async def show_invite_option(message: types.Message, state: FSMContext):
         [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
     ])
     await message.answer(
-        "Шаг 4/4: Приглашение\n"
+        "Шаг 5/6: Приглашение\n"
         "После сбора пользователей, хотите ли вы автоматически пригласить их в канал, "
         "указанный в 'Настройках приглашений'?",
         reply_markup=kb
     )
-    await state.set_state(ScrapingStates.step4)
+    await state.set_state(ScrapingStates.step5)
 
 @check_is_admin
 async def process_invite_choice(c: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
     invite_choice = c.data.split('_')[1] == "yes"
 
     if invite_choice and not settings_mgr.get_channel():
@@ -172,17 +213,50 @@ async def process_invite_choice(c: types.CallbackQuery, state: FSMContext):
         await c.answer()
         return
 
+    await state.update_data(invite_enabled=invite_choice)
+    await show_report_format_options(c.message, state)
+    await c.answer()
+
+async def show_report_format_options(message: types.Message, state: FSMContext):
+    default_format = settings_mgr.get_report_format()
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{fmt.title}{' (по умолчанию)' if key == default_format else ''}",
+                              callback_data=f"rfmt_{key}")]
+        for key, fmt in REPORT_FORMATS.items()
+    ] + [[InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]])
+    await message.answer(
+        "Шаг 6/6: Формат отчета\n"
+        "В каком формате прислать отчет? CSV/JSON Lines/Parquet формируются быстрее и весят меньше, чем XLSX.",
+        reply_markup=kb
+    )
+    await state.set_state(ScrapingStates.step6)
+
+@check_is_admin
+async def process_report_format(c: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    report_format = c.data[len("rfmt_"):]
+    if report_format not in REPORT_FORMATS:
+        report_format = settings_mgr.get_report_format()
+
     task = Task(
         admin_id=c.from_user.id,
         target_chat=data["target_chat"],
         message_limit=data.get("message_limit", 0),
         user_limit=data.get("user_limit", 0),
-        invite_enabled=invite_choice
+        invite_enabled=data.get("invite_enabled", False),
+        report_format=report_format,
+        incremental=settings_mgr.is_incremental(),
+        only_new=settings_mgr.is_only_new(),
+        min_messages=settings_mgr.get_min_messages(),
+        sort_by_activity=settings_mgr.is_activity_sort(),
+        date_from=data.get("date_from"),
+        date_to=data.get("date_to")
     )
 
     await state.clear()
+    period = f" за период {task.date_window_label()}" if task.has_date_window else ""
     await c.message.answer(
-        f"Ваша задача <code>{task.id}</code> на сбор данных из «{task.target_chat}» поставлена в очередь."
+        f"Ваша задача <code>{task.id}</code> на сбор данных из «{task.target_chat}»{period} поставлена в очередь."
     )
     await c.answer()
     asyncio.create_task(task_runner.run(task, admin_user_id=c.from_user.id))
@@ -192,6 +266,9 @@ def register_handlers(dp: Dispatcher):
     dp.message.register(process_target_chat, ScrapingStates.step1)
     dp.callback_query.register(process_message_limit_callback, Text(startswith="msg_"), ScrapingStates.step2)
     dp.message.register(process_message_limit_input, ScrapingStates.step2)
-    dp.callback_query.register(process_user_limit_callback, Text(startswith="usr_"), ScrapingStates.step3)
-    dp.message.register(process_user_limit_input, ScrapingStates.step3)
-    dp.callback_query.register(process_invite_choice, Text(startswith="invite_"), ScrapingStates.step4)
+    dp.callback_query.register(process_period_callback, Text(startswith="period_"), ScrapingStates.step3)
+    dp.message.register(process_period_input, ScrapingStates.step3)
+    dp.callback_query.register(process_user_limit_callback, Text(startswith="usr_"), ScrapingStates.step4)
+    dp.message.register(process_user_limit_input, ScrapingStates.step4)
+    dp.callback_query.register(process_invite_choice, Text(startswith="invite_"), ScrapingStates.step5)
+    dp.callback_query.register(process_report_format, Text(startswith="rfmt_"), ScrapingStates.step6)
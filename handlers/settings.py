@@ -9,15 +9,30 @@ import config
 from models import InviteSettingsStates, check_is_admin
 from services.settings_manager import settings_mgr
 from services.account_manager import account_mgr
+from services.report_generator import REPORT_FORMATS
+
+# Пороги числа сообщений пользователя для отчета (0 — без порога)
+MIN_MESSAGES_CHOICES = (0, 2, 5, 10, 20)
 
 
 async def get_settings_menu_content(user_id: int) -> Tuple[str, InlineKeyboardMarkup]:
     current_channel = settings_mgr.get_channel() or "Не установлен"
     auto_invite_status = "Включены" if settings_mgr.is_auto_invite() else "Отключены"
+    report_format = REPORT_FORMATS[settings_mgr.get_report_format()].title
+    incremental_status = "Включен" if settings_mgr.is_incremental() else "Отключен"
+    only_new_status = "Включены" if settings_mgr.is_only_new() else "Отключены"
+    min_messages = settings_mgr.get_min_messages()
+    activity_status = f"от {min_messages} сообщ." if min_messages else "все"
+    if settings_mgr.is_activity_sort():
+        activity_status += ", по активности"
 
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Установить канал для приглашений", callback_data="set_invite_channel")],
         [InlineKeyboardButton(text=f"Автоприглашения: {auto_invite_status}", callback_data="toggle_auto_invite")],
+        [InlineKeyboardButton(text=f"Формат отчетов: {report_format}", callback_data="report_format_menu")],
+        [InlineKeyboardButton(text=f"Инкрементальный сбор: {incremental_status}", callback_data="toggle_incremental")],
+        [InlineKeyboardButton(text=f"Только новые пользователи: {only_new_status}", callback_data="toggle_only_new")],
+        [InlineKeyboardButton(text=f"Пользователи в отчете: {activity_status}", callback_data="activity_menu")],
         [InlineKeyboardButton(text="◀️ Назад в главное меню", callback_data="menu")]
     ])
     text = f"⚙️ Настройки приглашений:\nТекущий канал: <code>{current_channel}</code>"
@@ -65,15 +80,110 @@ async def process_invite_channel(m: types.Message, state: FSMContext):
 
 @check_is_admin
 async def toggle_auto_invite(c: types.CallbackQuery):
-    new_status = settings_mgr.toggle_invite()
+    new_status = await settings_mgr.toggle_invite()
     status_text = "Включены" if new_status else "Отключены"
     await c.answer(f"Автоприглашения: {status_text}", show_alert=True)
     text, kb = await get_settings_menu_content(c.from_user.id)
     await c.message.edit_text(text, reply_markup=kb, parse_mode='HTML')
 
 
+@check_is_admin
+async def toggle_incremental(c: types.CallbackQuery):
+    new_status = await settings_mgr.toggle_incremental()
+    status_text = "Включен" if new_status else "Отключен"
+    await c.answer(
+        f"Инкрементальный сбор: {status_text}. Повторный сбор чата читает только сообщения после прошлого запуска.",
+        show_alert=True)
+    text, kb = await get_settings_menu_content(c.from_user.id)
+    await c.message.edit_text(text, reply_markup=kb, parse_mode='HTML')
+
+
+@check_is_admin
+async def toggle_only_new(c: types.CallbackQuery):
+    new_status = await settings_mgr.toggle_only_new()
+    status_text = "Включены" if new_status else "Отключены"
+    await c.answer(
+        f"Только новые пользователи: {status_text}. В отчет не попадут пользователи из отчетов прошлых задач.",
+        show_alert=True)
+    text, kb = await get_settings_menu_content(c.from_user.id)
+    await c.message.edit_text(text, reply_markup=kb, parse_mode='HTML')
+
+
+@check_is_admin
+async def show_report_format_menu(c: types.CallbackQuery):
+    current = settings_mgr.get_report_format()
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{'✅ ' if key == current else ''}{fmt.title}", callback_data=f"set_rfmt_{key}")]
+        for key, fmt in REPORT_FORMATS.items()
+    ] + [[InlineKeyboardButton(text="◀️ Назад", callback_data="m_settings")]])
+    await c.message.edit_text("Выберите формат отчетов по умолчанию:", reply_markup=kb)
+    await c.answer()
+
+
+@check_is_admin
+async def set_report_format(c: types.CallbackQuery):
+    report_format = c.data[len("set_rfmt_"):]
+    try:
+        await settings_mgr.set_report_format(report_format)
+    except ValueError as ve:
+        await c.answer(str(ve), show_alert=True)
+        return
+    await c.answer(f"Формат отчетов: {REPORT_FORMATS[report_format].title}")
+    text, kb = await get_settings_menu_content(c.from_user.id)
+    await c.message.edit_text(text, reply_markup=kb, parse_mode='HTML')
+
+
+async def get_activity_menu_content() -> Tuple[str, InlineKeyboardMarkup]:
+    current = settings_mgr.get_min_messages()
+    sort_status = "Включена" if settings_mgr.is_activity_sort() else "Отключена"
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{'✅ ' if value == current else ''}{f'От {value} сообщений' if value else 'Все'}",
+                              callback_data=f"set_minmsg_{value}")]
+        for value in MIN_MESSAGES_CHOICES
+    ] + [
+        [InlineKeyboardButton(text=f"Сортировка по активности: {sort_status}", callback_data="toggle_activity_sort")],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="m_settings")]
+    ])
+    text = ("Каких отправителей собирать из истории сообщений? Порог действует и на приглашения, а лимит "
+            "пользователей считается среди прошедших его, поэтому история читается до лимита сообщений. "
+            "При инкрементальном сборе с порогом отправители из прошлых запусков не добавляются.\n"
+            "Число сообщений и ответов, даты первого и последнего сообщения есть в отчете всегда.")
+    return text, kb
+
+
+@check_is_admin
+async def show_activity_menu(c: types.CallbackQuery):
+    text, kb = await get_activity_menu_content()
+    await c.message.edit_text(text, reply_markup=kb)
+    await c.answer()
+
+
+@check_is_admin
+async def set_min_messages(c: types.CallbackQuery):
+    value = int(c.data[len("set_minmsg_"):])
+    await settings_mgr.set_min_messages(value)
+    await c.answer(f"Порог: от {value} сообщений" if value else "Порог отключен")
+    text, kb = await get_activity_menu_content()
+    await c.message.edit_text(text, reply_markup=kb)
+
+
+@check_is_admin
+async def toggle_activity_sort(c: types.CallbackQuery):
+    new_status = await settings_mgr.toggle_activity_sort()
+    await c.answer(f"Сортировка по активности: {'Включена' if new_status else 'Отключена'}")
+    text, kb = await get_activity_menu_content()
+    await c.message.edit_text(text, reply_markup=kb)
+
+
 def register_handlers(dp: Dispatcher):
     dp.callback_query.register(show_settings_menu, Text("m_settings"))
     dp.callback_query.register(start_set_invite_channel, Text("set_invite_channel"))
     dp.message.register(process_invite_channel, InviteSettingsStates.channel)
     dp.callback_query.register(toggle_auto_invite, Text("toggle_auto_invite"))
+    dp.callback_query.register(toggle_incremental, Text("toggle_incremental"))
+    dp.callback_query.register(toggle_only_new, Text("toggle_only_new"))
+    dp.callback_query.register(show_report_format_menu, Text("report_format_menu"))
+    dp.callback_query.register(set_report_format, Text(startswith="set_rfmt_"))
+    dp.callback_query.register(show_activity_menu, Text("activity_menu"))
+    dp.callback_query.register(set_min_messages, Text(startswith="set_minmsg_"))
+    dp.callback_query.register(toggle_activity_sort, Text("toggle_activity_sort"))
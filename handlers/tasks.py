@@ -0,0 +1,105 @@
+import html
+import logging
+
+from aiogram import types, Dispatcher
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.filters.text import Text
+from aiogram.fsm.context import FSMContext
+from typing import Tuple
+
+from models import check_is_admin
+from services.task_registry import task_registry, PHASE_TITLES
+from services.task_runner import task_runner
+
+logger = logging.getLogger(__name__)
+
+
+async def get_tasks_menu_content() -> Tuple[str, InlineKeyboardMarkup]:
+    """
+    Список задач строится только из реестра в памяти, без обращений к Telegram.
+    """
+    active = task_registry.active()
+    running = [p for p in active if p.task.phase not in ("queued", "paused")]
+    queued = [p for p in active if p.task.phase == "queued"]
+    paused = [p for p in active if p.task.phase == "paused"]
+    finished = task_registry.finished()
+
+    text = "<b>📋 Список задач</b>\n"
+    text += f"Выполняется: {len(running)}, в очереди: {len(queued)}, на паузе: {len(paused)}\n"
+    kb_rows = []
+
+    if running:
+        text += "\n<b>Активные:</b>\n"
+        text += "\n\n".join(task_registry.render(p) for p in running) + "\n"
+    if queued:
+        text += "\n<b>В очереди:</b>\n"
+        for p in queued:
+            text += f"• <code>{p.task.id}</code> — <code>{html.escape(p.task.target_chat)}</code>\n"
+    if paused:
+        text += "\n<b>На паузе:</b>\n"
+        for p in paused:
+            text += (f"• <code>{p.task.id}</code> — <code>{html.escape(p.task.target_chat)}</code>, "
+                     f"собрано {len(p.task.collected_users)}\n")
+    if finished:
+        text += "\n<b>Завершенные:</b>\n"
+        for p in finished:
+            task = p.task
+            text += (f"• <code>{task.id}</code> — {PHASE_TITLES.get(task.phase, task.phase)}, "
+                     f"собрано {len(task.collected_users)}, приглашено {len(task.invited_users)}\n")
+    if not (active or finished):
+        text += "\nЗадач пока нет."
+
+    for p in running + queued:
+        kb_rows.append([
+            InlineKeyboardButton(text=f"⏸ Пауза {p.task.id}", callback_data=f"task_pause_{p.task.id}"),
+            InlineKeyboardButton(text=f"🛑 Отмена {p.task.id}", callback_data=f"task_cancel_{p.task.id}")
+        ])
+    for p in paused:
+        kb_rows.append([
+            InlineKeyboardButton(text=f"▶️ Продолжить {p.task.id}", callback_data=f"task_resume_{p.task.id}"),
+            InlineKeyboardButton(text=f"🛑 Отмена {p.task.id}", callback_data=f"task_cancel_{p.task.id}")
+        ])
+    kb_rows.append([InlineKeyboardButton(text="🔄 Обновить", callback_data="m_tasks")])
+    kb_rows.append([InlineKeyboardButton(text="◀️ Назад в главное меню", callback_data="menu")])
+    return text, InlineKeyboardMarkup(inline_keyboard=kb_rows)
+
+
+async def _refresh_tasks_menu(c: types.CallbackQuery):
+    text, kb = await get_tasks_menu_content()
+    try:
+        await c.message.edit_text(text, reply_markup=kb, parse_mode='HTML')
+    except TelegramBadRequest as e:
+        # "message is not modified": нажали "Обновить", а содержимое не изменилось
+        if "message is not modified" not in str(e):
+            logger.error(f"Не удалось обновить список задач: {e}")
+
+
+@check_is_admin
+async def show_tasks_menu(c: types.CallbackQuery, state: FSMContext):
+    await state.clear()
+    await _refresh_tasks_menu(c)
+    await c.answer()
+
+
+@check_is_admin
+async def control_task(c: types.CallbackQuery):
+    _, action, task_id = c.data.split("_", 2)
+    if action == "pause":
+        ok = await task_runner.pause(task_id)
+        answer = "Задача будет приостановлена." if ok else "Эту задачу нельзя приостановить."
+    elif action == "resume":
+        position = await task_runner.resume(task_id)
+        answer = f"Задача возвращена в очередь, позиция {position}." if position else "Не удалось продолжить задачу."
+    elif action == "cancel":
+        ok = await task_runner.cancel(task_id)
+        answer = "Задача будет отменена, отчет придет по уже собранным данным." if ok else "Задача не найдена."
+    else:
+        answer = "Неизвестное действие."
+    await c.answer(answer)
+    await _refresh_tasks_menu(c)
+
+
+def register_handlers(dp: Dispatcher):
+    dp.callback_query.register(show_tasks_menu, Text("m_tasks"))
+    dp.callback_query.register(control_task, Text(startswith="task_"))
@@ -1,12 +1,71 @@
 import logging
 import asyncio
+import signal
 
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
+# Первым импортом: отсчёт времени запуска должен включать импорт aiogram, telethon и обработчиков.
+from services.startup_profile import startup_profile
+
+from aiogram import Dispatcher
 from aiogram.fsm.storage.redis import RedisStorage
 
 import config
-from handlers import accounts, invitations, scraping, settings
+from handlers import accounts, invitations, scraping, settings, tasks
+from services.task_runner import task_runner
+from services.account_manager import account_mgr
+from services.history_store import history_store
+from services.entity_cache import entity_cache
+from services import metrics
+from services.metrics import metrics_server
+from services.notifier import notifier
+from services.settings_manager import settings_mgr
+from services.state_store import state_store
+from services.webhook_server import webhook_server
+from services.report_generator import shutdown_report_pool
+
+
+async def track_first_update(handler, event, data):
+    """Внешний middleware апдейтов: фиксирует время до первого обработанного апдейта после запуска."""
+    if startup_profile.first_update():
+        metrics.startup_seconds.set(startup_profile.first_update_at - startup_profile.started_at, stage="first_update")
+    return await handler(event, data)
+
+
+async def bootstrap(redis_url: str) -> Dispatcher:
+    """
+    Подготавливает всё, что нужно до первого апдейта. Независимые этапы идут параллельно,
+    openpyxl и пул процессов отчетов создаются позже — при первом отчете.
+    """
+    logger = logging.getLogger(__name__)
+
+    with startup_profile.stage("storage"):
+        await state_store.migrate_from_json()
+        await asyncio.gather(account_mgr.load(), settings_mgr.load())
+
+    with startup_profile.stage("dispatcher"):
+        storage = RedisStorage.from_url(redis_url)
+        dp = Dispatcher(storage=storage)
+        dp.update.outer_middleware(track_first_update)
+        accounts.register_handlers(dp)
+        invitations.register_handlers(dp)
+        scraping.register_handlers(dp)
+        settings.register_handlers(dp)
+        tasks.register_handlers(dp)
+        logger.info("Dispatcher initialized, handlers registered.")
+
+    with startup_profile.stage("services"):
+        if config.METRICS_ENABLED:
+            await metrics_server.start()
+        account_mgr.start_auth_prober()
+    return dp
+
+
+async def wait_for_stop_signal():
+    """В режиме вебхука нет цикла polling, который сам обрабатывает SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
 
 
 async def main():
@@ -16,25 +75,45 @@ async def main():
         handlers=[logging.FileHandler("bot.log", encoding='utf-8'), logging.StreamHandler()]
     )
     logger = logging.getLogger(__name__)
+    startup_profile.mark("imports")
     logger.info("Starting bot initialization...")
 
     redis_url = f"redis://{config.REDIS_HOST}:{config.REDIS_PORT}/{config.REDIS_DB}"
-    storage = RedisStorage.from_url(redis_url)
-    logger.info(f"Redis storage connected to {redis_url}")
-
-    bot = Bot(token=config.BOT_TOKEN, parse_mode=ParseMode.HTML)
-    dp = Dispatcher(storage=storage)
-    logger.info("Bot and Dispatcher initialized.")
-
-    logger.info("Registering handlers...")
-    accounts.register_handlers(dp)
-    invitations.register_handlers(dp)
-    scraping.register_handlers(dp)
-    settings.register_handlers(dp)
-    logger.info("Handlers registered.")
-
-    logger.info("Bot started polling...")
-    await dp.start_polling(bot)
+    dp = await bootstrap(redis_url)
+
+    with startup_profile.stage("task_queue"):
+        await task_runner.start(redis_url)
+
+    webhook = config.BOT_MODE == "webhook"
+    if webhook:
+        with startup_profile.stage("webhook"):
+            await webhook_server.start(dp, notifier.bot)
+
+    startup_profile.ready()
+    for stage, seconds in startup_profile.stages:
+        metrics.startup_seconds.set(seconds, stage=stage)
+
+    try:
+        if webhook:
+            logger.info("Bot is receiving updates via webhook...")
+            await wait_for_stop_signal()
+        else:
+            # Вебхук, оставшийся от запуска в режиме webhook, блокирует getUpdates
+            await notifier.bot.delete_webhook()
+            logger.info("Bot started polling...")
+            # Сессию бота закрывает notifier, после отправки уведомлений остановленных задач
+            await dp.start_polling(notifier.bot, close_bot_session=False)
+    finally:
+        await webhook_server.stop()
+        await task_runner.stop()
+        await notifier.close()
+        await account_mgr.stop_auth_prober()
+        await account_mgr.pool.close_all()
+        await history_store.close()
+        await entity_cache.close()
+        await metrics_server.stop()
+        await state_store.close()
+        shutdown_report_pool()
 
 
 if __name__ == "__main__":
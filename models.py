@@ -1,11 +1,15 @@
 import re
+import sys
 import uuid
 import time
 import config
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 from aiogram.fsm.state import State, StatesGroup
-from typing import Optional, List
+from typing import Optional, List, Dict, Iterable, Iterator, Sequence, Set, Tuple
 from aiogram import types
+from array import array
 from dataclasses import dataclass, field
 from telethon import TelegramClient, types as telethon_types, errors as telethon_errors
 import asyncio
@@ -30,11 +34,13 @@ class ScrapingStates(StatesGroup):
     step2 = State()
     step3 = State()
     step4 = State()
+    step5 = State()
+    step6 = State()
 
 class SeparateInviteStates(StatesGroup):
     user_limit = State()
 
-@dataclass
+@dataclass(slots=True)
 class UserStub:
     user_id: int
     username: Optional[str] = None
@@ -42,6 +48,235 @@ class UserStub:
     last_name: Optional[str] = None
     phone: Optional[str] = None
 
+# Флаги строки в UserTable
+COLLECTED = 1
+INVITED = 2
+ALREADY_PARTICIPANT = 4
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else value
+
+class UserTable:
+    """
+    Колоночное хранилище пользователей задачи: id в array('q'), строковые колонки
+    с интернированием, статусы — битовые флаги. Каждый пользователь хранится
+    ровно в одной строке, сколько бы списков задачи на него ни ссылалось.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.usernames: List[Optional[str]] = []
+        self.first_names: List[Optional[str]] = []
+        self.last_names: List[Optional[str]] = []
+        self.phones: List[Optional[str]] = []
+        self.flags = bytearray()
+        self._index: Dict[int, int] = {}
+        self._counts: Dict[int, int] = {COLLECTED: 0, INVITED: 0, ALREADY_PARTICIPANT: 0}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row_of(self, user_id: int) -> Optional[int]:
+        return self._index.get(user_id)
+
+    def has_flag(self, user_id: int, flag: int) -> bool:
+        row = self._index.get(user_id)
+        return row is not None and bool(self.flags[row] & flag)
+
+    def mark(self, user: UserStub, flag: int) -> bool:
+        """Добавляет пользователя (если его ещё нет) и ставит флаг. False — флаг уже стоял."""
+        row = self._index.get(user.user_id)
+        if row is None:
+            row = len(self.ids)
+            self._index[user.user_id] = row
+            self.ids.append(user.user_id)
+            self.usernames.append(_intern(user.username))
+            self.first_names.append(_intern(user.first_name))
+            self.last_names.append(_intern(user.last_name))
+            self.phones.append(user.phone)
+            self.flags.append(0)
+        elif self.flags[row] & flag:
+            return False
+        self.flags[row] |= flag
+        self._counts[flag] += 1
+        return True
+
+    def unmark(self, user_id: int, flag: int) -> bool:
+        """Снимает флаг; строка остаётся в таблице. False — флага не было."""
+        row = self._index.get(user_id)
+        if row is None or not self.flags[row] & flag:
+            return False
+        self.flags[row] &= ~flag
+        self._counts[flag] -= 1
+        return True
+
+    def count(self, flag: int) -> int:
+        return self._counts[flag]
+
+    def stub(self, row: int) -> UserStub:
+        return UserStub(self.ids[row], self.usernames[row], self.first_names[row],
+                        self.last_names[row], self.phones[row])
+
+    def rows(self, flag: int) -> Iterator[int]:
+        flags = self.flags
+        return (row for row in range(len(flags)) if flags[row] & flag)
+
+    def to_records(self) -> List[list]:
+        """Строки таблицы в порядке добавления, для сохранения в чекпоинт задачи."""
+        return [[self.ids[row], self.usernames[row], self.first_names[row], self.last_names[row],
+                 self.phones[row], self.flags[row]] for row in range(len(self.ids))]
+
+    @classmethod
+    def from_records(cls, records: Iterable[list]) -> "UserTable":
+        table = cls()
+        for user_id, username, first_name, last_name, phone, flags in records:
+            user = UserStub(user_id, username, first_name, last_name, phone)
+            for flag in (COLLECTED, INVITED, ALREADY_PARTICIPANT):
+                if flags & flag:
+                    table.mark(user, flag)
+        return table
+
+class UserCollection:
+    """
+    Представление UserTable по одному флагу (собранные, приглашённые, уже участники).
+    Проверка наличия, добавление и поиск выполняются за O(1), данные пользователя не копируются.
+    """
+
+    def __init__(self, table: Optional[UserTable] = None, flag: int = COLLECTED,
+                 users: Optional[Iterable[UserStub]] = None):
+        self.table = table if table is not None else UserTable()
+        self.flag = flag
+        if users:
+            for user in users:
+                self.add(user)
+
+    def add(self, user: UserStub) -> bool:
+        return self.table.mark(user, self.flag)
+
+    def append(self, user: UserStub):
+        self.add(user)
+
+    def discard(self, user_id: int) -> bool:
+        return self.table.unmark(user_id, self.flag)
+
+    def get(self, user_id: int) -> Optional[UserStub]:
+        row = self.table.row_of(user_id)
+        if row is None or not self.table.flags[row] & self.flag:
+            return None
+        return self.table.stub(row)
+
+    def ids(self) -> Iterator[int]:
+        return (self.table.ids[row] for row in self.table.rows(self.flag))
+
+    def __contains__(self, item) -> bool:
+        if isinstance(item, UserStub):
+            item = item.user_id
+        return self.table.has_flag(item, self.flag)
+
+    def __len__(self) -> int:
+        return self.table.count(self.flag)
+
+    def __iter__(self) -> Iterator[UserStub]:
+        return (self.table.stub(row) for row in self.table.rows(self.flag))
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __repr__(self):
+        return f"UserCollection({len(self)} users)"
+
+class UserActivity:
+    """
+    Активность отправителей в просмотренных сообщениях: число сообщений, число ответов,
+    даты первого и последнего сообщения (unix-время). Колонки в array, сами сообщения не хранятся.
+    Страница истории учитывается пачкой: подсчёт по отправителям идёт в Counter и dict,
+    а колонки обновляются один раз на каждого отправителя страницы.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.messages = array('q')
+        self.replies = array('q')
+        self.first_dates = array('q')
+        self.last_dates = array('q')
+        self._index: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row_of(self, user_id: int) -> Optional[int]:
+        return self._index.get(user_id)
+
+    def add_messages(self, messages: Sequence):
+        """Учитывает сообщения одной страницы истории (от новых к старым); служебные сообщения пропускаются."""
+        messages = [m for m in messages if not isinstance(m, telethon_types.MessageService)]
+        senders = [from_id.user_id if isinstance(from_id, telethon_types.PeerUser) else None
+                   for from_id in (m.from_id for m in messages)]
+        counts = Counter(senders)
+        counts.pop(None, None)
+        if not counts:
+            return
+        replies = Counter(sender for sender, m in zip(senders, messages) if m.reply_to is not None)
+        # При повторах ключа dict оставляет последнее значение: в прямом порядке это самое старое
+        # сообщение отправителя, в обратном — самое новое.
+        oldest = dict(zip(senders, messages))
+        newest = dict(zip(reversed(senders), reversed(messages)))
+        for sender, count in counts.items():
+            first, last = oldest[sender], newest[sender]
+            first_date = int(first.date.timestamp())
+            last_date = first_date if last is first else int(last.date.timestamp())
+            self._merge(sender, count, replies[sender], first_date, last_date)
+
+    def merge(self, other: "UserActivity"):
+        """Добавляет активность, посчитанную отдельно (например, шардом истории)."""
+        for row, user_id in enumerate(other.ids):
+            self._merge(user_id, other.messages[row], other.replies[row], other.first_dates[row],
+                        other.last_dates[row])
+
+    def _merge(self, user_id: int, messages: int, replies: int, first_date: int, last_date: int):
+        row = self._index.get(user_id)
+        if row is None:
+            self._index[user_id] = len(self.ids)
+            self.ids.append(user_id)
+            self.messages.append(messages)
+            self.replies.append(replies)
+            self.first_dates.append(first_date)
+            self.last_dates.append(last_date)
+            return
+        self.messages[row] += messages
+        self.replies[row] += replies
+        if first_date < self.first_dates[row]:
+            self.first_dates[row] = first_date
+        if last_date > self.last_dates[row]:
+            self.last_dates[row] = last_date
+
+    def to_records(self) -> List[list]:
+        return [[self.ids[row], self.messages[row], self.replies[row], self.first_dates[row], self.last_dates[row]]
+                for row in range(len(self.ids))]
+
+    @classmethod
+    def from_records(cls, records: Iterable[list]) -> "UserActivity":
+        activity = cls()
+        for user_id, messages, replies, first_date, last_date in records:
+            activity._merge(user_id, messages, replies, first_date, last_date)
+        return activity
+
+@dataclass
+class ShardStat:
+    index: int
+    account_phone: Optional[str]
+    min_id: int
+    max_id: int
+    messages: int = 0
+    users: int = 0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def duration(self) -> float:
+        if self.started_at and self.finished_at:
+            return self.finished_at - self.started_at
+        return 0.0
+
 @dataclass
 class Task:
     id: str = field(default_factory=lambda: str(uuid.uuid4())[:8])
@@ -54,22 +289,92 @@ class Task:
     invite_enabled: bool = False
     account_phone: Optional[str] = None
     status: str = "pending"
+    phase: str = "queued"
+    resume_phase: Optional[str] = None
+    control: Optional[str] = None  # "pause" / "cancel", запрошенные админом
+    enqueued_at: Optional[float] = None
     created_at: float = field(default_factory=time.monotonic)
     started_at: Optional[float] = None
     finished_at: Optional[float] = None
-    collected_users: List[UserStub] = field(default_factory=list)
-    invited_users: List[UserStub] = field(default_factory=list)
+    users: UserTable = field(default_factory=UserTable, repr=False)
+    activity: UserActivity = field(default_factory=UserActivity, repr=False)
+    collected_users: UserCollection = field(init=False)
+    invited_users: UserCollection = field(init=False)
+    messages_scanned: int = 0
+    invites_processed: int = 0
     failed_privacy: int = 0
     already_participants: int = 0
     failed_other: int = 0
     invite_status: Optional[str] = None
-    already_participants_list: List[UserStub] = field(default_factory=list)
+    already_participants_list: UserCollection = field(init=False)
+    report_format: str = "xlsx"
+    incremental: bool = False
+    only_new: bool = False  # пропускать пользователей, уже попадавших в отчеты прошлых задач
+    # Сбор из истории: остаются только отправители с не меньше чем min_messages сообщений
+    # (below_min_messages — сколько отсеяно); отчет можно отсортировать по активности
+    min_messages: int = 0
+    below_min_messages: int = 0
+    sort_by_activity: bool = False
+    # Окно дат сообщений, unix-время UTC; date_to не входит в окно
+    date_from: Optional[int] = None
+    date_to: Optional[int] = None
+    skipped_seen: Set[int] = field(default_factory=set, repr=False)
+    shard_stats: List[ShardStat] = field(default_factory=list)
+    # Курсоры для продолжения после перезапуска
+    history_offset_id: int = 0
+    history_top_id: int = 0
+    participants_offset: int = 0
+
+    PERSISTED_FIELDS = ("id", "admin_id", "target_chat", "message_limit", "user_limit", "invite_enabled",
+                        "report_format", "incremental", "only_new", "date_from", "date_to", "min_messages",
+                        "sort_by_activity", "enqueued_at")
+    CHECKPOINT_FIELDS = ("status", "chat_id", "chat_title", "account_phone", "messages_scanned", "invites_processed",
+                         "failed_privacy", "already_participants", "failed_other", "invite_status",
+                         "history_offset_id", "history_top_id", "participants_offset", "below_min_messages")
+
+    def __post_init__(self):
+        self.collected_users = UserCollection(self.users, COLLECTED)
+        self.invited_users = UserCollection(self.users, INVITED)
+        self.already_participants_list = UserCollection(self.users, ALREADY_PARTICIPANT)
+
+    @property
+    def has_date_window(self) -> bool:
+        return self.date_from is not None or self.date_to is not None
+
+    def date_window_label(self) -> str:
+        """Окно дат для людей: включительные дни, как их вводят в мастере."""
+        start = format_day(self.date_from) if self.date_from is not None else "…"
+        end = format_day(self.date_to - 1) if self.date_to is not None else "сейчас"
+        return f"{start} – {end}"
 
     def duration(self) -> float:
         if self.started_at and self.finished_at:
             return self.finished_at - self.started_at
         return 0.0
 
+    def to_dict(self, checkpoint: bool = False) -> dict:
+        """
+        Параметры задачи для очереди. С checkpoint=True добавляются прогресс, курсоры,
+        фаза и собранные пользователи — этого достаточно, чтобы продолжить задачу после перезапуска.
+        """
+        data = {name: getattr(self, name) for name in self.PERSISTED_FIELDS}
+        if checkpoint:
+            data.update({name: getattr(self, name) for name in self.CHECKPOINT_FIELDS})
+            data["phase"] = self.resume_phase or self.phase
+            data["users"] = self.users.to_records()
+            data["activity"] = self.activity.to_records()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Task":
+        fields = cls.PERSISTED_FIELDS + cls.CHECKPOINT_FIELDS
+        task = cls(**{name: data[name] for name in fields if name in data},
+                   users=UserTable.from_records(data.get("users", ())),
+                   activity=UserActivity.from_records(data.get("activity", ())))
+        if data.get("phase") not in (None, "queued", "starting", "paused"):
+            task.resume_phase = data["phase"]
+        return task
+
 def validate_phone_number(phone: str) -> bool:
     return re.fullmatch(r'^\+\d{10,15}$', phone) is not None
 
@@ -79,10 +384,12 @@ def validate_api_id(api_id: str) -> bool:
 def validate_api_hash(api_hash: str) -> bool:
     return re.fullmatch(r'^[0-9a-fA-F]{32}$', api_hash) is not None
 
-async def validate_target(target: str, client: TelegramClient) -> bool:
+async def validate_target(target: str, client: TelegramClient, account: str) -> bool:
+    # Импорт здесь: services.entity_cache сам импортирует models.
+    from services.entity_cache import entity_cache
     try:
-        entity = await client.get_entity(target)
-        return isinstance(entity, (telethon_types.Channel, telethon_types.Chat))
+        resolved = await entity_cache.resolve(client, account, target)
+        return resolved.peer_type in ("channel", "chat")
     except (ValueError, telethon_errors.rpcerrorlist.UsernameNotOccupiedError,
             telethon_errors.rpcerrorlist.ChannelInvalidError,
             telethon_errors.rpcerrorlist.ChatIdInvalidError,
@@ -91,6 +398,26 @@ async def validate_target(target: str, client: TelegramClient) -> bool:
     except Exception:
         return False
 
+def format_day(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%d.%m.%Y")
+
+def parse_date_range(text: str) -> Optional[Tuple[int, int]]:
+    """
+    "ДД.ММ.ГГГГ" или "ДД.ММ.ГГГГ-ДД.ММ.ГГГГ" (дни по UTC, включительно) →
+    (начало, конец) в unix-секундах, конец не входит в окно. None — неверный ввод.
+    """
+    parts = [part.strip() for part in text.split("-")]
+    if len(parts) > 2:
+        return None
+    try:
+        days = [datetime.strptime(part, "%d.%m.%Y").replace(tzinfo=timezone.utc) for part in parts]
+    except ValueError:
+        return None
+    start, end = days[0], days[-1] + timedelta(days=1)
+    if end <= start:
+        return None
+    return int(start.timestamp()), int(end.timestamp())
+
 def validate_positive_int(value: str, maximum: Optional[int] = None) -> bool:
     if not value.isdigit():
         return False
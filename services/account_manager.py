@@ -1,8 +1,8 @@
-import os
-import json
+import time
 import asyncio
 import logging
-from typing import Callable, Any, Optional, Union
+from collections import defaultdict
+from typing import Callable, Any, Optional, Union, Tuple
 
 import config
 from telethon import TelegramClient
@@ -11,9 +11,16 @@ from telethon.tl.types import User
 from aiogram import Bot
 from aiogram.fsm.context import FSMContext
 
+from services.request_layer import request_layer
+from services.state_store import state_store
+
 logger = logging.getLogger(__name__)
 
 
+class AccountNotAuthorizedError(RuntimeError):
+    pass
+
+
 class Account:
     def __init__(
             self,
@@ -36,6 +43,8 @@ class Account:
         self.last_name = last_name
         self.is_busy = False
         self.lock = asyncio.Lock()
+        self.auth_status: Optional[bool] = None
+        self.auth_checked_at: float = 0.0
 
     def __repr__(self):
         return (f"Account(phone='{self.phone}', user_id={self.user_id}, "
@@ -43,87 +52,195 @@ class Account:
                 f"is_busy={self.is_busy})")
 
     def client(self) -> TelegramClient:
+        # flood_sleep_threshold=0: telethon не спит на FloodWait сам, каждый FloodWait
+        # получает request_layer и решает, ждать или отправить аккаунт на паузу
         if self.session_string:
-            return TelegramClient(StringSession(self.session_string), self.api_id, self.api_hash)
+            return TelegramClient(StringSession(self.session_string), self.api_id, self.api_hash,
+                                  flood_sleep_threshold=0)
         else:
             logger.warning(
                 f"Creating TelegramClient for {self.phone} without session_string. Authorization will be required.")
-            return TelegramClient(None, self.api_id, self.api_hash)
+            return TelegramClient(None, self.api_id, self.api_hash, flood_sleep_threshold=0)
+
+
+
+class ClientPool:
+    """
+    Пул подключенных TelegramClient: по одному долгоживущему соединению на аккаунт.
+    Клиенты выдаются в аренду (lease) и возвращаются (give_back) без отключения,
+    периодически проверяются и закрываются после простоя.
+    """
+
+    def __init__(self,
+                 idle_timeout: float = config.CLIENT_IDLE_TIMEOUT_SEC,
+                 health_check_interval: float = config.CLIENT_HEALTH_CHECK_SEC):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._clients: dict[str, TelegramClient] = {}
+        self._last_used: dict[str, float] = {}
+        self._last_checked: dict[str, float] = {}
+        self._leased: set[str] = set()
+        self._locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def get(self, account: Account) -> TelegramClient:
+        """Возвращает подключенный клиент аккаунта, не помечая его арендованным."""
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+        async with self._locks[account.phone]:
+            client = self._clients.get(account.phone)
+            if client is not None and not await self._is_healthy(account, client):
+                await self._close(account.phone)
+                client = None
+
+            if client is None:
+                client = account.client()
+                await client.connect()
+                if not await client.is_user_authorized():
+                    await client.disconnect()
+                    raise AccountNotAuthorizedError(
+                        f"Аккаунт {account.phone} не авторизован или сессия недействительна.")
+                self._clients[account.phone] = client
+                self._last_checked[account.phone] = time.monotonic()
+                logger.debug(f"Opened pooled client for {account.phone}.")
+
+            self._last_used[account.phone] = time.monotonic()
+            return client
+
+    async def probe(self, account: Account, connect: bool = False) -> Optional[bool]:
+        """
+        Проверяет авторизацию через уже открытый клиент, не продлевая его простой.
+        Если клиента в пуле нет и connect=True, проверка идет через временное соединение,
+        которое в пул не попадает и сразу закрывается.
+        None — клиент арендован, его нет (при connect=False) или проверка не удалась.
+        """
+        async with self._locks[account.phone]:
+            if account.phone in self._leased:
+                return None
+            client = self._clients.get(account.phone)
+            if client is None or not client.is_connected():
+                return await self._probe_detached(account) if connect else None
+            try:
+                is_auth = await asyncio.wait_for(client.is_user_authorized(), timeout=10)
+            except Exception as e:
+                logger.warning(f"Фоновая проверка авторизации {account.phone} не удалась: {e}")
+                return None
+            self._last_checked[account.phone] = time.monotonic()
+            return is_auth
+
+    async def _probe_detached(self, account: Account) -> Optional[bool]:
+        client = account.client()
+        try:
+            await asyncio.wait_for(client.connect(), timeout=10)
+            return await asyncio.wait_for(client.is_user_authorized(), timeout=10)
+        except Exception as e:
+            logger.warning(f"Фоновая проверка авторизации {account.phone} не удалась: {e}")
+            return None
+        finally:
+            await client.disconnect()
+
+    async def lease(self, account: Account) -> TelegramClient:
+        client = await self.get(account)
+        self._leased.add(account.phone)
+        return client
 
-    async def is_authorized(self) -> bool:
-        if not self.session_string:
-            logger.debug(f"Account {self.phone} is not authorized: no session_string.")
+    def give_back(self, account: Account):
+        self._leased.discard(account.phone)
+        self._last_used[account.phone] = time.monotonic()
+
+    async def discard(self, phone: str):
+        async with self._locks[phone]:
+            self._leased.discard(phone)
+            await self._close(phone)
+
+    async def close_all(self):
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        for phone in list(self._clients):
+            await self._close(phone)
+
+    async def _is_healthy(self, account: Account, client: TelegramClient) -> bool:
+        if not client.is_connected():
             return False
-        client = self.client()
+        if time.monotonic() - self._last_checked.get(account.phone, 0) < self.health_check_interval:
+            return True
         try:
-            await client.connect()
-            is_auth = await client.is_user_authorized()
-            logger.debug(f"Account {self.phone} authorization status: {is_auth}")
-            return is_auth
+            healthy = await asyncio.wait_for(client.is_user_authorized(), timeout=10)
         except Exception as e:
-            logger.warning(f"Ошибка проверки авторизации для {self.phone}: {e}")
+            logger.warning(f"Проверка соединения {account.phone} не пройдена: {e}")
             return False
-        finally:
-            if client and client.is_connected():
+        self._last_checked[account.phone] = time.monotonic()
+        return healthy
+
+    async def _close(self, phone: str):
+        client = self._clients.pop(phone, None)
+        self._last_used.pop(phone, None)
+        self._last_checked.pop(phone, None)
+        if client and client.is_connected():
+            try:
                 await client.disconnect()
+            except Exception as e:
+                logger.warning(f"Ошибка при отключении клиента {phone}: {e}")
+            logger.debug(f"Closed pooled client for {phone}.")
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 60))
+            now = time.monotonic()
+            for phone, last_used in list(self._last_used.items()):
+                if phone not in self._leased and now - last_used > self.idle_timeout:
+                    async with self._locks[phone]:
+                        if phone not in self._leased:
+                            logger.info(f"Closing idle client for {phone}.")
+                            await self._close(phone)
 
 
 class AccountManager:
     def __init__(self):
         self.accounts: list[Account] = []
-        self._load()
+        self.pool = ClientPool()
+        self._auth_prober: Optional[asyncio.Task] = None
 
-    def _load(self):
-        if os.path.exists(config.ACCOUNTS_FILE):
-            try:
-                with open(config.ACCOUNTS_FILE, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    self.accounts = []
-                    for acc_data in data:
-                        logger.debug(f"Attempting to load account data: {acc_data}")
-                        if "session_string" not in acc_data or not acc_data.get("session_string"):
-                            logger.warning(
-                                f"Loaded account data for {acc_data.get('phone', 'unknown')} has no valid session_string.")
-                        self.accounts.append(Account(
-                            phone=acc_data["phone"],
-                            api_id=acc_data["api_id"],
-                            api_hash=acc_data["api_hash"],
-                            session_string=acc_data.get("session_string"),
-                            user_id=acc_data.get("user_id"),
-                            username=acc_data.get("username"),
-                            first_name=acc_data.get("first_name"),
-                            last_name=acc_data.get("last_name")
-                        ))
-                logger.info(f"Загружено {len(self.accounts)} аккаунтов.")
-                if self.accounts:
-                    logger.debug(f"Loaded accounts list: {self.accounts}")
-            except json.JSONDecodeError as e:
-                logger.error(
-                    f"Ошибка загрузки аккаунтов (JSONDecodeError): {e}. Файл accounts.json может быть поврежден. Создаю новый пустой список аккаунтов.")
-                self.accounts = []
-            except Exception as e:
-                logger.error(f"Неизвестная ошибка при загрузке аккаунтов: {e}")
-                self.accounts = []
+    async def load(self):
+        """Загружает аккаунты из хранилища (вызывается при старте бота, после миграции JSON)."""
+        try:
+            rows = await state_store.load_accounts()
+        except Exception as e:
+            logger.error(f"Неизвестная ошибка при загрузке аккаунтов: {e}")
+            rows = []
+        self.accounts = []
+        for acc_data in rows:
+            if not acc_data.get("session_string"):
+                logger.warning(
+                    f"Loaded account data for {acc_data.get('phone', 'unknown')} has no valid session_string.")
+            self.accounts.append(Account(**acc_data))
+        logger.info(f"Загружено {len(self.accounts)} аккаунтов.")
+        if self.accounts:
+            logger.debug(f"Loaded accounts list: {self.accounts}")
 
-    def _save(self):
+    async def _save_account(self, account: Account):
         try:
-            with open(config.ACCOUNTS_FILE, "w", encoding="utf-8") as f:
-                json.dump([
-                    {
-                        "phone": a.phone,
-                        "api_id": a.api_id,
-                        "api_hash": a.api_hash,
-                        "session_string": a.session_string,
-                        "user_id": a.user_id,
-                        "username": a.username,
-                        "first_name": a.first_name,
-                        "last_name": a.last_name
-                    }
-                    for a in self.accounts
-                ], f, indent=4, ensure_ascii=False)
-            logger.info(f"Saved {len(self.accounts)} accounts to {config.ACCOUNTS_FILE}")
+            await state_store.save_account({
+                "phone": account.phone,
+                "api_id": account.api_id,
+                "api_hash": account.api_hash,
+                "session_string": account.session_string,
+                "user_id": account.user_id,
+                "username": account.username,
+                "first_name": account.first_name,
+                "last_name": account.last_name
+            })
+            logger.info(f"Saved account {account.phone}")
         except Exception as e:
-            logger.error(f"Ошибка сохранения аккаунтов: {e}")
+            logger.error(f"Ошибка сохранения аккаунта {account.phone}: {e}")
+
+    async def _delete_account(self, phone: str):
+        try:
+            await state_store.delete_account(phone)
+        except Exception as e:
+            logger.error(f"Ошибка удаления аккаунта {phone} из хранилища: {e}")
 
     async def add_account(
             self,
@@ -138,12 +255,13 @@ class AccountManager:
     ) -> Account:
         for acc in self.accounts:
             if acc.phone == phone:
-                if await acc.is_authorized():
+                if await self.is_authorized(acc):
                     raise ValueError(f"Аккаунт {phone} уже добавлен и авторизован.")
                 else:
                     logger.warning(f"Аккаунт {phone} существует, но не авторизован. Попробуем переавторизовать.")
                     self.accounts.remove(acc)
-                    self._save()
+                    await self.pool.discard(phone)
+                    await self._delete_account(phone)
                     break
 
         client = TelegramClient(StringSession(), api_id, api_hash)
@@ -173,7 +291,7 @@ class AccountManager:
                 last_name=me.last_name
             )
             self.accounts.append(a)
-            self._save()
+            await self._save_account(a)
             logger.info(f"Account {phone} successfully added and saved.")
             return a
         except Exception as e:
@@ -183,50 +301,127 @@ class AccountManager:
             if client and client.is_connected():
                 await client.disconnect()
 
-    def delete(self, idx: int):
+    async def delete(self, idx: int):
         if 0 <= idx < len(self.accounts):
             phone_to_delete = self.accounts[idx].phone
             del self.accounts[idx]
-            self._save()
+            await self._delete_account(phone_to_delete)
+            await self.pool.discard(phone_to_delete)
+            request_layer.forget(phone_to_delete)
             logger.info(f"Account {phone_to_delete} deleted.")
         else:
             raise IndexError("Неверный индекс аккаунта.")
 
+    def cached_auth_status(self, account: Account) -> Optional[bool]:
+        """Последний известный статус авторизации без обращения к сети (None — неизвестен)."""
+        if account.is_busy:
+            return True
+        return account.auth_status
+
+    def _set_auth_status(self, account: Account, status: Optional[bool]):
+        account.auth_status = status
+        account.auth_checked_at = time.monotonic()
+
+    async def is_authorized(self, account: Account) -> bool:
+        if not account.session_string:
+            logger.debug(f"Account {account.phone} is not authorized: no session_string.")
+            self._set_auth_status(account, False)
+            return False
+        fresh = time.monotonic() - account.auth_checked_at < config.AUTH_STATUS_TTL_SEC
+        if fresh and account.auth_status is not None:
+            return account.auth_status
+        try:
+            client = await self.pool.get(account)
+            is_auth = await client.is_user_authorized()
+            logger.debug(f"Account {account.phone} authorization status: {is_auth}")
+        except AccountNotAuthorizedError:
+            is_auth = False
+        except Exception as e:
+            logger.warning(f"Ошибка проверки авторизации для {account.phone}: {e}")
+            self._set_auth_status(account, None)
+            return False
+        self._set_auth_status(account, is_auth)
+        return is_auth
+
+    async def invalidate_authorization(self, account: Account):
+        """Вызывается, когда RPC вернул AuthKeyUnregisteredError: сессия больше недействительна."""
+        logger.warning(f"Сессия аккаунта {account.phone} отозвана, помечаю как неавторизованный.")
+        self._set_auth_status(account, False)
+        await self.pool.discard(account.phone)
+
+    async def probe_all(self):
+        """
+        Параллельно обновляет кэш статусов авторизации свободных аккаунтов.
+        Проверка не считается использованием: простаивающие клиенты по-прежнему закрываются.
+        Аккаунты без открытого клиента с неизвестным или устаревшим статусом проверяются
+        через временное соединение, не попадающее в пул.
+        """
+        accounts = [a for a in self.accounts if not a.is_busy and a.session_string]
+        if not accounts:
+            return
+        now = time.monotonic()
+        statuses = await asyncio.gather(*(
+            self.pool.probe(a, connect=a.auth_status is None
+                            or now - a.auth_checked_at >= config.AUTH_STATUS_TTL_SEC)
+            for a in accounts))
+        for account, is_auth in zip(accounts, statuses):
+            if is_auth is not None:
+                self._set_auth_status(account, is_auth)
+
+    def start_auth_prober(self):
+        if self._auth_prober is None or self._auth_prober.done():
+            self._auth_prober = asyncio.create_task(self._probe_loop())
+
+    async def stop_auth_prober(self):
+        if self._auth_prober:
+            self._auth_prober.cancel()
+            await asyncio.gather(self._auth_prober, return_exceptions=True)
+            self._auth_prober = None
+
+    async def _probe_loop(self):
+        while True:
+            try:
+                await self.probe_all()
+            except Exception:
+                logger.exception("Ошибка фоновой проверки авторизации аккаунтов")
+            await asyncio.sleep(config.AUTH_PROBE_INTERVAL_SEC)
+
     async def acquire(self, account: Account) -> TelegramClient:
         async with account.lock:
             if account.is_busy:
                 raise RuntimeError(f"Аккаунт {account.phone} уже занят.")
-            client = account.client()
             try:
-                await client.connect()
-                if not await client.is_user_authorized():
-                    await client.disconnect()
-                    raise RuntimeError(f"Аккаунт {account.phone} не авторизован или сессия недействительна.")
-                account.is_busy = True
-                logger.debug(f"Account {account.phone} acquired.")
-                return client
+                client = await self.pool.lease(account)
+            except AccountNotAuthorizedError:
+                self._set_auth_status(account, False)
+                raise
             except Exception as e:
-                if client and client.is_connected():
-                    await client.disconnect()
                 logger.error(f"Ошибка при получении клиента для аккаунта {account.phone}: {e}")
                 raise RuntimeError(f"Не удалось получить клиента для {account.phone}: {e}")
+            account.is_busy = True
+            self._set_auth_status(account, True)
+            logger.debug(f"Account {account.phone} acquired.")
+            return client
 
     async def release(self, account: Account):
         async with account.lock:
             if account.is_busy:
                 account.is_busy = False
+                self.pool.give_back(account)
                 logger.debug(f"Account {account.phone} released.")
             else:
                 logger.warning(f"Попытка освободить незанятый аккаунт {account.phone}. Возможно, ошибка логики.")
 
-    async def get_free_account(self) -> Optional[Account]:
+    async def acquire_free(self) -> Optional[Tuple[Account, TelegramClient]]:
+        """Находит свободный авторизованный аккаунт и арендует его клиент из пула.
+        Аккаунты на паузе после FloodWait пропускаются."""
         for account in self.accounts:
-            async with account.lock:
-                if not account.is_busy:
-                    if await account.is_authorized():
-                        return account
-                    else:
-                        logger.warning(f"Аккаунт {account.phone} не авторизован и будет пропущен.")
+            if account.is_busy or account.auth_status is False or request_layer.is_cooling_down(account.phone):
+                continue
+            try:
+                return account, await self.acquire(account)
+            except RuntimeError as e:
+                logger.warning(f"Аккаунт {account.phone} пропущен: {e}")
         return None
 
 
@@ -0,0 +1,184 @@
+import re
+import time
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from telethon import TelegramClient, utils
+from telethon.tl.types import (
+    Channel, Chat, User,
+    InputPeerChannel, InputPeerChat, InputPeerUser
+)
+
+import config
+from models import UserStub
+from services.sqlite_store import SQLiteStore
+from services.request_layer import request_layer
+
+logger = logging.getLogger(__name__)
+
+_LINK_PREFIX = re.compile(r'^(?:https?://)?(?:www\.)?(?:t\.me|telegram\.me)/', re.IGNORECASE)
+
+
+def normalize_target(target: str) -> str:
+    """'https://t.me/Durov', '@durov' и 'durov' дают один ключ кэша."""
+    key = _LINK_PREFIX.sub('', target.strip()).lstrip('@').rstrip('/')
+    return key.lower()
+
+
+@dataclass
+class CachedEntity:
+    peer_type: str  # "channel", "chat" или "user"
+    peer_id: int
+    access_hash: Optional[int]
+    title: Optional[str]
+    is_bot: bool = False
+    is_broadcast: bool = False
+
+    @property
+    def input_peer(self):
+        if self.peer_type == "channel":
+            return InputPeerChannel(channel_id=self.peer_id, access_hash=self.access_hash)
+        if self.peer_type == "chat":
+            return InputPeerChat(chat_id=self.peer_id)
+        return InputPeerUser(user_id=self.peer_id, access_hash=self.access_hash)
+
+    @classmethod
+    def from_entity(cls, entity) -> "CachedEntity":
+        input_peer = utils.get_input_peer(entity)
+        if isinstance(entity, Channel):
+            return cls("channel", entity.id, input_peer.access_hash, entity.title,
+                       is_broadcast=bool(entity.broadcast))
+        if isinstance(entity, Chat):
+            return cls("chat", entity.id, None, entity.title)
+        if isinstance(entity, User):
+            title = " ".join(filter(None, (entity.first_name, entity.last_name))) or entity.username
+            return cls("user", entity.id, input_peer.access_hash, title, is_bot=bool(entity.bot))
+        raise ValueError(f"Неподдерживаемый тип объекта: {type(entity).__name__}")
+
+
+class EntityCache(SQLiteStore):
+    """
+    Дисковый кэш резолва чатов/каналов и данных пользователей с TTL.
+    access_hash у каждого аккаунта свой, поэтому объекты кэшируются по паре (аккаунт, ключ).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entities (
+            account TEXT NOT NULL,
+            key TEXT NOT NULL,
+            peer_type TEXT NOT NULL,
+            peer_id INTEGER NOT NULL,
+            access_hash INTEGER,
+            title TEXT,
+            is_bot INTEGER NOT NULL DEFAULT 0,
+            is_broadcast INTEGER NOT NULL DEFAULT 0,
+            cached_at REAL NOT NULL,
+            PRIMARY KEY (account, key)
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            phone TEXT,
+            cached_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS users_username ON users (username);
+    """
+
+    def __init__(self, path: str, ttl: float = config.ENTITY_CACHE_TTL_SEC):
+        super().__init__(path)
+        self.ttl = ttl
+        self._last_purge = 0.0
+
+    async def resolve(self, client: TelegramClient, account: str, target: str) -> CachedEntity:
+        """Возвращает чат/канал/пользователя из кэша, а при промахе — резолвит через client.get_entity."""
+        if not target:
+            raise ValueError("Цель не указана.")
+        key = normalize_target(target)
+        await self._maybe_purge()
+
+        cached = await self.run(self._get_entity, account, key, time.time() - self.ttl)
+        if cached:
+            logger.debug(f"Entity cache hit for {key} ({account})")
+            return cached
+
+        entity = await request_layer.call(account, client, client.get_entity, target)
+        cached = CachedEntity.from_entity(entity)
+        await self.run(self._put_entity, account, key, cached)
+        return cached
+
+    async def forget(self, account: str, target: str):
+        await self.run(lambda conn: conn.execute(
+            "DELETE FROM entities WHERE account = ? AND key = ?", (account, normalize_target(target))))
+
+    async def remember_users(self, users: Iterable[UserStub]):
+        now = time.time()
+        rows = [(u.user_id, u.username, u.first_name, u.last_name, u.phone, now) for u in users]
+        if not rows:
+            return
+        await self.run(lambda conn: conn.executemany(
+            "INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, phone, cached_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows))
+
+    async def get_users(self, user_ids: Iterable[int]) -> Dict[int, UserStub]:
+        ids = list(user_ids)
+        if not ids:
+            return {}
+
+        def _get(conn, ids, since):
+            found = {}
+            # Ограничение SQLite на число параметров запроса
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                # Боты, попавшие в кэш пользователей раньше (как цели резолва), отправителями не считаются
+                query = ("SELECT user_id, username, first_name, last_name, phone FROM users "
+                         f"WHERE cached_at >= ? AND user_id IN ({','.join('?' * len(chunk))}) "
+                         "AND user_id NOT IN (SELECT peer_id FROM entities WHERE peer_type = 'user' AND is_bot = 1)")
+                for row in conn.execute(query, (since, *chunk)):
+                    found[row[0]] = UserStub(user_id=row[0], username=row[1], first_name=row[2],
+                                             last_name=row[3], phone=row[4])
+            return found
+
+        return await self.run(_get, ids, time.time() - self.ttl)
+
+    async def purge_expired(self):
+        since = time.time() - self.ttl
+
+        def _purge(conn, since):
+            removed = conn.execute("DELETE FROM entities WHERE cached_at < ?", (since,)).rowcount
+            removed += conn.execute("DELETE FROM users WHERE cached_at < ?", (since,)).rowcount
+            return removed
+
+        removed = await self.run(_purge, since)
+        self._last_purge = time.monotonic()
+        if removed:
+            logger.info(f"Entity cache: evicted {removed} expired records.")
+
+    async def _maybe_purge(self):
+        if time.monotonic() - self._last_purge > config.ENTITY_CACHE_PURGE_INTERVAL_SEC:
+            await self.purge_expired()
+
+    @staticmethod
+    def _get_entity(conn, account: str, key: str, since: float) -> Optional[CachedEntity]:
+        row = conn.execute(
+            "SELECT peer_type, peer_id, access_hash, title, is_bot, is_broadcast FROM entities "
+            "WHERE account = ? AND key = ? AND cached_at >= ?", (account, key, since)
+        ).fetchone()
+        if row is None:
+            return None
+        return CachedEntity(row[0], row[1], row[2], row[3], is_bot=bool(row[4]), is_broadcast=bool(row[5]))
+
+    @staticmethod
+    def _put_entity(conn, account: str, key: str, cached: CachedEntity):
+        now = time.time()
+        values = (cached.peer_type, cached.peer_id, cached.access_hash, cached.title,
+                  int(cached.is_bot), int(cached.is_broadcast), now)
+        conn.execute(
+            "INSERT OR REPLACE INTO entities "
+            "(account, key, peer_type, peer_id, access_hash, title, is_bot, is_broadcast, cached_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (account, key, *values))
+
+
+entity_cache = EntityCache(config.ENTITY_CACHE_DB_FILE)
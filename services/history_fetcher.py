@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+
+from telethon import TelegramClient
+from telethon.tl.functions.messages import GetHistoryRequest
+from telethon.tl.types import MessageEmpty, PeerUser, User
+
+import config
+from services.request_layer import request_layer
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryPage(NamedTuple):
+    """Страница истории в сыром виде: TL-сообщения (от новых к старым) и пользователи из ответа по id."""
+    messages: List
+    users: Dict[int, User]
+
+
+def sender_user_id(message) -> Optional[int]:
+    """id пользователя-отправителя из сырого сообщения без создания объекта Message."""
+    from_id = message.from_id
+    return from_id.user_id if isinstance(from_id, PeerUser) else None
+
+
+async def message_id_before(client: TelegramClient, entity, account: str, date: datetime) -> int:
+    """
+    id самого нового сообщения, отправленного раньше date, или 0, если таких нет.
+    Один запрос с offset_date: так границы окна по датам превращаются в min_id/max_id для сканирования.
+    """
+    result = await request_layer.call(account, client, GetHistoryRequest(
+        peer=entity, offset_id=0, offset_date=date, add_offset=0, limit=1, max_id=0, min_id=0, hash=0))
+    messages = [m for m in result.messages if not isinstance(m, MessageEmpty)]
+    return messages[0].id if messages else 0
+
+
+async def iter_history_pages(client: TelegramClient, entity, account: str, min_id: int = 0, max_id: int = 0,
+                             limit: Optional[int] = None,
+                             page_size: int = config.HISTORY_PAGE_SIZE) -> AsyncIterator[HistoryPage]:
+    """
+    Читает историю (min_id, max_id) страницами GetHistoryRequest через request_layer.
+    Следующая страница запрашивается сразу после получения текущей, пока вызывающий её обрабатывает.
+    Генератор нужно закрывать (contextlib.aclosing), если чтение прерывается досрочно.
+    """
+    def fetch(offset_id: int, count: int):
+        return asyncio.ensure_future(request_layer.call(account, client, GetHistoryRequest(
+            peer=entity, offset_id=offset_id, offset_date=None, add_offset=0, limit=count,
+            max_id=0, min_id=min_id, hash=0)))
+
+    remaining = limit
+    requested = min(page_size, remaining) if remaining else page_size
+    pending = fetch(max_id, requested)
+    try:
+        while pending is not None:
+            result = await pending
+            pending = None
+            messages = [m for m in result.messages if not isinstance(m, MessageEmpty)]
+            if not messages:
+                return
+            if remaining is not None:
+                messages = messages[:remaining]
+                remaining -= len(messages)
+
+            # Неполная страница означает, что история в диапазоне закончилась.
+            if len(result.messages) >= requested and (remaining is None or remaining > 0):
+                requested = min(page_size, remaining) if remaining else page_size
+                pending = fetch(messages[-1].id, requested)
+
+            yield HistoryPage(messages, {u.id: u for u in result.users if isinstance(u, User)})
+    finally:
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,82 @@
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+import config
+from models import UserStub
+from services.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChatCheckpoint:
+    chat_id: int
+    last_message_id: int
+    updated_at: float
+    senders: List[UserStub] = field(default_factory=list)
+
+
+class HistoryStore(SQLiteStore):
+    """
+    Отметки последнего обработанного сообщения по каждому чату и известные отправители.
+    Позволяют повторному сбору читать только сообщения после прошлого запуска (min_id).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS chat_checkpoints (
+            chat_id INTEGER PRIMARY KEY,
+            last_message_id INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS chat_senders (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            phone TEXT,
+            PRIMARY KEY (chat_id, user_id)
+        );
+    """
+
+    async def get(self, chat_id: int) -> Optional[ChatCheckpoint]:
+        def _get(conn, chat_id):
+            row = conn.execute(
+                "SELECT last_message_id, updated_at FROM chat_checkpoints WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            senders = [
+                UserStub(user_id=r[0], username=r[1], first_name=r[2], last_name=r[3], phone=r[4])
+                for r in conn.execute(
+                    "SELECT user_id, username, first_name, last_name, phone FROM chat_senders WHERE chat_id = ?",
+                    (chat_id,))
+            ]
+            return ChatCheckpoint(chat_id=chat_id, last_message_id=row[0], updated_at=row[1], senders=senders)
+
+        return await self.run(_get, chat_id)
+
+    async def save(self, chat_id: int, last_message_id: int, senders: Iterable[UserStub]):
+        rows = [(chat_id, u.user_id, u.username, u.first_name, u.last_name, u.phone) for u in senders]
+
+        def _save(conn, chat_id, last_message_id, rows):
+            conn.execute(
+                "INSERT INTO chat_checkpoints (chat_id, last_message_id, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET "
+                "last_message_id = MAX(last_message_id, excluded.last_message_id), updated_at = excluded.updated_at",
+                (chat_id, last_message_id, time.time()))
+            conn.executemany(
+                "INSERT INTO chat_senders (chat_id, user_id, username, first_name, last_name, phone) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(chat_id, user_id) DO UPDATE SET username = excluded.username, "
+                "first_name = excluded.first_name, last_name = excluded.last_name, phone = excluded.phone",
+                rows)
+
+        await self.run(_save, chat_id, last_message_id, rows)
+        logger.info(f"Saved history checkpoint for chat {chat_id}: last message {last_message_id}, "
+                    f"{len(rows)} senders.")
+
+
+history_store = HistoryStore(config.HISTORY_DB_FILE)
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+)
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import FSInputFile
+
+import config
+from services.request_layer import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class BotApiLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии Bot: все запросы, адресованные чату (ответы обработчиков, уведомления задач),
+    проходят через общее ведро токенов и ведро своего чата, а при 429 и сетевых ошибках повторяются.
+    Остальные методы (getUpdates, answerCallbackQuery и т.п.) не ограничиваются.
+    """
+
+    def __init__(self):
+        self.bucket = TokenBucket(*config.BOT_API_RATE_LIMIT)
+        self.chat_buckets: Dict[Any, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(*config.BOT_API_CHAT_RATE_LIMIT)
+        return bucket
+
+    async def __call__(self, make_request, bot: Bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        chat_bucket = self._chat_bucket(chat_id)
+        deadline = time.monotonic() + config.NOTIFY_SEND_DEADLINE_SEC
+        attempt = 0
+        while True:
+            await chat_bucket.acquire(deadline)
+            await self.bucket.acquire(deadline)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if e.retry_after > config.NOTIFY_MAX_RETRY_AFTER_SEC:
+                    raise
+                logger.warning(f"Bot API 429 for {type(method).__name__} in chat {chat_id}, "
+                               f"retry after {e.retry_after}s")
+                # Ведро чата заблокировано до конца ожидания — повтор дождётся его в acquire()
+                chat_bucket.on_flood_wait(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > config.NOTIFY_MAX_RETRIES:
+                    raise
+                backoff = 2 ** (attempt - 1)
+                logger.warning(f"Bot API error for {type(method).__name__} in chat {chat_id}: {e}. "
+                               f"Retry {attempt} in {backoff}s")
+                await asyncio.sleep(backoff)
+                continue
+            chat_bucket.on_success()
+            return response
+
+
+@dataclass
+class Outgoing:
+    kind: str  # "message", "edit" или "document"
+    chat_id: int
+    text: Optional[str] = None
+    message_id: Optional[int] = None
+    path: Optional[str] = None
+    coalesce: bool = False
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    future: Optional[asyncio.Future] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class Notifier:
+    """
+    Единственный Bot процесса и исходящие сообщения задач.
+    У каждого чата своя очередь: сообщения уходят по порядку, подряд идущие статусы
+    склеиваются в одно сообщение, правка сообщения заменяет ещё не отправленную правку того же сообщения.
+    Лимиты Bot API и повторы — в BotApiLimiter.
+    """
+
+    def __init__(self):
+        self._bot: Optional[Bot] = None
+        self._owns_bot = False
+        self.limiter = BotApiLimiter()
+        self._queues: Dict[int, Deque[Outgoing]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    @property
+    def bot(self) -> Bot:
+        if self._bot is None:
+            self._bot = Bot(token=config.BOT_TOKEN, parse_mode=ParseMode.HTML)
+            self._bot.session.middleware(self.limiter)
+            self._owns_bot = True
+        return self._bot
+
+    def use_bot(self, bot):
+        """Подменяет Bot (бенчмарки, тесты); лимиты сессии к подменённому боту не применяются."""
+        self._bot = bot
+        self._owns_bot = False
+
+    def notify(self, chat_id: int, text: str, **kwargs):
+        """Статусное сообщение без ожидания доставки; серия таких сообщений может прийти одним."""
+        self._enqueue(Outgoing("message", chat_id, text=text, coalesce=True, kwargs=kwargs))
+
+    async def send(self, chat_id: int, text: str, **kwargs):
+        """Отправляет сообщение в порядке очереди чата и возвращает его (Message)."""
+        return await self._enqueue_and_wait(Outgoing("message", chat_id, text=text, kwargs=kwargs))
+
+    async def send_document(self, chat_id: int, path: str, caption: Optional[str] = None, **kwargs):
+        return await self._enqueue_and_wait(Outgoing("document", chat_id, text=caption, path=path, kwargs=kwargs))
+
+    def edit(self, chat_id: int, message_id: int, text: str, **kwargs):
+        """Правка без ожидания доставки; неотправленная правка того же сообщения заменяется."""
+        for item in self._queues.get(chat_id, ()):
+            if item.kind == "edit" and item.message_id == message_id:
+                item.text = text
+                item.kwargs = kwargs
+                return
+        self._enqueue(Outgoing("edit", chat_id, text=text, message_id=message_id, kwargs=kwargs))
+
+    async def close(self, timeout: float = config.NOTIFY_DRAIN_TIMEOUT_SEC):
+        """Дожидается отправки очередей (не дольше timeout) и закрывает сессию бота."""
+        await self.drain(timeout)
+        if self._owns_bot:
+            await self._bot.session.close()
+
+    async def drain(self, timeout: float = config.NOTIFY_DRAIN_TIMEOUT_SEC):
+        """Ждёт, пока очереди чатов опустеют; недоставленное за timeout отбрасывается."""
+        workers = list(self._workers.values())
+        if workers:
+            _, pending = await asyncio.wait(workers, timeout=timeout)
+            for worker in pending:
+                worker.cancel()
+            if pending:
+                logger.warning(f"Не отправлены сообщения в {len(pending)} чатов: истекло время ожидания.")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _enqueue_and_wait(self, item: Outgoing):
+        item.future = asyncio.get_running_loop().create_future()
+        self._enqueue(item)
+        return await item.future
+
+    def _enqueue(self, item: Outgoing):
+        queue = self._queues.setdefault(item.chat_id, deque())
+        queue.append(item)
+        worker = self._workers.get(item.chat_id)
+        if worker is None or worker.done():
+            self._workers[item.chat_id] = asyncio.create_task(self._drain(item.chat_id))
+
+    async def _drain(self, chat_id: int):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                item = queue[0]
+                if item.coalesce:
+                    # Даём серии статусов накопиться, чтобы отправить её одним сообщением
+                    await asyncio.sleep(max(item.enqueued_at + config.NOTIFY_COALESCE_SEC - time.monotonic(), 0))
+                    item = self._merge_head(queue)
+                else:
+                    queue.popleft()
+                await self._deliver(item)
+        finally:
+            if not queue:
+                self._queues.pop(chat_id, None)
+            if self._workers.get(chat_id) is asyncio.current_task():
+                del self._workers[chat_id]
+
+    @staticmethod
+    def _merge_head(queue: Deque[Outgoing]) -> Outgoing:
+        head = queue.popleft()
+        parts = [head.text]
+        length = len(head.text)
+        while (queue and queue[0].coalesce and queue[0].kwargs == head.kwargs
+               and length + 2 + len(queue[0].text) <= MAX_MESSAGE_LENGTH):
+            item = queue.popleft()
+            parts.append(item.text)
+            length += 2 + len(item.text)
+        if len(parts) > 1:
+            logger.debug(f"Coalesced {len(parts)} notifications for chat {head.chat_id}")
+            head.text = "\n\n".join(parts)
+        return head
+
+    async def _deliver(self, item: Outgoing):
+        try:
+            if item.kind == "message":
+                result = await self.bot.send_message(item.chat_id, item.text, **item.kwargs)
+            elif item.kind == "edit":
+                result = await self.bot.edit_message_text(item.text, chat_id=item.chat_id,
+                                                          message_id=item.message_id, **item.kwargs)
+            else:
+                result = await self.bot.send_document(item.chat_id, FSInputFile(item.path), caption=item.text,
+                                                      **item.kwargs)
+        except asyncio.CancelledError:
+            if item.future and not item.future.done():
+                item.future.cancel()
+            raise
+        except Exception as e:
+            if item.future:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            elif isinstance(e, TelegramBadRequest) and item.kind == "edit" and "message is not modified" in str(e):
+                logger.debug(f"Message {item.message_id} in chat {item.chat_id} not edited: {e}")
+            elif isinstance(e, TelegramForbiddenError):
+                logger.warning(f"Чат {item.chat_id} недоступен для бота, уведомление не доставлено: {e}")
+            else:
+                logger.error(f"Не удалось отправить уведомление в чат {item.chat_id}: {e}")
+            return
+        if item.future and not item.future.done():
+            item.future.set_result(result)
+
+
+notifier = Notifier()
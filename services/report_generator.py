@@ -1,90 +1,326 @@
 import os
-import openpyxl
+import csv
+import gzip
+import json
 import asyncio
 import re
-from openpyxl.styles import Font
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+import time
+from array import array
+import importlib.util
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from itertools import chain
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional
 
 import config
-from models import Task
+from models import Task, COLLECTED, INVITED, ALREADY_PARTICIPANT
+from services import metrics
 
-_executor = ThreadPoolExecutor(max_workers=3)
+# openpyxl и pyarrow импортируются при первой сборке отчета: вместе они добавляют к запуску бота
+# сотни миллисекунд, а нужны только при выгрузке.
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
 
+logger = logging.getLogger(__name__)
 
-def _save_workbook(wb, path):
-    ws = wb.active
-    for col in ws.columns:
-        max_len = max(len(str(c.value)) if c.value is not None else 0 for c in col)
-        ws.column_dimensions[col[0].column_letter].width = max_len + 2
+_executor: Optional[Executor] = None
+
+SHEET_TITLE = "Собранные пользователи"
+HEADERS = ["ID пользователя", "Имя пользователя", "Имя", "Фамилия", "Телефон", "Статус приглашения",
+           "Сообщений", "Ответов", "Первое сообщение (UTC)", "Последнее сообщение (UTC)"]
+# Машиночитаемые имена колонок для CSV/JSONL/Parquet
+FIELDS = ["user_id", "username", "first_name", "last_name", "phone", "status",
+          "messages", "replies", "first_message_at", "last_message_at"]
+PARQUET_BATCH_ROWS = 10000
+
+
+@dataclass(frozen=True)
+class ReportSnapshot:
+    """
+    Копия колонок UserTable, нужных для отчета. Передаётся в процесс-сборщик вместо Task:
+    сериализуется быстро и не тянет за собой индексы и прочее состояние задачи.
+    """
+    ids: bytes
+    usernames: List[Optional[str]]
+    first_names: List[Optional[str]]
+    last_names: List[Optional[str]]
+    phones: List[Optional[str]]
+    flags: bytes
+    # Активность по строкам таблицы (array('q')): сообщения, ответы, даты первого и последнего сообщения.
+    # has_activity=False — задача не читала историю (сбор участников), колонки активности пустые.
+    # Ноль сообщений в строке — активности по пользователю нет (например, отправитель из прошлых запусков).
+    messages: bytes = b""
+    replies: bytes = b""
+    first_dates: bytes = b""
+    last_dates: bytes = b""
+    has_activity: bool = False
+    sort_by_activity: bool = False
+
+    @classmethod
+    def from_task(cls, task: Task) -> "ReportSnapshot":
+        table = task.users
+        activity = task.activity
+        columns = [array('q', bytes(8 * len(table))) for _ in range(4)]
+        messages, replies, first_dates, last_dates = columns
+        if len(activity):
+            for row, user_id in enumerate(table.ids):
+                source = activity.row_of(user_id)
+                if source is not None:
+                    messages[row] = activity.messages[source]
+                    replies[row] = activity.replies[source]
+                    first_dates[row] = activity.first_dates[source]
+                    last_dates[row] = activity.last_dates[source]
+        return cls(table.ids.tobytes(), list(table.usernames), list(table.first_names),
+                   list(table.last_names), list(table.phones), bytes(table.flags),
+                   *(column.tobytes() for column in columns), has_activity=len(activity) > 0,
+                   sort_by_activity=task.sort_by_activity)
+
+
+def _int_column(data: bytes) -> array:
+    column = array('q')
+    column.frombytes(data)
+    return column
+
+
+def _utc(timestamp: int) -> Optional[datetime]:
+    # Без tzinfo: openpyxl не пишет даты с часовым поясом
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None) if timestamp else None
+
+
+def _report_rows(snapshot: ReportSnapshot) -> Iterator[list]:
+    """
+    Строки отчета прямо из колонок снимка, по одной на пользователя: сначала собранные,
+    затем приглашенные вне сбора. Порог min_messages применяется ещё при сборе (собранные уже
+    отобраны по нему); с sort_by_activity самые активные идут первыми (при равенстве — писавшие позже).
+    """
+    ids = _int_column(snapshot.ids)
+    messages, replies, first_dates, last_dates = (
+        _int_column(data) for data in (snapshot.messages, snapshot.replies, snapshot.first_dates, snapshot.last_dates))
+    collected = [row for row, flags in enumerate(snapshot.flags) if flags & COLLECTED]
+    invited_outside = [row for row, flags in enumerate(snapshot.flags) if flags & INVITED and not flags & COLLECTED]
+    if snapshot.has_activity and snapshot.sort_by_activity:
+        for group in (collected, invited_outside):
+            group.sort(key=lambda row: (messages[row], last_dates[row]), reverse=True)
+    no_activity = [None] * 4
+    for row in chain(collected, invited_outside):
+        flags = snapshot.flags[row]
+        if snapshot.has_activity and messages[row]:
+            activity = [messages[row], replies[row], _utc(first_dates[row]), _utc(last_dates[row])]
+        else:
+            activity = no_activity
+        if flags & ALREADY_PARTICIPANT:
+            status = "Уже участник"
+        elif flags & INVITED:
+            status = "Приглашен" if flags & COLLECTED else "Приглашен (вне сбора)"
+        else:
+            status = "Собран"
+        yield [ids[row], snapshot.usernames[row], snapshot.first_names[row], snapshot.last_names[row],
+               snapshot.phones[row], status, *activity]
+
+
+def _build_xlsx(snapshot: ReportSnapshot, path: str):
+    """
+    Потоковая запись отчета в write-only режиме openpyxl: ячейки не держатся в памяти.
+    Write-only лист пишет ширины колонок до данных, поэтому ширины считаются
+    отдельным проходом по тем же строкам, без их сохранения.
+    """
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    widths = [len(h) for h in HEADERS]
+    row_count = 0
+    for row in _report_rows(snapshot):
+        row_count += 1
+        for idx, value in enumerate(row):
+            if value is not None:
+                widths[idx] = max(widths[idx], len(str(value)))
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(SHEET_TITLE)
+    for idx, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(idx)].width = width + 2
+    ws.auto_filter.ref = f"A1:{get_column_letter(len(HEADERS))}{row_count + 1}"
+
+    header_cells = []
+    for header in HEADERS:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for row in _report_rows(snapshot):
+        ws.append(row)
     wb.save(path)
 
 
+def _build_csv(snapshot: ReportSnapshot, path: str):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        writer.writerows(_report_rows(snapshot))
+
+
+def _build_csv_gz(snapshot: ReportSnapshot, path: str):
+    with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        writer.writerows(_report_rows(snapshot))
+
+
+def _build_jsonl(snapshot: ReportSnapshot, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in _report_rows(snapshot):
+            f.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False, default=str))
+            f.write("\n")
+
+
+def _build_parquet(snapshot: ReportSnapshot, path: str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("user_id", pa.int64()),
+        ("username", pa.string()),
+        ("first_name", pa.string()),
+        ("last_name", pa.string()),
+        ("phone", pa.string()),
+        ("status", pa.string()),
+        ("messages", pa.int64()),
+        ("replies", pa.int64()),
+        ("first_message_at", pa.timestamp("s")),
+        ("last_message_at", pa.timestamp("s")),
+    ])
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        columns = [[] for _ in FIELDS]
+        for row in _report_rows(snapshot):
+            for column, value in zip(columns, row):
+                column.append(value)
+            if len(columns[0]) >= PARQUET_BATCH_ROWS:
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+                columns = [[] for _ in FIELDS]
+        if columns[0]:
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+
+@dataclass(frozen=True)
+class ReportFormat:
+    key: str
+    title: str
+    extension: str
+    build: Callable[[ReportSnapshot, str], None]
+
+
+REPORT_FORMATS: Dict[str, ReportFormat] = {
+    f.key: f for f in (
+        ReportFormat("xlsx", "Excel (XLSX)", "xlsx", _build_xlsx),
+        ReportFormat("csv", "CSV", "csv", _build_csv),
+        ReportFormat("csv_gz", "CSV (gzip)", "csv.gz", _build_csv_gz),
+        ReportFormat("jsonl", "JSON Lines", "jsonl", _build_jsonl),
+    )
+}
+if PARQUET_AVAILABLE:
+    REPORT_FORMATS["parquet"] = ReportFormat("parquet", "Parquet", "parquet", _build_parquet)
+
+DEFAULT_REPORT_FORMAT = "xlsx"
+
+
+def get_report_format(key: str) -> ReportFormat:
+    return REPORT_FORMATS.get(key) or REPORT_FORMATS[DEFAULT_REPORT_FORMAT]
+
+
 async def make_report(task: Task, chat_title: str) -> str:
     sanitized_chat_title = re.sub(r'[<>:"/\\|?*]', '_', chat_title)
     sanitized_chat_title = re.sub(r'[^\x20-\x7E]', '', sanitized_chat_title)
     if len(sanitized_chat_title) > 50:
         sanitized_chat_title = sanitized_chat_title[:50]
 
+    report_format = get_report_format(task.report_format)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_name = f"report_{sanitized_chat_title}_{timestamp}.xlsx"
+    file_name = f"report_{sanitized_chat_title}_{timestamp}.{report_format.extension}"
     path = os.path.join(config.REPORTS_DIR, file_name)
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Собранные пользователи"
-
-    headers = ["ID пользователя", "Имя пользователя", "Имя", "Фамилия", "Телефон", "Статус приглашения"]
-    ws.append(headers)
-    for col_idx, header in enumerate(headers, 1):
-        ws.cell(row=1, column=col_idx).font = Font(bold=True)
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    snapshot = ReportSnapshot.from_task(task)
+    executor = _get_executor()
+    try:
+        await loop.run_in_executor(executor, report_format.build, snapshot, path)
+    except BrokenProcessPool:
+        # Процесс-сборщик упал (например, нехватка памяти): пересоздаём пул, этот отчет строим в потоке.
+        logger.exception(f"Пул сборки отчетов сломан, отчет {file_name} строится в потоке")
+        # Другие отчеты на том же пуле получают ту же ошибку: закрывается только сломанный пул,
+        # а не новый, уже созданный и, возможно, занятый чужим отчетом
+        if _executor is executor:
+            shutdown_report_pool()
+        await loop.run_in_executor(None, report_format.build, snapshot, path)
+    metrics.report_build_seconds.observe(time.monotonic() - started, format=report_format.key)
+    return path
 
-    unique_users = {}
-    for user in task.collected_users:
-        unique_users[user.user_id] = {"data": user, "status": "Собран"}
 
-    for user in task.invited_users:
-        if user.user_id in unique_users:
-            unique_users[user.user_id]["status"] = "Приглашен"
+def _get_executor() -> Executor:
+    """
+    Пул создаётся при первом отчете. REPORT_WORKERS > 0 — отдельные процессы (сборка не делит GIL
+    с event loop), 0 — потоки текущего процесса.
+    """
+    global _executor
+    if _executor is None:
+        if config.REPORT_WORKERS > 0:
+            _executor = ProcessPoolExecutor(max_workers=config.REPORT_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
         else:
-            unique_users[user.user_id] = {"data": user, "status": "Приглашен (вне сбора)"}
+            _executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="report")
+    return _executor
 
-    already_participants_ids = {u.user_id for u in task.already_participants_list}
 
-    for user_id, data in unique_users.items():
-        status = data["status"]
-        if user_id in already_participants_ids:
-            status = "Уже участник"
-
-        user = data["data"]
-        ws.append([
-            user.user_id,
-            user.username,
-            user.first_name,
-            user.last_name,
-            user.phone,
-            status
-        ])
-
-    ws.auto_filter.ref = ws.dimensions
-    loop = asyncio.get_running_loop()
-    await loop.run_in_executor(_executor, _save_workbook, wb, path)
-    return path
+def shutdown_report_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
 
 
 def make_caption(task: Task, chat_title: str) -> str:
     duration_str = f"{task.duration():.2f} сек." if task.started_at else "N/A"
     account_info = task.account_phone if hasattr(task, 'account_phone') and task.account_phone else 'N/A'
 
+    shards_info = ""
+    if task.shard_stats:
+        shards_info = "\n🧩 **Шарды истории:**\n" + "".join(
+            f"`#{shard.index}` `{shard.account_phone}` id {shard.min_id + 1}–{shard.max_id}: "
+            f"`{shard.messages}` сообщ., `{shard.users}` польз., `{shard.duration():.2f}` сек.\n"
+            for shard in task.shard_stats
+        )
+
+    status_info = "🛑 **Задача отменена, отчет по уже собранным данным.**\n" if task.status == "cancelled" else ""
+    activity_info = ""
+    activity = task.activity
+    if len(activity) and task.min_messages:
+        activity_info += (f"📈 **Порог активности:** от `{task.min_messages}` сообщ., "
+                          f"отсеяно `{task.below_min_messages}`\n")
+    if len(activity) and task.sort_by_activity:
+        activity_info += "🔢 Отчет отсортирован по числу сообщений\n"
+    period_info = f"📅 **Период сообщений:** `{task.date_window_label()}`\n" if task.has_date_window else ""
+    only_new_info = f"🆕 **Пропущено собранных ранее:** `{len(task.skipped_seen)}`\n" if task.only_new else ""
+
     return (
         f"📊 **Отчет по задаче:** `{task.id}`\n"
+        f"{status_info}"
         f"🔗 **Источник сбора:** `{chat_title}`\n"
+        f"{period_info}"
         f"⚡ **Аккаунт:** `{account_info}`\n"
         f"👥 **Всего собрано пользователей:** `{len(task.collected_users)}`\n"
+        f"{only_new_info}"
+        f"{activity_info}"
         f"⏳ **Длительность:** `{duration_str}`\n\n"
         f"📊 **Отчет по приглашениям:**\n"
         f"✅ Приглашено успешно: `{len(task.invited_users)}`\n"
         f"👤 Уже были участниками: `{task.already_participants}`\n"
         f"🔒 Приватность: `{task.failed_privacy}`\n"
         f"❌ Другие ошибки: `{task.failed_other}`\n"
+        f"{shards_info}"
     )
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from telethon import TelegramClient, errors
+from telethon.tl.tlobject import TLRequest
+
+import config
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Группы методов с общими лимитами Telegram: и TL-запросы, и высокоуровневые методы клиента.
+METHOD_FAMILIES = {
+    "GetHistoryRequest": "history",
+    "get_messages": "history",
+    "iter_messages": "history",
+    "GetParticipantsRequest": "participants",
+    "GetFullChatRequest": "participants",
+    "get_participants": "participants",
+    "iter_participants": "participants",
+    "InviteToChannelRequest": "invite",
+    "ResolveUsernameRequest": "resolve",
+    "GetFullChannelRequest": "resolve",
+    "get_entity": "resolve",
+}
+
+
+def method_family(method: str) -> str:
+    return METHOD_FAMILIES.get(method, "default")
+
+
+class AccountCoolingDown(RuntimeError):
+    """Аккаунт упёрся в лимиты Telegram и временно исключён из работы."""
+
+    def __init__(self, phone: str, until: float):
+        self.phone = phone
+        self.until = until
+        super().__init__(f"Аккаунт {phone} на паузе из-за лимитов Telegram ещё {self.remaining:.0f} сек.")
+
+    @property
+    def remaining(self) -> float:
+        return max(self.until - time.monotonic(), 0.0)
+
+
+class RequestDeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+
+class TokenBucket:
+    """
+    Ведро токенов с адаптивной скоростью: каждый FloodWait уменьшает скорость вдвое
+    и блокирует ведро на время ожидания, успешные запросы понемногу возвращают её к базовой.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, deadline: float):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(self.blocked_until - now, 0.0)
+                if not wait:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                if now + wait > deadline:
+                    raise RequestDeadlineExceeded(f"Не дождались лимита запросов за отведённое время ({wait:.1f} сек.)")
+                await asyncio.sleep(wait)
+
+    def on_flood_wait(self, seconds: float):
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(self.rate * config.FLOOD_RATE_DECREASE, self.base_rate * config.FLOOD_MIN_RATE_FACTOR)
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def on_success(self):
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * config.FLOOD_RATE_RECOVERY)
+
+
+class AccountRequests:
+    """
+    Выполнение запросов от имени одного аккаунта: ведра токенов по группам методов,
+    общий дедлайн на вызов и автомат отключения аккаунта (cooldown) при долгих FloodWait и сериях таймаутов.
+    """
+
+    def __init__(self, phone: str):
+        self.phone = phone
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.cooldown_until = 0.0
+        self.consecutive_failures = 0
+
+    def bucket(self, family: str) -> TokenBucket:
+        bucket = self.buckets.get(family)
+        if bucket is None:
+            rate, capacity = config.REQUEST_RATE_LIMITS.get(family, config.REQUEST_RATE_LIMITS["default"])
+            bucket = self.buckets[family] = TokenBucket(rate, capacity)
+        return bucket
+
+    @property
+    def cooling_down(self) -> bool:
+        return time.monotonic() < self.cooldown_until
+
+    def trip(self, seconds: float, reason: str):
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+        self.consecutive_failures = 0
+        metrics.circuit_breaker_trips.inc(account=self.phone)
+        logger.warning(f"Аккаунт {self.phone} отправлен на паузу на {seconds:.0f} сек.: {reason}")
+
+    def _check_cooldown(self):
+        if self.cooling_down:
+            raise AccountCoolingDown(self.phone, self.cooldown_until)
+
+    def _on_failure(self, reason: str):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= config.CIRCUIT_BREAKER_FAILURES:
+            self.trip(config.CIRCUIT_BREAKER_COOLDOWN_SEC, reason)
+
+    async def on_flood_wait(self, family: str, seconds: int, deadline: Optional[float] = None):
+        """
+        Учитывает FloodWait, полученный в обход call() (например, при постраничном чтении истории).
+        Короткое ожидание выдерживается, длинное — отправляет аккаунт на паузу.
+        """
+        self.bucket(family).on_flood_wait(seconds + 1)
+        if seconds >= config.CIRCUIT_BREAKER_FLOOD_SEC or (deadline and time.monotonic() + seconds > deadline):
+            self.trip(seconds + 1, f"FloodWait {seconds} сек. ({family})")
+            raise AccountCoolingDown(self.phone, self.cooldown_until)
+        metrics.flood_wait_seconds.inc(seconds + 1, account=self.phone)
+        await asyncio.sleep(seconds + 1)
+
+    async def call(self, client: TelegramClient, request, *args,
+                   deadline: Optional[float] = None, timeout: Optional[float] = None, **kwargs):
+        """
+        Выполняет TL-запрос (client(request)) или метод клиента (request(*args, **kwargs)).
+        Повторяет вызов при таймаутах и коротких FloodWait, пока не исчерпан дедлайн.
+        По умолчанию deadline и timeout берутся из config в момент вызова.
+        """
+        deadline = config.REQUEST_DEADLINE_SEC if deadline is None else deadline
+        timeout = config.REQUEST_TIMEOUT_SEC if timeout is None else timeout
+        if isinstance(request, TLRequest):
+            method = type(request).__name__
+            make_call = lambda: client(request)
+        else:
+            method = getattr(request, "__name__", type(request).__name__)
+            make_call = lambda: request(*args, **kwargs)
+        family = method_family(method)
+        bucket = self.bucket(family)
+        end = time.monotonic() + deadline
+        backoff = 1
+
+        while True:
+            self._check_cooldown()
+            await bucket.acquire(end)
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(make_call(), timeout=max(min(timeout, end - started), 0.1))
+            except asyncio.TimeoutError:
+                metrics.rpc_retries.inc(method=method, reason="timeout")
+                self._on_failure(f"таймауты {method}")
+                if time.monotonic() + backoff >= end:
+                    raise RequestDeadlineExceeded(f"{method}: превышено время ожидания ответа ({deadline} сек.)")
+                logger.warning(f"Timeout for {method} ({self.phone}). Retrying with backoff {backoff}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, config.REQUEST_MAX_BACKOFF_SEC)
+                continue
+            except errors.FloodWaitError as e:
+                metrics.rpc_retries.inc(method=method, reason="flood_wait")
+                logger.warning(f"FloodWaitError for {method} ({self.phone}): {e.seconds} seconds.")
+                bucket.on_flood_wait(e.seconds + 1)
+                if e.seconds >= config.CIRCUIT_BREAKER_FLOOD_SEC or time.monotonic() + e.seconds > end:
+                    self.trip(e.seconds + 1, f"FloodWait {e.seconds} сек. ({method})")
+                    raise AccountCoolingDown(self.phone, self.cooldown_until) from e
+                # Ведро заблокировано до конца FloodWait — ожидание произойдёт в acquire()
+                metrics.flood_wait_seconds.inc(e.seconds + 1, account=self.phone)
+                continue
+            except errors.RPCError as e:
+                metrics.rpc_errors.inc(method=method, error=type(e).__name__)
+                self.consecutive_failures = 0
+                raise
+            except Exception as e:
+                metrics.rpc_errors.inc(method=method, error=type(e).__name__)
+                logger.error(f"Unexpected error in {method} ({self.phone}): {e}")
+                raise
+
+            metrics.rpc_latency.observe(time.monotonic() - started, method=method)
+            bucket.on_success()
+            self.consecutive_failures = 0
+            return result
+
+
+class RequestLayer:
+    """Реестр AccountRequests по номерам аккаунтов."""
+
+    def __init__(self):
+        self._accounts: Dict[str, AccountRequests] = {}
+
+    def for_account(self, phone: str) -> AccountRequests:
+        requests = self._accounts.get(phone)
+        if requests is None:
+            requests = self._accounts[phone] = AccountRequests(phone)
+        return requests
+
+    def is_cooling_down(self, phone: str) -> bool:
+        requests = self._accounts.get(phone)
+        return requests is not None and requests.cooling_down
+
+    def cooldown_remaining(self, phone: str) -> float:
+        requests = self._accounts.get(phone)
+        return max(requests.cooldown_until - time.monotonic(), 0.0) if requests else 0.0
+
+    async def call(self, phone: str, client: TelegramClient, request, *args, **kwargs):
+        return await self.for_account(phone).call(client, request, *args, **kwargs)
+
+    def forget(self, phone: str):
+        self._accounts.pop(phone, None)
+
+
+request_layer = RequestLayer()
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import math
+import os
+import struct
+from typing import BinaryIO, Iterable, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MTGSEEN1"
+# magic, число бит, число хеш-функций, добавлено id
+HEADER = struct.Struct("<8sQIQ")
+MASK64 = (1 << 64) - 1
+
+
+def _mix64(x: int) -> int:
+    """Финализатор splitmix64: равномерно перемешивает биты целого id."""
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class BloomFilter:
+    """
+    Фильтр Блума по целым id: "нет" — точно нет, "есть" — с вероятностью ложного срабатывания fp_rate,
+    пока добавлено не больше capacity id. Позиции бит — двойное хеширование (h1 + i * h2) mod m.
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: Optional[bytearray] = None, count: int = 0):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.count = count
+
+    @classmethod
+    def for_capacity(cls, capacity: int, fp_rate: float) -> "BloomFilter":
+        num_bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, item: int):
+        h1 = _mix64(item & MASK64)
+        h2 = _mix64(h1) | 1
+        m = self.num_bits
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % m
+
+    def add(self, item: int) -> bool:
+        """Добавляет id; True — его ещё не было (с точностью до ложного срабатывания)."""
+        bits = self.bits
+        added = False
+        for pos in self._positions(item):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, item: int) -> bool:
+        bits = self.bits
+        for pos in self._positions(item):
+            # Для нового id обычно уже первый бит пуст
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def expected_fp_rate(self) -> float:
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self.bits)
+
+    def write_to(self, f: BinaryIO):
+        """Пишет фильтр без копирования массива бит (десятки МБ)."""
+        f.write(HEADER.pack(MAGIC, self.num_bits, self.num_hashes, self.count))
+        f.write(memoryview(self.bits))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        magic, num_bits, num_hashes, count = HEADER.unpack_from(data)
+        bits = bytearray(data[HEADER.size:])
+        if magic != MAGIC or len(bits) != (num_bits + 7) // 8:
+            raise ValueError("Файл фильтра поврежден или имеет другой формат")
+        return cls(num_bits, num_hashes, bits, count)
+
+
+class SeenUsers:
+    """
+    id пользователей, которые уже попадали в отчеты. Хранится фильтром Блума в файле
+    (около 1,2 байта на id при 1% ложных срабатываний) и загружается при первом обращении.
+    Ложное срабатывание означает, что новый пользователь изредка будет принят за уже собранного.
+    """
+
+    def __init__(self, path: str = config.SEEN_USERS_FILE, capacity: int = config.SEEN_USERS_CAPACITY,
+                 fp_rate: float = config.SEEN_USERS_FP_RATE):
+        self.path = path
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.filter: Optional[BloomFilter] = None
+        self._dirty = False
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        async with self._lock:
+            if self.filter is not None:
+                return
+            loop = asyncio.get_running_loop()
+            self.filter = await loop.run_in_executor(None, self._load_sync)
+
+    def _load_sync(self) -> BloomFilter:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "rb") as f:
+                    bloom = BloomFilter.from_bytes(f.read())
+                logger.info(f"Loaded seen users filter: {bloom.count} ids, {bloom.size_bytes / 1024 / 1024:.1f} MB, "
+                            f"expected false positive rate {bloom.expected_fp_rate():.4f}")
+                return bloom
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Не удалось загрузить фильтр собранных пользователей {self.path}: {e}. "
+                             f"Создается пустой фильтр.")
+        bloom = BloomFilter.for_capacity(self.capacity, self.fp_rate)
+        logger.info(f"Created seen users filter for {self.capacity} ids "
+                    f"({bloom.size_bytes / 1024 / 1024:.1f} MB, {bloom.num_hashes} hashes)")
+        return bloom
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.filter is not None and user_id in self.filter
+
+    async def remember(self, user_ids: Iterable[int]) -> int:
+        """Добавляет id в фильтр и сохраняет его на диск; возвращает число новых id."""
+        await self.load()
+        added = 0
+        for n, user_id in enumerate(user_ids, 1):
+            added += self.filter.add(user_id)
+            if n % 1000 == 0:
+                # Несколько микросекунд на id: большие отчеты добавляются, не задерживая цикл событий
+                await asyncio.sleep(0)
+        if added:
+            self._dirty = True
+            if self.filter.count > self.capacity:
+                logger.warning(f"В фильтре собранных пользователей {self.filter.count} id при расчетных "
+                               f"{self.capacity}: ложные срабатывания растут "
+                               f"({self.filter.expected_fp_rate():.4f}). Увеличьте SEEN_USERS_CAPACITY "
+                               f"и удалите {self.path}.")
+            await self.save()
+        return added
+
+    async def save(self):
+        async with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            loop = asyncio.get_running_loop()
+            try:
+                # Биты только устанавливаются, поэтому запись без снимка безопасна: если во время неё
+                # добавятся id, в файл попадет их часть, а остальные — при следующем сохранении
+                await loop.run_in_executor(None, self._write_sync)
+            except OSError as e:
+                self._dirty = True
+                logger.error(f"Не удалось сохранить фильтр собранных пользователей {self.path}: {e}")
+
+    def _write_sync(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            self.filter.write_to(f)
+        os.replace(tmp_path, self.path)
+
+
+seen_users = SeenUsers()
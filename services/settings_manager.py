@@ -1,83 +1,69 @@
-import json
-import os
-import asyncio
 import logging
 from typing import Optional
 from telethon import TelegramClient, errors
 from telethon.tl.functions.channels import GetFullChannelRequest
 
-import config
 from services.account_manager import account_mgr
+from services.entity_cache import entity_cache
+from services.request_layer import request_layer
+from services.state_store import state_store
+from services.report_generator import REPORT_FORMATS, DEFAULT_REPORT_FORMAT
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SETTINGS = {
+    "invite_channel": None,
+    "auto_invite": False,
+    "report_format": DEFAULT_REPORT_FORMAT,
+    "incremental_scraping": False,
+    "only_new_users": False,
+    "min_messages": 0,
+    "sort_by_activity": False
+}
+
 
 class SettingsManager:
     def __init__(self):
-        self._lock = asyncio.Lock()
-        self.settings = {
-            "invite_channel": None,
-            "auto_invite": False
-        }
-        self._load()
-
-    def _load(self):
-        if os.path.exists(config.SETTINGS_FILE):
-            try:
-                with open(config.SETTINGS_FILE, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                for key in ("invite_channel", "auto_invite"):
-                    if key in data:
-                        self.settings[key] = data[key]
-                logger.info(f"Settings loaded from {config.SETTINGS_FILE}")
-            except Exception as e:
-                logger.error(
-                    f"Ошибка загрузки настроек из {config.SETTINGS_FILE}: {e}. Используем настройки по умолчанию.")
-                self.settings = {"invite_channel": None, "auto_invite": False}
-                self._save()
-        else:
-            logger.info(f"Settings file {config.SETTINGS_FILE} not found. Using default settings.")
-            self._save()
-
-    def _save(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+
+    async def load(self):
+        """Загружает настройки из хранилища (вызывается при старте бота, после миграции JSON)."""
+        try:
+            stored = await state_store.load_settings()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки настроек: {e}. Используем настройки по умолчанию.")
+            stored = {}
+        self.settings = dict(DEFAULT_SETTINGS)
+        for key in DEFAULT_SETTINGS:
+            if key in stored:
+                self.settings[key] = stored[key]
+        logger.info(f"Settings loaded from {state_store.path}")
+
+    async def _set(self, key: str, value):
+        self.settings[key] = value
         try:
-            with open(config.SETTINGS_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.settings, f, ensure_ascii=False, indent=4)
-            logger.info(f"Settings saved to {config.SETTINGS_FILE}")
+            await state_store.save_setting(key, value)
+            logger.info(f"Setting {key} saved")
         except Exception as e:
-            logger.error(f"Ошибка сохранения настроек в {config.SETTINGS_FILE}: {e}")
+            logger.error(f"Ошибка сохранения настройки {key}: {e}")
 
     async def set_channel(self, channel_input: str) -> str:
         if not account_mgr.accounts:
             raise ValueError("Нет подключенных аккаунтов для проверки канала.")
 
-        test_account = None
-        client = None
-        for acc in account_mgr.accounts:
-            try:
-                client = await account_mgr.acquire(acc)
-                test_account = acc
-                break
-            except Exception as e:
-                logger.warning(f"Не удалось получить клиент для аккаунта {acc.phone} для проверки канала: {e}")
-                if client and client.is_connected():
-                    await client.disconnect()
-                if acc.is_busy:
-                    await account_mgr.release(acc)
-                continue
-
-        if not test_account or not client:
+        leased = await account_mgr.acquire_free()
+        if not leased:
             raise ValueError("Нет доступных авторизованных аккаунтов для проверки канала.")
+        test_account, client = leased
 
         try:
-            entity = await client.get_entity(channel_input)
+            resolved = await entity_cache.resolve(client, test_account.phone, channel_input)
 
-            if not isinstance(entity, (errors.rpcerrorlist.ChannelInvalidError,
-                                       errors.rpcerrorlist.PeerIdInvalidError)):
+            if resolved.peer_type == "channel":
                 try:
-                    full_channel = await client(GetFullChannelRequest(entity))
-                    self.settings["invite_channel"] = channel_input
-                    self._save()
+                    full_channel = await request_layer.call(test_account.phone, client,
+                                                            GetFullChannelRequest(resolved.input_peer))
+                    await self._set("invite_channel", channel_input)
                     return channel_input
                 except Exception as e:
                     logger.error(f"Error getting full channel info for {channel_input}: {e}")
@@ -95,26 +81,65 @@ class SettingsManager:
         except errors.rpcerrorlist.PeerIdInvalidError:
             raise ValueError("Неверный формат ссылки/юзернейма или объект не найден.")
         except errors.rpcerrorlist.AuthKeyUnregisteredError:
+            await account_mgr.invalidate_authorization(test_account)
             raise ValueError("Аккаунт, используемый для проверки, не авторизован. Переавторизуйте его.")
+        except ValueError:
+            raise
         except Exception as e:
             logger.exception(f"Неизвестная ошибка при проверке канала {channel_input}")
             raise ValueError(f"Неизвестная ошибка при проверке канала: {e}")
         finally:
-            if client and client.is_connected():
-                await client.disconnect()
-            if test_account:
-                await account_mgr.release(test_account)
+            await account_mgr.release(test_account)
 
     def get_channel(self) -> Optional[str]:
         return self.settings.get("invite_channel")
 
-    def toggle_invite(self) -> bool:
-        self.settings["auto_invite"] = not self.settings.get("auto_invite", False)
-        self._save()
+    async def toggle_invite(self) -> bool:
+        await self._set("auto_invite", not self.settings.get("auto_invite", False))
         return self.settings["auto_invite"]
 
     def is_auto_invite(self) -> bool:
         return bool(self.settings.get("auto_invite", False))
 
+    async def toggle_incremental(self) -> bool:
+        await self._set("incremental_scraping", not self.settings.get("incremental_scraping", False))
+        return self.settings["incremental_scraping"]
+
+    def is_incremental(self) -> bool:
+        return bool(self.settings.get("incremental_scraping", False))
+
+    async def toggle_only_new(self) -> bool:
+        await self._set("only_new_users", not self.settings.get("only_new_users", False))
+        return self.settings["only_new_users"]
+
+    def is_only_new(self) -> bool:
+        return bool(self.settings.get("only_new_users", False))
+
+    def get_min_messages(self) -> int:
+        return int(self.settings.get("min_messages") or 0)
+
+    async def set_min_messages(self, min_messages: int) -> int:
+        if min_messages < 0:
+            raise ValueError("Порог сообщений не может быть отрицательным")
+        await self._set("min_messages", min_messages)
+        return min_messages
+
+    async def toggle_activity_sort(self) -> bool:
+        await self._set("sort_by_activity", not self.settings.get("sort_by_activity", False))
+        return self.settings["sort_by_activity"]
+
+    def is_activity_sort(self) -> bool:
+        return bool(self.settings.get("sort_by_activity", False))
+
+    def get_report_format(self) -> str:
+        report_format = self.settings.get("report_format")
+        return report_format if report_format in REPORT_FORMATS else DEFAULT_REPORT_FORMAT
+
+    async def set_report_format(self, report_format: str) -> str:
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат отчета: {report_format}")
+        await self._set("report_format", report_format)
+        return report_format
+
 
 settings_mgr = SettingsManager()
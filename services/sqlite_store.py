@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """
+    Локальное SQLite-хранилище, все запросы которого выполняются в отдельном потоке,
+    чтобы не блокировать event loop. Каждый вызов run() — одна транзакция.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{type(self).__name__}")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            if self.SCHEMA:
+                self._conn.executescript(self.SCHEMA)
+            logger.debug(f"Opened SQLite store {self.path}")
+        return self._conn
+
+    def _run_sync(self, fn: Callable[..., Any], *args) -> Any:
+        conn = self._connect()
+        with conn:
+            result = fn(conn, *args)
+        if isinstance(result, sqlite3.Cursor):
+            # Курсор не должен уходить в другой поток: его финализация там сбрасывает
+            # подготовленный оператор, который поток хранилища может в это время выполнять.
+            result.close()
+            return None
+        return result
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_sync, fn, *args)
+
+    async def close(self):
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, _close)
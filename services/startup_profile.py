@@ -0,0 +1,52 @@
+import time
+import logging
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    """
+    Длительность этапов запуска бота и время от старта процесса до первого апдейта.
+    Отсчёт идёт с импорта модуля, поэтому main.py импортирует его раньше aiogram и telethon.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.stages: List[Tuple[str, float]] = []
+        self.ready_at: Optional[float] = None
+        self.first_update_at: Optional[float] = None
+        self._mark = self.started_at
+
+    def mark(self, name: str):
+        """Закрывает этап, начавшийся с предыдущей отметки (например, импорт модулей)."""
+        now = time.monotonic()
+        self.stages.append((name, now - self._mark))
+        self._mark = now
+
+    @contextmanager
+    def stage(self, name: str):
+        self._mark = time.monotonic()
+        try:
+            yield
+        finally:
+            self.mark(name)
+
+    def ready(self):
+        self.ready_at = time.monotonic()
+        logger.info(f"Startup finished in {self.ready_at - self.started_at:.2f}s: {self._render_stages()}")
+
+    def first_update(self) -> bool:
+        """Отмечает первый апдейт; True — только при первом вызове."""
+        if self.first_update_at is not None:
+            return False
+        self.first_update_at = time.monotonic()
+        logger.info(f"First update handled {self.first_update_at - self.started_at:.2f}s after start")
+        return True
+
+    def _render_stages(self) -> str:
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stages)
+
+
+startup_profile = StartupProfile()
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import logging
+from typing import Any, Dict, List
+
+import config
+from services.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_COLUMNS = ("phone", "api_id", "api_hash", "session_string", "user_id", "username", "first_name", "last_name")
+
+
+class StateStore(SQLiteStore):
+    """
+    Аккаунты и настройки бота в SQLite (WAL). Каждое изменение — отдельная транзакция
+    над одной строкой, поэтому сбой посреди записи не портит остальные данные.
+    Прежние accounts.json/settings.json импортируются один раз при первом запуске.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            phone TEXT PRIMARY KEY,
+            api_id INTEGER NOT NULL,
+            api_hash TEXT NOT NULL,
+            session_string TEXT,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    async def load_accounts(self) -> List[Dict[str, Any]]:
+        def _load(conn):
+            rows = conn.execute(f"SELECT {', '.join(ACCOUNT_COLUMNS)} FROM accounts ORDER BY rowid")
+            return [dict(zip(ACCOUNT_COLUMNS, row)) for row in rows]
+
+        return await self.run(_load)
+
+    async def save_account(self, data: Dict[str, Any]):
+        values = tuple(data.get(column) for column in ACCOUNT_COLUMNS)
+        await self.run(self._upsert_accounts, [values])
+
+    async def delete_account(self, phone: str):
+        await self.run(lambda conn: conn.execute("DELETE FROM accounts WHERE phone = ?", (phone,)))
+
+    async def load_settings(self) -> Dict[str, Any]:
+        def _load(conn):
+            return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM settings")}
+
+        return await self.run(_load)
+
+    async def save_setting(self, key: str, value: Any):
+        raw = json.dumps(value, ensure_ascii=False)
+        await self.run(lambda conn: conn.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, raw)))
+
+    async def migrate_from_json(self, accounts_file: str = config.ACCOUNTS_FILE,
+                                settings_file: str = config.SETTINGS_FILE):
+        """
+        Импортирует accounts.json и settings.json в одной транзакции, если это ещё не сделано.
+        Исходные файлы переименовываются в *.migrated и остаются как резервная копия.
+        """
+        accounts = self._read_json(accounts_file, list)
+        settings = self._read_json(settings_file, dict)
+
+        def _migrate(conn, accounts, settings):
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return False
+            rows = [tuple(acc.get(column) for column in ACCOUNT_COLUMNS)
+                    for acc in accounts if acc.get("phone") and acc.get("api_id") and acc.get("api_hash")]
+            self._upsert_accounts(conn, rows)
+            conn.executemany(
+                "INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()])
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(time.time()),))
+            return True
+
+        if not await self.run(_migrate, accounts, settings):
+            return
+        logger.info(f"Migrated {len(accounts)} accounts and {len(settings)} settings from JSON into {self.path}")
+        for path in (accounts_file, settings_file):
+            if os.path.exists(path):
+                os.replace(path, path + ".migrated")
+
+    @staticmethod
+    def _read_json(path: str, expected: type):
+        if not os.path.exists(path):
+            return expected()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Не удалось прочитать {path} для миграции: {e}. Файл пропущен.")
+            return expected()
+        if not isinstance(data, expected):
+            logger.error(f"Неожиданный формат {path} для миграции, файл пропущен.")
+            return expected()
+        return data
+
+    @staticmethod
+    def _upsert_accounts(conn, rows):
+        now = time.time()
+        conn.executemany(
+            f"INSERT INTO accounts ({', '.join(ACCOUNT_COLUMNS)}, updated_at) "
+            f"VALUES ({', '.join('?' * len(ACCOUNT_COLUMNS))}, ?) "
+            "ON CONFLICT(phone) DO UPDATE SET "
+            + ", ".join(f"{column} = excluded.{column}" for column in ACCOUNT_COLUMNS[1:])
+            + ", updated_at = excluded.updated_at",
+            [(*row, now) for row in rows])
+
+
+state_store = StateStore(config.STATE_DB_FILE)
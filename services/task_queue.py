@@ -0,0 +1,204 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+import config
+import models
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "mytgparser:task_queue"
+
+
+class TaskQueueFull(Exception):
+    pass
+
+
+class TaskQueue:
+    """
+    Ограниченная приоритетная очередь задач с пулом воркеров.
+
+    Приоритет задачи — количество уже ожидающих/выполняемых задач того же админа,
+    поэтому задачи разных админов чередуются, и один админ не может занять всю очередь.
+    Очередь дублируется в Redis и восстанавливается после перезапуска.
+    """
+
+    def __init__(self, runner: Callable[[models.Task], Awaitable[None]],
+                 workers: int = config.MAX_CONCURRENT_SCRAPING_TASKS,
+                 maxsize: int = config.MAX_QUEUED_TASKS):
+        self._runner = runner
+        self._workers_count = workers
+        self.maxsize = maxsize
+        # Емкость считается по self.queued: записи снятых задач остаются в PriorityQueue
+        # до того, как их вынет воркер, и не должны занимать места в очереди.
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._pending_per_admin: Dict[int, int] = defaultdict(int)
+        # Ключ (приоритет, порядковый номер) действующей записи каждой ожидающей задачи
+        self._keys: Dict[str, Tuple[int, int]] = {}
+        self._workers: List[asyncio.Task] = []
+        self._redis: Optional[aioredis.Redis] = None
+        self.queued: Dict[str, models.Task] = {}
+        self.paused: Dict[str, models.Task] = {}
+        self.busy_workers = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.queued)
+
+    def has_free_worker(self) -> bool:
+        return self.busy_workers < self._workers_count and not self.queued
+
+    async def start(self, redis_url: str):
+        try:
+            self._redis = aioredis.from_url(redis_url, decode_responses=True)
+            restored = await self._restore()
+            logger.info(f"Task queue connected to {redis_url}, restored {restored} tasks.")
+        except Exception as e:
+            logger.error(f"Не удалось восстановить очередь задач из Redis: {e}. Очередь работает только в памяти.")
+            self._redis = None
+
+        for n in range(self._workers_count):
+            self._workers.append(asyncio.create_task(self._worker(n)))
+        logger.info(f"Started {self._workers_count} task queue workers.")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        if self._redis:
+            await self._redis.close()
+
+    async def put(self, task: models.Task) -> int:
+        """Ставит задачу в очередь и возвращает её позицию (1 — следующая на запуск)."""
+        if len(self.queued) >= self.maxsize:
+            raise TaskQueueFull(f"Очередь задач заполнена ({self.maxsize}).")
+        key = (self._pending_per_admin[task.admin_id], next(self._seq))
+        self._queue.put_nowait((*key, task))
+        self._pending_per_admin[task.admin_id] += 1
+        self.queued[task.id] = task
+        self._keys[task.id] = key
+        task.enqueued_at = task.enqueued_at or time.time()
+        # Продолженная задача сохраняется вместе с прогрессом: иначе запись в Redis затрёт
+        # собранных пользователей и курсоры, и после перезапуска сбор начнётся заново
+        await self._persist(task, checkpoint=bool(task.collected_users or task.resume_phase))
+        return sum(1 for other in self._keys.values() if other <= key)
+
+    async def pause_queued(self, task: models.Task):
+        """Снимает ожидающую задачу с очереди; её запись в PriorityQueue будет пропущена воркером."""
+        self._unqueue(task)
+        task.status = "paused"
+        self.paused[task.id] = task
+        await self.checkpoint(task)
+
+    async def resume(self, task: models.Task) -> int:
+        self.paused.pop(task.id, None)
+        task.status = "queued"
+        try:
+            return await self.put(task)
+        except TaskQueueFull:
+            task.status = "paused"
+            self.paused[task.id] = task
+            raise
+
+    async def cancel_queued(self, task: models.Task):
+        self._unqueue(task)
+        self.paused.pop(task.id, None)
+        await self._forget(task)
+
+    def _unqueue(self, task: models.Task):
+        self.queued.pop(task.id, None)
+        if self._keys.pop(task.id, None) is not None:
+            self._release_admin_slot(task.admin_id)
+
+    def _release_admin_slot(self, admin_id: int):
+        self._pending_per_admin[admin_id] -= 1
+        if self._pending_per_admin[admin_id] <= 0:
+            del self._pending_per_admin[admin_id]
+
+    async def _worker(self, n: int):
+        while True:
+            priority, seq, task = await self._queue.get()
+            try:
+                if self._keys.get(task.id) != (priority, seq):
+                    # Задачу сняли с очереди (пауза/отмена) или её ждёт более новая запись
+                    continue
+                del self._keys[task.id]
+                self.queued.pop(task.id, None)
+                self.busy_workers += 1
+                try:
+                    await self._runner(task)
+                    if task.status == "paused":
+                        self.paused[task.id] = task
+                        await self.checkpoint(task)
+                    else:
+                        await self._forget(task)
+                except asyncio.CancelledError:
+                    # Остановка бота: запись остаётся в Redis и будет подхвачена после перезапуска.
+                    raise
+                except Exception:
+                    logger.exception(f"Worker {n}: задача {task.id} завершилась с необработанной ошибкой")
+                    await self._forget(task)
+                finally:
+                    self.busy_workers -= 1
+                    self._release_admin_slot(task.admin_id)
+            finally:
+                self._queue.task_done()
+
+    async def checkpoint(self, task: models.Task):
+        """Сохраняет прогресс выполняемой задачи поверх её записи в очереди."""
+        await self._persist(task, checkpoint=True)
+
+    async def _persist(self, task: models.Task, checkpoint: bool = False):
+        if not self._redis:
+            return
+        # Снимок делается синхронно, поэтому он согласован с состоянием задачи на момент вызова.
+        raw = json.dumps(task.to_dict(checkpoint=checkpoint), ensure_ascii=False)
+        try:
+            await self._redis.hset(QUEUE_KEY, task.id, raw)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить задачу {task.id} в Redis: {e}")
+
+    async def _forget(self, task: models.Task):
+        if not self._redis:
+            return
+        try:
+            await self._redis.hdel(QUEUE_KEY, task.id)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить задачу {task.id} из Redis: {e}")
+
+    async def _restore(self) -> int:
+        stored = await self._redis.hgetall(QUEUE_KEY)
+        records = []
+        for task_id, raw in stored.items():
+            try:
+                records.append(json.loads(raw))
+            except json.JSONDecodeError:
+                logger.warning(f"Повреждённая запись задачи {task_id} в Redis, пропускаю.")
+                await self._redis.hdel(QUEUE_KEY, task_id)
+
+        restored = 0
+        # Прерванные перезапуском задачи продолжаются раньше тех, что ещё не начинались.
+        records.sort(key=lambda d: (d.get("phase", "queued") in ("queued", "starting"), d.get("enqueued_at") or 0))
+        for data in records:
+            task = models.Task.from_dict(data)
+            if task.status == "paused":
+                self.paused[task.id] = task
+                continue
+            if len(self.queued) >= self.maxsize:
+                logger.warning(f"Очередь заполнена при восстановлении, задача {task.id} остаётся в Redis.")
+                break
+            priority, seq = self._pending_per_admin[task.admin_id], next(self._seq)
+            self._queue.put_nowait((priority, seq, task))
+            self._pending_per_admin[task.admin_id] += 1
+            self.queued[task.id] = task
+            self._keys[task.id] = (priority, seq)
+            restored += 1
+        return restored
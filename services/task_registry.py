@@ -0,0 +1,158 @@
+import html
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import config
+import models
+
+logger = logging.getLogger(__name__)
+
+PHASE_TITLES = {
+    "queued": "⏳ В очереди",
+    "starting": "🚀 Запуск",
+    "resolving": "🔎 Проверка цели",
+    "collecting": "📥 Сбор пользователей",
+    "inviting": "✉️ Приглашение",
+    "reporting": "📊 Формирование отчета",
+    "completed": "✅ Завершена",
+    "failed": "❌ Ошибка",
+    "paused": "⏸ Приостановлена",
+    "cancelled": "🛑 Отменена",
+}
+
+
+@dataclass
+class TaskProgress:
+    """Снимок прогресса задачи: скорость считается по счетчикам самой задачи, без обращений к Telegram."""
+    task: models.Task
+    progress_chat_id: Optional[int] = None
+    progress_message_id: Optional[int] = None
+    phase_started_at: float = 0.0
+    phase_messages_start: int = 0
+    phase_users_start: int = 0
+    phase_invites_start: int = 0
+    last_rendered: str = ""
+    last_edit_at: float = 0.0
+
+    @property
+    def phase_elapsed(self) -> float:
+        return max(time.monotonic() - self.phase_started_at, 1e-6)
+
+    @property
+    def messages_per_sec(self) -> float:
+        return (self.task.messages_scanned - self.phase_messages_start) / self.phase_elapsed
+
+    @property
+    def users_per_sec(self) -> float:
+        return (len(self.task.collected_users) - self.phase_users_start) / self.phase_elapsed
+
+    @property
+    def invites_per_sec(self) -> float:
+        return (self.task.invites_processed - self.phase_invites_start) / self.phase_elapsed
+
+    def eta(self) -> Optional[float]:
+        task = self.task
+        if task.phase == "collecting":
+            if task.message_limit > 0 and self.messages_per_sec > 0:
+                return max(task.message_limit - task.messages_scanned, 0) / self.messages_per_sec
+            if task.message_limit == 0 and task.user_limit > 0 and self.users_per_sec > 0:
+                return max(task.user_limit - len(task.collected_users), 0) / self.users_per_sec
+        elif task.phase == "inviting" and self.invites_per_sec > 0:
+            return max(len(task.collected_users) - task.invites_processed, 0) / self.invites_per_sec
+        return None
+
+
+def _format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "—"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60} сек"
+    return f"{seconds} сек"
+
+
+class TaskRegistry:
+    """
+    Реестр задач для отображения прогресса: активные задачи и несколько последних завершенных.
+    """
+
+    def __init__(self, keep_finished: int = config.TASK_HISTORY_SIZE):
+        self.keep_finished = keep_finished
+        self._active: Dict[str, TaskProgress] = {}
+        self._finished: "OrderedDict[str, TaskProgress]" = OrderedDict()
+
+    def register(self, task: models.Task) -> TaskProgress:
+        progress = self._active.get(task.id)
+        if progress is None:
+            progress = TaskProgress(task=task)
+            self._active[task.id] = progress
+        return progress
+
+    def get(self, task_id: str) -> Optional[TaskProgress]:
+        return self._active.get(task_id) or self._finished.get(task_id)
+
+    def set_phase(self, task: models.Task, phase: str):
+        progress = self.register(task)
+        task.phase = phase
+        progress.phase_started_at = time.monotonic()
+        progress.phase_messages_start = task.messages_scanned
+        progress.phase_users_start = len(task.collected_users)
+        progress.phase_invites_start = task.invites_processed
+        logger.info(f"Task {task.id} phase: {phase}")
+
+    def finish(self, task: models.Task):
+        progress = self._active.pop(task.id, None)
+        if progress is None:
+            return
+        self._finished[task.id] = progress
+        while len(self._finished) > self.keep_finished:
+            self._finished.popitem(last=False)
+
+    def active(self) -> List[TaskProgress]:
+        return list(self._active.values())
+
+    def finished(self) -> List[TaskProgress]:
+        return list(reversed(self._finished.values()))
+
+    @staticmethod
+    def render(progress: TaskProgress) -> str:
+        task = progress.task
+        lines = [
+            f"<b>Задача</b> <code>{task.id}</code> — {PHASE_TITLES.get(task.phase, task.phase)}",
+            f"Источник: <code>{html.escape(task.chat_title or task.target_chat or '—')}</code>",
+            f"Сообщений просмотрено: <b>{task.messages_scanned}</b>"
+            + (f" / {task.message_limit}" if task.message_limit else ""),
+            f"Пользователей собрано: <b>{len(task.collected_users)}</b>"
+            + (f" / {task.user_limit}" if task.user_limit else ""),
+        ]
+        if task.skipped_seen:
+            lines.append(f"Пропущено собранных ранее: {len(task.skipped_seen)}")
+        if task.phase == "collecting":
+            lines.append(f"Скорость: {progress.messages_per_sec:.1f} сообщ./сек, {progress.users_per_sec:.1f} польз./сек")
+        if task.phase == "inviting":
+            lines.append(f"Приглашения: {task.invites_processed} / {len(task.collected_users)}")
+        if task.phase in ("collecting", "inviting"):
+            lines.append(f"Осталось примерно: {_format_eta(progress.eta())}")
+        if task.shard_stats:
+            lines.append("Шарды истории:")
+            for shard in task.shard_stats:
+                if shard.finished_at:
+                    state = f"готов за {_format_eta(shard.duration())}"
+                elif shard.started_at:
+                    state = f"идет {_format_eta(time.monotonic() - shard.started_at)}"
+                else:
+                    state = "ожидает"
+                lines.append(f"  #{shard.index} <code>{shard.account_phone}</code>: {shard.messages} сообщ., "
+                             f"{shard.users} польз., {state}")
+        if task.started_at:
+            end = task.finished_at or time.monotonic()
+            lines.append(f"Прошло: {_format_eta(end - task.started_at)}")
+        return "\n".join(lines)
+
+
+task_registry = TaskRegistry()
@@ -1,64 +1,624 @@
 import asyncio
+import html
+import itertools
 import logging
 import time
+from contextlib import aclosing
+from datetime import datetime, timezone
 from telethon import TelegramClient, errors
 from telethon.sessions import StringSession
-from telethon.tl.functions.channels import InviteToChannelRequest
+from telethon.tl.functions.channels import InviteToChannelRequest, GetParticipantsRequest
+from telethon.tl.functions.messages import GetFullChatRequest
 from telethon.tl.types import User
-from telethon.tl.functions.messages import GetHistoryRequest
-from telethon.tl.types import Channel
-from typing import Optional
+from telethon.tl.types import InputPeerChannel, InputPeerChat, ChannelParticipantsSearch
+from typing import Dict, Optional, Tuple
 
 import config
 from services.account_manager import account_mgr
 from services.settings_manager import settings_mgr
 from services.report_generator import make_report, make_caption
+from services.task_queue import TaskQueue, TaskQueueFull
+from services.history_store import history_store
+from services.entity_cache import entity_cache
+from services.task_registry import task_registry, TaskProgress
+from services import metrics
+from services.request_layer import request_layer, AccountCoolingDown
+from services.history_fetcher import iter_history_pages, message_id_before, sender_user_id
+from services.notifier import notifier
+from services.seen_users import seen_users
 import models
-from aiogram import Bot
-from aiogram.types import FSInputFile
 
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=config.BOT_TOKEN)
 
-async def api_call(coro_func, *args, timeout=30, max_backoff=4, **kwargs):
-    backoff = 1
-    while True:
-        try:
-            return await asyncio.wait_for(coro_func(*args, **kwargs), timeout=timeout)
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout for {coro_func.__name__}. Retrying with backoff {backoff}")
-            await asyncio.sleep(backoff)
-            backoff = min(backoff * 2, max_backoff)
-        except errors.FloodWaitError as e:
-            logger.warning(f"FloodWaitError for {coro_func.__name__}. Waiting {e.seconds} seconds.")
-            await asyncio.sleep(e.seconds + 1)
-            backoff = 1
-        except errors.RPCError as e:
-            logger.error(f"RPC Error for {coro_func.__name__}: {e}")
-            raise
-        except Exception as e:
-            logger.error(f"Unexpected error in api_call for {coro_func.__name__}: {e}")
-            raise
+class TaskInterrupted(Exception):
+    """Задачу остановил админ; выбрасывается в точках проверки внутри циклов сбора и приглашения."""
+
+
+class TaskPaused(TaskInterrupted):
+    pass
+
+
+class TaskCancelled(TaskInterrupted):
+    pass
+
+
+def check_control(task: models.Task):
+    if task.control == "cancel":
+        raise TaskCancelled(task.id)
+    if task.control == "pause":
+        raise TaskPaused(task.id)
+
+
+def is_new_user(task: models.Task, user_id: int) -> bool:
+    """В режиме «только новые» отсеивает пользователей из отчетов прошлых задач и запоминает пропущенных."""
+    if not task.only_new:
+        return True
+    if user_id in task.skipped_seen:
+        return False
+    if user_id in seen_users:
+        task.skipped_seen.add(user_id)
+        return False
+    return True
+
+
+def user_limit_reached(task: models.Task, users: models.UserCollection) -> bool:
+    """
+    Можно ли остановить чтение истории по лимиту пользователей. С порогом min_messages нельзя:
+    число сообщений отправителя известно только после чтения всей истории, лимит применяется
+    при отборе (_select_active_users).
+    """
+    return not task.min_messages and len(users) >= task.user_limit > 0
+
 
 class TaskRunner:
     def __init__(self):
         self.running_tasks = {}
         self.running_tasks_count = 0
+        self.queue = TaskQueue(self._execute)
+        self.registry = task_registry
+        self._background_jobs: set = set()
+        # Задержка автоматического продолжения задач, остановленных паузой аккаунта
+        self._cooldown_resumes: Dict[str, float] = {}
+        metrics.queue_depth.set_function(lambda: self.queue.size)
+        metrics.busy_workers.set_function(lambda: self.queue.busy_workers)
+        metrics.running_tasks.set_function(lambda: self.running_tasks_count)
+
+    async def start(self, redis_url: str):
+        await self.queue.start(redis_url)
+        for task in self.queue.queued.values():
+            self.registry.register(task)
+        for task in self.queue.paused.values():
+            self.registry.set_phase(task, "paused")
+
+    async def stop(self):
+        await self.queue.stop()
 
     async def run(self, task: models.Task, admin_user_id: int):
-        if self.running_tasks_count >= config.MAX_CONCURRENT_SCRAPING_TASKS:
-            task.status = "queued"
-            await bot.send_message(admin_user_id,
-                                   f"Задача <code>{task.id}</code> поставлена в очередь. Макс. количество одновременно выполняемых задач: {config.MAX_CONCURRENT_SCRAPING_TASKS}.")
+        task.admin_id = task.admin_id or admin_user_id
+        starts_now = self.queue.has_free_worker()
+        self.registry.register(task)
+        try:
+            position = await self.queue.put(task)
+        except TaskQueueFull as e:
+            task.status = "failed"
+            task.phase = "failed"
+            self.registry.finish(task)
+            logger.warning(f"Task {task.id} rejected: {e}")
+            notifier.notify(admin_user_id,
+                            f"❌ Задача <code>{task.id}</code> не принята: {html.escape(str(e))} Попробуйте позже.")
             return
 
+        if not starts_now:
+            task.status = "queued"
+            notifier.notify(admin_user_id,
+                            f"Задача <code>{task.id}</code> поставлена в очередь, позиция: {position}. Макс. количество одновременно выполняемых задач: {config.MAX_CONCURRENT_SCRAPING_TASKS}.")
+
+    def _find(self, task_id: str) -> Optional[models.Task]:
+        progress = self.registry.get(task_id)
+        return progress.task if progress else None
+
+    async def pause(self, task_id: str) -> bool:
+        """Ставит задачу на паузу: в очереди — сразу, выполняемую — в ближайшей точке проверки."""
+        task = self._find(task_id)
+        if task is None:
+            return False
+        if task.id in self.queue.queued:
+            await self.queue.pause_queued(task)
+            self.registry.set_phase(task, "paused")
+            return True
+        if task.id in self.running_tasks and task.status == "running":
+            task.control = "pause"
+            return True
+        return False
+
+    async def resume(self, task_id: str) -> Optional[int]:
+        """Возвращает приостановленную задачу в очередь; результат — позиция в очереди."""
+        task = self.queue.paused.get(task_id)
+        if task is None:
+            return None
+        task.control = None
+        task.phase = "queued"
+        try:
+            return await self.queue.resume(task)
+        except TaskQueueFull as e:
+            task.phase = "paused"
+            logger.warning(f"Task {task.id} not resumed: {e}")
+            return None
+
+    async def cancel(self, task_id: str) -> bool:
+        """
+        Отменяет задачу. Выполняемая задача остановится в ближайшей точке проверки
+        и пришлёт отчет по уже собранным данным; приостановленная — пришлёт его сразу.
+        """
+        task = self._find(task_id)
+        if task is None:
+            return False
+        if task.id in self.running_tasks and task.status == "running":
+            task.control = "cancel"
+            return True
+        if task.id in self.queue.queued or task.id in self.queue.paused:
+            await self.queue.cancel_queued(task)
+            task.status = "cancelled"
+            task.phase = "cancelled"
+            self.registry.finish(task)
+            if len(task.collected_users):
+                # Отчет строится в фоне: ответ на нажатие "Отменить" не ждёт сборки и отправки файла
+                self._spawn(self._send_partial_report(task))
+            return True
+        return False
+
+    def _spawn(self, coro):
+        job = asyncio.create_task(coro)
+        self._background_jobs.add(job)
+        job.add_done_callback(self._background_jobs.discard)
+
+    async def _resume_after(self, task_id: str, delay: float):
+        await asyncio.sleep(delay)
+        if await self.resume(task_id) is None:
+            logger.warning(f"Task {task_id} was not resumed automatically after the account cooldown.")
+
+    async def _send_partial_report(self, task: models.Task):
+        try:
+            await self._send_report(task, task.admin_id)
+        except Exception:
+            logger.exception(f"Не удалось сформировать частичный отчет по задаче {task.id}")
+
+    async def _send_report(self, task: models.Task, admin_user_id: int):
+        report_path = await make_report(task, task.target_chat if task.target_chat else "users_list")
+        report_caption = make_caption(task, task.target_chat if task.target_chat else "Список пользователей")
+        # Подпись отчета - обычный текст, а бот по умолчанию разбирает HTML
+        await notifier.send_document(admin_user_id, report_path, caption=report_caption, parse_mode=None)
+        # Пользователи из доставленного отчета больше не считаются новыми для следующих задач
+        added = await seen_users.remember(task.collected_users.ids())
+        logger.info(f"Task {task.id}: {added} users added to the seen users filter.")
+
+    async def _execute(self, task: models.Task):
         self.running_tasks_count += 1
-        self.running_tasks[task.id] = asyncio.create_task(
-            self._run_task_internal(task, admin_user_id)
-        )
+        self.running_tasks[task.id] = asyncio.current_task()
         logger.info(f"Starting task {task.id}. Current running tasks: {self.running_tasks_count}")
-        await bot.send_message(admin_user_id, f"Задача <code>{task.id}</code> запущена.")
+        progress = self.registry.register(task)
+        self.registry.set_phase(task, "starting")
+        try:
+            if task.resume_phase:
+                logger.info(f"Resuming task {task.id} from checkpoint (phase {task.resume_phase}, "
+                            f"{task.messages_scanned} messages, {len(task.collected_users)} users).")
+                notifier.notify(task.admin_id, f"♻️ Задача <code>{task.id}</code> продолжается "
+                                               f"с сохраненного места.")
+            message = await notifier.send(task.admin_id, self.registry.render(progress))
+            progress.progress_chat_id = message.chat.id
+            progress.progress_message_id = message.message_id
+        except Exception as e:
+            logger.warning(f"Не удалось отправить сообщение о прогрессе задачи {task.id}: {e}")
+
+        reporter = asyncio.create_task(self._report_progress(progress))
+        checkpointer = asyncio.create_task(self._checkpoint_loop(task))
+        try:
+            await self._run_task_internal(task, task.admin_id)
+        except asyncio.CancelledError:
+            # Остановка бота: сохраняем последнее состояние, задача продолжится после перезапуска.
+            await self.queue.checkpoint(task)
+            raise
+        finally:
+            reporter.cancel()
+            checkpointer.cancel()
+            if task.status != "paused":
+                self.registry.finish(task)
+            self._edit_progress(progress, force=True)
+            delay = self._cooldown_resumes.pop(task.id, None)
+            if delay is not None:
+                # Запускается после возврата в воркер очереди, который переносит задачу в paused
+                self._spawn(self._resume_after(task.id, delay))
+
+    async def _checkpoint_loop(self, task: models.Task):
+        while True:
+            await asyncio.sleep(config.TASK_CHECKPOINT_INTERVAL_SEC)
+            await self.queue.checkpoint(task)
+
+    async def _set_phase(self, task: models.Task, phase: str):
+        self.registry.set_phase(task, phase)
+        await self.queue.checkpoint(task)
+
+    async def _report_progress(self, progress: TaskProgress):
+        """Обновляет одно сообщение о прогрессе не чаще PROGRESS_UPDATE_INTERVAL_SEC, склеивая промежуточные изменения."""
+        while True:
+            await asyncio.sleep(config.PROGRESS_UPDATE_INTERVAL_SEC)
+            self._edit_progress(progress)
+
+    def _edit_progress(self, progress: TaskProgress, force: bool = False):
+        if progress.progress_message_id is None:
+            return
+        now = time.monotonic()
+        if not force and now < progress.last_edit_at + config.PROGRESS_UPDATE_INTERVAL_SEC:
+            return
+        text = self.registry.render(progress)
+        if text == progress.last_rendered:
+            return
+        # Доставка, повтор при 429 и замена устаревшей неотправленной правки — в notifier
+        notifier.edit(progress.progress_chat_id, progress.progress_message_id, text)
+        progress.last_rendered = text
+        progress.last_edit_at = now
+
+    async def _scan_history(self, task: models.Task, client: TelegramClient, entity,
+                            users: models.UserCollection, activity: models.UserActivity,
+                            limit: Optional[int] = None, min_id: int = 0, max_id: int = 0, label: str = "",
+                            account: str = "unknown", track_cursor: bool = False,
+                            shard: Optional[models.ShardStat] = None) -> Tuple[int, int]:
+        """
+        Читает историю (min_id, max_id) от новых к старым, добавляет отправителей в users,
+        а их сообщения учитывает в activity.
+        При FloodWait ждёт и продолжает с последнего прочитанного сообщения.
+        С track_cursor=True позиция сохраняется в задаче для продолжения после перезапуска.
+        Счётчики shard обновляются по ходу чтения, чтобы прогресс шардов был виден в карточке задачи.
+        Возвращает (количество сообщений, id самого нового сообщения).
+        """
+        total_messages = 0
+        top_message_id = min_id
+        uncached_senders = set()
+
+        def handle(msg_id: int, sender_id: Optional[int], sender) -> bool:
+            """Учитывает одно сообщение; True — достигнут лимит пользователей."""
+            nonlocal total_messages, top_message_id
+            # До счётчиков: сообщение, на котором задачу остановили, будет прочитано после продолжения
+            if task.control:
+                check_control(task)
+            total_messages += 1
+            task.messages_scanned += 1
+            top_message_id = max(top_message_id, msg_id)
+            if track_cursor:
+                task.history_offset_id = msg_id
+                task.history_top_id = max(task.history_top_id, msg_id)
+            if shard is not None:
+                shard.messages = total_messages
+                shard.users = len(users)
+            if total_messages % 100 == 0:
+                metrics.messages_scanned.inc(100)
+                logger.info(f"{label}Processed {total_messages} messages, collected {len(users)} users.")
+            if sender is None:
+                # Отправитель не пришёл вместе с сообщением — попробуем взять его из кэша пользователей.
+                if sender_id and sender_id > 0 and sender_id not in users and is_new_user(task, sender_id):
+                    uncached_senders.add(sender_id)
+            elif (isinstance(sender, User) and not sender.bot and sender.id not in users
+                  and is_new_user(task, sender.id)):
+                users.add(models.UserStub(
+                    user_id=sender.id,
+                    username=sender.username,
+                    first_name=sender.first_name,
+                    last_name=sender.last_name,
+                    phone=sender.phone
+                ))
+                metrics.users_collected.inc()
+                if user_limit_reached(task, users):
+                    logger.info(f"{label}Collected {len(users)} users. Reached user limit.")
+                    return True
+            return False
+
+        if config.HISTORY_RAW_FETCH:
+            # Сырые страницы GetHistoryRequest: отправители берутся из вектора users ответа,
+            # объекты Message не создаются, FloodWait обрабатывает request_layer.
+            async with aclosing(iter_history_pages(client, entity, account, min_id=min_id, max_id=max_id,
+                                                   limit=limit)) as pages:
+                async for page in pages:
+                    handled = 0
+                    try:
+                        for message in page.messages:
+                            sender_id = sender_user_id(message)
+                            stop = handle(message.id, sender_id, page.users.get(sender_id))
+                            handled += 1
+                            if stop:
+                                break
+                        else:
+                            continue
+                        break
+                    finally:
+                        # Активность считается по той же части страницы, что учтена в счётчиках и курсоре
+                        activity.add_messages(page.messages[:handled])
+        else:
+            finished = False
+            batch = []
+            while not finished:
+                remaining = limit - total_messages if limit else None
+                try:
+                    async for msg in client.iter_messages(entity, limit=remaining, min_id=min_id, max_id=max_id):
+                        max_id = msg.id
+                        stop = handle(msg.id, msg.sender_id, msg.sender)
+                        batch.append(msg)
+                        if len(batch) >= config.HISTORY_PAGE_SIZE:
+                            activity.add_messages(batch)
+                            batch.clear()
+                        if stop:
+                            break
+                    finished = True
+                except errors.FloodWaitError as e:
+                    logger.warning(f"{label}FloodWaitError: {e.seconds}s, resuming below message {max_id}.")
+                    # Долгий FloodWait отправляет аккаунт на паузу вместо того, чтобы спать внутри задачи
+                    await request_layer.for_account(account).on_flood_wait("history", e.seconds)
+                finally:
+                    activity.add_messages(batch)
+                    batch.clear()
+        metrics.messages_scanned.inc(total_messages % 100)
+
+        uncached_senders.difference_update(users.ids())
+        if uncached_senders and not user_limit_reached(task, users):
+            cached = await entity_cache.get_users(uncached_senders)
+            for user_stub in cached.values():
+                if user_limit_reached(task, users):
+                    break
+                if users.add(user_stub):
+                    metrics.users_collected.inc()
+            logger.info(f"{label}Restored {len(cached)} of {len(uncached_senders)} senders from the user cache.")
+        return total_messages, top_message_id
+
+    async def _run_shard(self, task: models.Task, shard: models.ShardStat, client: TelegramClient, entity):
+        # Шард может читаться повторно после падения: счётчики начинаются заново
+        shard.started_at, shard.finished_at = time.monotonic(), None
+        shard.messages = shard.users = 0
+        users = models.UserCollection()
+        # Своя активность у шарда: если он упадёт и будет перечитан, сообщения не посчитаются дважды
+        activity = models.UserActivity()
+        if entity is None:
+            # У каждого аккаунта свой access_hash, поэтому цель резолвится его же клиентом.
+            entity = (await entity_cache.resolve(client, shard.account_phone, task.target_chat)).input_peer
+        shard.messages, _ = await self._scan_history(
+            task, client, entity, users, activity, min_id=shard.min_id, max_id=shard.max_id + 1,
+            label=f"[{task.id} shard {shard.index}] ", account=shard.account_phone, shard=shard)
+        shard.users = len(users)
+        shard.finished_at = time.monotonic()
+        logger.info(f"Task {task.id} shard {shard.index} ({shard.account_phone}) finished: "
+                    f"{shard.messages} messages, {shard.users} users in {shard.duration():.2f}s")
+        return users, activity
+
+    async def _collect_sharded(self, task: models.Task, client: TelegramClient, entity, min_id: int,
+                               max_id: int = 0) -> Optional[int]:
+        """
+        Делит диапазон id сообщений (min_id, max_id) на непересекающиеся шарды и читает их параллельно
+        с разных свободных аккаунтов. Возвращает id самого нового сообщения или None,
+        если шардирование невозможно (нет дополнительных свободных аккаунтов).
+        """
+        if max_id:
+            top_id = max_id - 1
+        else:
+            latest = await request_layer.call(task.account_phone, client, client.get_messages, entity, limit=1)
+            if not latest:
+                return None
+            top_id = latest[0].id
+        low_id = max(min_id, top_id - task.message_limit) if task.message_limit else min_id
+
+        extra = []
+        while (len(extra) + 1 < config.MAX_HISTORY_SHARDS
+               and (top_id - low_id) // (len(extra) + 2) >= config.SHARD_MIN_MESSAGES):
+            leased = await account_mgr.acquire_free()
+            if not leased:
+                break
+            extra.append(leased)
+        if not extra:
+            return None
+
+        try:
+            clients = [(task.account_phone, client, entity)] + [(a.phone, c, None) for a, c in extra]
+            count = len(clients)
+            span = top_id - low_id
+            shards = []
+            for index, (phone, shard_client, shard_entity) in enumerate(clients):
+                # Шард 0 — самые новые сообщения, чтобы порядок пользователей совпадал с обычным сбором.
+                high = top_id - span * index // count
+                low = top_id - span * (index + 1) // count
+                shards.append((models.ShardStat(index=index, account_phone=phone, min_id=low, max_id=high),
+                               shard_client, shard_entity))
+            task.shard_stats = [shard for shard, _, _ in shards]
+            logger.info(f"Task {task.id}: scanning messages {low_id + 1}..{top_id} in {count} shards.")
+
+            results = await asyncio.gather(
+                *(self._run_shard(task, shard, shard_client, shard_entity) for shard, shard_client, shard_entity in shards),
+                return_exceptions=True)
+
+            for result in results:
+                if isinstance(result, TaskInterrupted):
+                    raise result
+            # Сообщения упавших шардов уже попали в счётчик задачи и будут прочитаны заново
+            task.messages_scanned = sum(shard.messages for (shard, _, _), result in zip(shards, results)
+                                        if not isinstance(result, Exception))
+            for (shard, _, _), result in zip(shards, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"Task {task.id} shard {shard.index} failed on {shard.account_phone}: {result}. "
+                                   f"Re-reading it with the main account.")
+                    shard.account_phone = task.account_phone
+                    result = await self._run_shard(task, shard, client, entity)
+                users, activity = result
+                task.activity.merge(activity)
+                for user_stub in users:
+                    if user_limit_reached(task, task.collected_users):
+                        break
+                    task.collected_users.add(user_stub)
+        finally:
+            for acc, _ in extra:
+                await account_mgr.release(acc)
+        return top_id
+
+    async def _collect_participants(self, task: models.Task, client: TelegramClient, entity):
+        """
+        Собирает участников канала постранично, запоминая смещение в task.participants_offset.
+        Участники обычной группы приходят одним запросом, для них смещение не нужно.
+        """
+        def add(participant) -> bool:
+            if not isinstance(participant, User) or participant.bot or not is_new_user(task, participant.id):
+                return False
+            user_stub = models.UserStub(
+                user_id=participant.id,
+                username=participant.username,
+                first_name=participant.first_name,
+                last_name=participant.last_name,
+                phone=participant.phone
+            )
+            if task.collected_users.add(user_stub):
+                metrics.users_collected.inc()
+            return len(task.collected_users) >= task.user_limit
+
+        if isinstance(entity, InputPeerChat):
+            check_control(task)
+            result = await request_layer.call(task.account_phone, client, GetFullChatRequest(entity.chat_id))
+            for user in result.users:
+                if add(user):
+                    break
+            return
+
+        while len(task.collected_users) < task.user_limit:
+            check_control(task)
+            result = await request_layer.call(task.account_phone, client, GetParticipantsRequest(
+                entity, ChannelParticipantsSearch(''), offset=task.participants_offset, limit=200, hash=0))
+            if not result.participants:
+                break
+            task.participants_offset += len(result.participants)
+            for user in result.users:
+                if add(user):
+                    logger.info(f"Collected {len(task.collected_users)} users. Reached user limit.")
+                    return
+
+    def _select_active_users(self, task: models.Task):
+        """
+        Оставляет среди собранных из истории отправителей с не меньше чем min_messages сообщений
+        и применяет лимит пользователей, на котором чтение истории с порогом не останавливалось.
+        """
+        if not task.min_messages:
+            return
+        activity = task.activity
+        kept = 0
+        for user_id in list(task.collected_users.ids()):
+            row = activity.row_of(user_id)
+            if row is not None and activity.messages[row] < task.min_messages:
+                task.collected_users.discard(user_id)
+                task.below_min_messages += 1
+            elif task.user_limit > 0 and kept >= task.user_limit:
+                task.collected_users.discard(user_id)
+            else:
+                kept += 1
+        logger.info(f"Task {task.id}: {kept} users with at least {task.min_messages} messages selected, "
+                    f"{task.below_min_messages} below the threshold.")
+
+    async def _date_window_ids(self, task: models.Task, client: TelegramClient, entity) -> Optional[Tuple[int, int]]:
+        """
+        Переводит окно дат задачи в (min_id, max_id) для GetHistoryRequest: Telegram отдаёт только
+        сообщения окна, и чтение заканчивается на первой же странице за его нижней границей.
+        max_id = 0 — окно открыто до последнего сообщения. None — в окне нет сообщений.
+        """
+        min_id = max_id = 0
+        if task.date_from is not None:
+            min_id = await message_id_before(client, entity, task.account_phone,
+                                             datetime.fromtimestamp(task.date_from, timezone.utc))
+        if task.date_to is not None:
+            last_id = await message_id_before(client, entity, task.account_phone,
+                                              datetime.fromtimestamp(task.date_to, timezone.utc))
+            if last_id <= min_id:
+                return None
+            max_id = last_id + 1
+        return min_id, max_id
+
+    async def _collect_from_history(self, task: models.Task, client: TelegramClient, entity):
+        window_min_id = window_max_id = 0
+        if task.has_date_window:
+            window = await self._date_window_ids(task, client, entity)
+            if window is None:
+                logger.info(f"No messages in {task.chat_title} within {task.date_window_label()}.")
+                return
+            window_min_id, window_max_id = window
+            logger.info(f"Date window {task.date_window_label()} of {task.chat_title}: messages after id "
+                        f"{window_min_id}" + (f" and before id {window_max_id}." if window_max_id else "."))
+
+        # Окно дат читает прошлый срез истории: отметка инкрементального сбора к нему не относится
+        incremental = task.incremental and not task.has_date_window
+        if incremental and isinstance(entity, InputPeerChat):
+            # id сообщений обычной группы свои у каждого аккаунта: отметка, сохраненная одним
+            # аккаунтом, для другого ничего не значит
+            logger.info(f"Incremental scrape is not available for basic group {task.chat_title}, reading full range.")
+            incremental = False
+        checkpoint = await history_store.get(task.chat_id) if incremental else None
+        min_id = max(window_min_id, checkpoint.last_message_id if checkpoint else 0)
+        if checkpoint:
+            logger.info(f"Incremental scrape of {task.chat_title}: reading messages after id {min_id}, "
+                        f"{len(checkpoint.senders)} senders known from previous runs.")
+        logger.info(f"Collecting users from {task.chat_title} (limit {task.message_limit or 'none'} messages)...")
+
+        top_message_id = None
+        resuming = task.history_offset_id > 0
+        if not resuming:
+            # Шарды не ведут курсор и отдают пользователей только по завершении: прерванный шардированный
+            # сбор начинается заново, и его счётчики не должны учитываться дважды
+            task.messages_scanned = 0
+            task.activity = models.UserActivity()
+            task.shard_stats = []
+        if (config.HISTORY_SHARDING_ENABLED and not resuming and isinstance(entity, InputPeerChannel)
+                and (task.message_limit == 0 or task.message_limit >= 2 * config.SHARD_MIN_MESSAGES)):
+            top_message_id = await self._collect_sharded(task, client, entity, min_id, window_max_id)
+        # Дочитана ли история до min_id: только тогда отметка инкрементального сбора может сдвинуться
+        reached_min_id = False
+        if top_message_id is None:
+            # Лимит 0 бывает только с окном дат: читаются все сообщения окна
+            limit = task.message_limit or None
+            if resuming:
+                if limit:
+                    limit = max(limit - task.messages_scanned, 0)
+                logger.info(f"Resuming history scan of {task.chat_title} below message {task.history_offset_id}, "
+                            f"{limit if limit is not None else 'all'} messages left.")
+            total_messages, top_message_id = 0, min_id
+            if limit != 0 and not user_limit_reached(task, task.collected_users):
+                total_messages, top_message_id = await self._scan_history(
+                    task, client, entity, task.collected_users, task.activity, limit=limit, min_id=min_id,
+                    max_id=task.history_offset_id or window_max_id, account=task.account_phone,
+                    track_cursor=True)
+                reached_min_id = limit is None or total_messages < limit
+            top_message_id = max(top_message_id, task.history_top_id)
+            logger.info(f"Finished collecting. Total messages processed: {total_messages}, "
+                        f"total users collected: {len(task.collected_users)}")
+        else:
+            logger.info(f"Finished sharded collecting. Total messages processed: "
+                        f"{sum(s.messages for s in task.shard_stats)}, total users collected: {len(task.collected_users)}")
+            reached_min_id = min(shard.min_id for shard in task.shard_stats) <= min_id
+        if user_limit_reached(task, task.collected_users):
+            reached_min_id = False
+
+        new_senders = list(task.collected_users) if incremental else []
+        self._select_active_users(task)
+
+        if incremental:
+            if checkpoint and task.min_messages:
+                # Число сообщений отправителей из прошлых запусков не хранится, порог к ним не применить:
+                # с порогом в отчет попадают только писавшие в прочитанной части истории
+                logger.info(f"Activity threshold is set: {len(checkpoint.senders)} previously known senders "
+                            f"are not merged.")
+            elif checkpoint:
+                for user_stub in checkpoint.senders:
+                    if task.user_limit > 0 and len(task.collected_users) >= task.user_limit:
+                        break
+                    if is_new_user(task, user_stub.user_id):
+                        task.collected_users.add(user_stub)
+                logger.info(f"Merged previously known senders, total users: {len(task.collected_users)}")
+            if not reached_min_id:
+                # Сообщения между min_id и прочитанной частью остались непрочитанными: отметка
+                # не сдвигается, иначе следующий сбор их пропустит
+                logger.info(f"History of {task.chat_title} was not read down to message {min_id}, "
+                            f"incremental checkpoint stays at {min_id}.")
+                top_message_id = min_id
+            await history_store.save(task.chat_id, top_message_id, new_senders)
 
     async def _run_task_internal(self, task: models.Task, admin_user_id: int):
         client: Optional[TelegramClient] = None
@@ -66,118 +626,80 @@ class TaskRunner:
         try:
             task.status = "running"
             task.started_at = time.monotonic()
+            resume_phase, task.resume_phase = task.resume_phase, None
+            await self._set_phase(task, "resolving")
 
-            acc = await account_mgr.get_free_account()
-            if not acc:
+            leased = await account_mgr.acquire_free()
+            if not leased:
                 raise RuntimeError("Нет свободных аккаунтов для выполнения задачи.")
-
-            client = acc.client()
-            await client.start()
+            acc, client = leased
             task.account_phone = acc.phone
 
-            entity = await api_call(client.get_entity, task.target_chat)
+            target = await entity_cache.resolve(client, acc.phone, task.target_chat)
+            if target.peer_type == "user":
+                if target.is_bot:
+                    raise ValueError(f"Цель {task.target_chat} является ботом, сбор из ботов не поддерживается.")
+                raise ValueError("Цель не является поддерживаемым типом (канал или группа).")
+            task.chat_id = target.peer_id
+            task.chat_title = target.title
+            entity = target.input_peer
+            logger.info(f"Target is {target.peer_type}: {target.title} ({target.peer_id})")
 
-            if isinstance(entity, Channel):
-                task.chat_id = entity.id
-                task.chat_title = entity.title
-                logger.info(f"Target is Channel: {entity.title} ({entity.id})")
-            elif isinstance(entity, User) and entity.bot:
-                raise ValueError(f"Цель {task.target_chat} является ботом, сбор из ботов не поддерживается.")
-            else:
-                try:
-                    full_entity = await api_call(client(entity))
-                    if hasattr(full_entity, 'chats') and len(full_entity.chats) > 0:
-                        chat_obj = full_entity.chats[0]
-                        if isinstance(chat_obj, Channel):
-                            task.chat_id = chat_obj.id
-                            task.chat_title = chat_obj.title
-                            logger.info(f"Target is Channel (via User entity): {chat_obj.title} ({chat_obj.id})")
-                        elif isinstance(chat_obj, models.Chat):
-                            task.chat_id = chat_obj.id
-                            task.chat_title = chat_obj.title
-                            logger.info(f"Target is Chat: {chat_obj.title} ({chat_obj.id})")
-                        else:
-                            raise ValueError("Цель не является поддерживаемым типом (канал или группа).")
-                    else:
-                        raise ValueError("Цель не является поддерживаемым типом (канал или группа).")
-                except Exception as e:
-                    raise ValueError(
-                        f"Не удалось получить информацию о цели {task.target_chat}: {e}.")
-
-            if task.message_limit > 0:
-                logger.info(f"Collecting users from {task.chat_title} (limit {task.message_limit} messages)...")
-                total_messages = 0
-                async for msg in client.iter_messages(entity, limit=task.message_limit):
-                    total_messages += 1
-                    if msg.sender and isinstance(msg.sender, User) and not msg.sender.bot:
-                        user_stub = models.UserStub(
-                            user_id=msg.sender.id,
-                            username=msg.sender.username,
-                            first_name=msg.sender.first_name,
-                            last_name=msg.sender.last_name,
-                            phone=msg.sender.phone
-                        )
-                        if user_stub.user_id not in [u.user_id for u in task.collected_users]:
-                            task.collected_users.append(user_stub)
-                            if len(task.collected_users) >= task.user_limit and task.user_limit > 0:
-                                logger.info(f"Collected {len(task.collected_users)} users. Reached user limit.")
-                                break
-                    if total_messages % 100 == 0:
-                        logger.info(
-                            f"Processed {total_messages} messages, collected {len(task.collected_users)} users.")
-                logger.info(
-                    f"Finished collecting. Total messages processed: {total_messages}, total users collected: {len(task.collected_users)}")
+            collected = resume_phase in ("inviting", "reporting")
+            if task.only_new and not collected:
+                await seen_users.load()
+            if not collected:
+                await self._set_phase(task, "collecting")
+            if collected:
+                logger.info(f"Task {task.id}: {len(task.collected_users)} users restored from checkpoint.")
+            elif task.message_limit > 0 or task.has_date_window:
+                await self._collect_from_history(task, client, entity)
             elif task.user_limit > 0 and task.message_limit == 0:
                 logger.info(f"Collecting users directly from chat participants (limit {task.user_limit})...")
-                if isinstance(entity, (Channel, models.Chat)):
+                if isinstance(entity, (InputPeerChannel, InputPeerChat)):
                     try:
-                        async for participant in client.iter_participants(entity, limit=task.user_limit):
-                            if isinstance(participant, User) and not participant.bot:
-                                user_stub = models.UserStub(
-                                    user_id=participant.id,
-                                    username=participant.username,
-                                    first_name=participant.first_name,
-                                    last_name=participant.last_name,
-                                    phone=participant.phone
-                                )
-                                if user_stub.user_id not in [u.user_id for u in task.collected_users]:
-                                    task.collected_users.append(user_stub)
-                                    if len(task.collected_users) >= task.user_limit:
-                                        logger.info(f"Collected {len(task.collected_users)} users. Reached user limit.")
-                                        break
+                        await self._collect_participants(task, client, entity)
                         logger.info(
                             f"Finished collecting participants. Total users collected: {len(task.collected_users)}")
                     except errors.RPCError as e:
                         logger.warning(f"Ошибка при получении участников чата {task.chat_title}: {e}")
-                        await bot.send_message(admin_user_id,
-                                               f"⚠️ Не удалось собрать участников из {task.chat_title}: {e}")
+                        notifier.notify(admin_user_id,
+                                        f"⚠️ Не удалось собрать участников из {html.escape(task.chat_title)}: "
+                                        f"{html.escape(str(e))}")
                 else:
                     logger.warning("Прямой сбор участников возможен только для каналов/групп.")
-                    await bot.send_message(admin_user_id,
-                                           "⚠️ Прямой сбор участников возможен только для каналов/групп.")
+                    notifier.notify(admin_user_id,
+                                    "⚠️ Прямой сбор участников возможен только для каналов/групп.")
 
-            if task.invite_enabled and len(task.collected_users) > 0:
+            await entity_cache.remember_users(task.collected_users)
+
+            if task.invite_enabled and len(task.collected_users) > 0 and resume_phase != "reporting":
                 invite_channel_username = settings_mgr.get_channel()
                 if invite_channel_username:
+                    await self._set_phase(task, "inviting")
                     logger.info(f"Inviting collected users to {invite_channel_username}...")
                     try:
-                        invite_channel_entity = await api_call(client.get_entity, invite_channel_username)
-                        if not isinstance(invite_channel_entity, Channel):
+                        invite_channel = await entity_cache.resolve(client, acc.phone, invite_channel_username)
+                        if invite_channel.peer_type != "channel":
                             raise ValueError("Канал для приглашений не является действительным каналом Telegram.")
+                        invite_channel_entity = invite_channel.input_peer
 
-                        for user_stub in task.collected_users:
+                        # invites_processed — курсор: после перезапуска обработанные пользователи пропускаются
+                        for user_stub in itertools.islice(task.collected_users, task.invites_processed, None):
+                            check_control(task)
                             try:
-                                await api_call(InviteToChannelRequest, invite_channel_entity, [user_stub.user_id])
+                                # Темп приглашений (INVITE_DELAY_SEC) выдерживает ведро токенов группы "invite"
+                                await request_layer.call(acc.phone, client, InviteToChannelRequest(
+                                    invite_channel_entity, [user_stub.user_id]))
                                 task.invited_users.append(user_stub)
+                                metrics.invites_processed.inc(result="invited")
                                 logger.info(f"Invited user {user_stub.user_id} to {invite_channel_username}")
-                                await asyncio.sleep(config.INVITE_DELAY_SEC)
 
+                            except (AccountCoolingDown, TaskInterrupted):
+                                raise
                             except errors.RPCError as rpc_e:
-                                if isinstance(rpc_e, errors.FloodWaitError):
-                                    logger.warning(f"FloodWaitError during invite: {rpc_e.seconds}s. Waiting...")
-                                    await asyncio.sleep(rpc_e.seconds + 1)
-                                    task.failed_other += 1
-                                elif isinstance(rpc_e, errors.UserPrivacyRestrictedError):
+                                metrics.invites_processed.inc(result=type(rpc_e).__name__)
+                                if isinstance(rpc_e, errors.UserPrivacyRestrictedError):
                                     task.failed_privacy += 1
                                     logger.warning(f"User {user_stub.user_id} privacy restricted.")
                                 elif isinstance(rpc_e, errors.UserAlreadyParticipantError):
@@ -191,50 +713,104 @@ class TaskRunner:
                                     task.failed_other += 1
                                     logger.error(f"Other RPCError inviting {user_stub.user_id}: {rpc_e}")
                             except Exception as e:
+                                metrics.invites_processed.inc(result="error")
                                 task.failed_other += 1
                                 logger.error(f"Unhandled error during invitation for user {user_stub.user_id}: {e}")
+                            task.invites_processed += 1
 
                         task.invite_status = "success"
                         logger.info(
                             f"Finished inviting users to {invite_channel_username}. Invited: {len(task.invited_users)}")
 
+                    except TaskInterrupted:
+                        raise
+                    except AccountCoolingDown as e:
+                        task.invite_status = "cooldown"
+                        logger.warning(f"Приглашение в {invite_channel_username} остановлено: {e}")
+                        notifier.notify(admin_user_id,
+                                        f"⏸ Приглашение остановлено: {html.escape(str(e))} "
+                                        f"Приглашено {len(task.invited_users)} из {len(task.collected_users)}.")
                     except ValueError as e:
                         task.invite_status = "failed"
                         logger.error(f"Ошибка при подготовке к приглашению: {e}")
-                        await bot.send_message(admin_user_id,
-                                               f"❌ Ошибка приглашения: {e}. Проверьте канал в настройках.")
+                        notifier.notify(admin_user_id,
+                                        f"❌ Ошибка приглашения: {html.escape(str(e))}. Проверьте канал в настройках.")
                     except Exception as e:
                         task.invite_status = "failed"
                         logger.exception(f"Непредвиденная ошибка при приглашении в канал {invite_channel_username}")
-                        await bot.send_message(admin_user_id,
-                                               f"❌ Неизвестная ошибка при приглашении: {e}. Проверьте канал в настройках.")
+                        notifier.notify(admin_user_id,
+                                        f"❌ Неизвестная ошибка при приглашении: {html.escape(str(e))}. Проверьте канал в настройках.")
                 else:
                     task.invite_status = "skipped_no_channel"
-                    await bot.send_message(admin_user_id,
-                                           "⚠️ Приглашение пропущено: канал для приглашений не установлен в настройках.")
+                    notifier.notify(admin_user_id,
+                                    "⚠️ Приглашение пропущено: канал для приглашений не установлен в настройках.")
 
+            await self._set_phase(task, "reporting")
             task.finished_at = time.monotonic()
-            report_path = await make_report(task, task.target_chat if task.target_chat else "users_list")
-            report_caption = make_caption(task, task.target_chat if task.target_chat else "Список пользователей")
-
-            await bot.send_document(admin_user_id, FSInputFile(report_path), caption=report_caption)
+            await self._send_report(task, admin_user_id)
 
             task.status = "completed"
+            task.phase = "completed"
             logger.info(f"Task {task.id} completed in {task.duration():.2f} sec")
 
+        except TaskPaused:
+            task.status = "paused"
+            task.control = None
+            task.resume_phase = task.phase
+            self.registry.set_phase(task, "paused")
+            logger.info(f"Task {task.id} paused in phase {task.resume_phase}, account released.")
+            notifier.notify(admin_user_id, f"⏸ Задача <code>{task.id}</code> приостановлена, аккаунт освобожден.")
+
+        except AccountCoolingDown as e:
+            # Аккаунт задачи упёрся в лимиты Telegram: задача встаёт на паузу с сохранённым курсором
+            # и возвращается в очередь — сразу, если есть другой свободный аккаунт, иначе после паузы
+            task.status = "paused"
+            task.control = None
+            task.resume_phase = task.phase
+            self.registry.set_phase(task, "paused")
+            other_free = any(not a.is_busy and a.auth_status is not False
+                             and not request_layer.is_cooling_down(a.phone) for a in account_mgr.accounts)
+            delay = 0.0 if other_free else e.remaining + 1
+            self._cooldown_resumes[task.id] = delay
+            logger.warning(f"Task {task.id} paused in phase {task.resume_phase}: {e} Resuming in {delay:.0f}s.")
+            notifier.notify(admin_user_id,
+                            f"⏸ Задача <code>{task.id}</code> приостановлена: {html.escape(str(e))} "
+                            + ("Продолжится на другом аккаунте." if other_free
+                               else f"Продолжится через {delay:.0f} сек."))
+
+        except TaskCancelled:
+            task.status = "cancelled"
+            task.phase = "cancelled"
+            task.finished_at = time.monotonic()
+            logger.info(f"Task {task.id} cancelled with {len(task.collected_users)} users collected.")
+            notifier.notify(admin_user_id, f"🛑 Задача <code>{task.id}</code> отменена.")
+            if len(task.collected_users):
+                try:
+                    await self._send_report(task, admin_user_id)
+                except Exception:
+                    logger.exception(f"Не удалось сформировать частичный отчет по задаче {task.id}")
+
         except Exception as e:
             task.status = "failed"
+            task.phase = "failed"
+            task.finished_at = task.finished_at or time.monotonic()
             logger.exception(f"❌ Ошибка в задаче {task.id}")
-            await bot.send_message(admin_user_id,
-                                   f"❌ Ошибка в задаче <code>{task.id}</code>: {e}. Подробности в логах.")
+            if acc and isinstance(e, errors.AuthKeyUnregisteredError):
+                await account_mgr.invalidate_authorization(acc)
+            if acc and task.target_chat and isinstance(e, (errors.ChannelInvalidError, errors.ChannelPrivateError,
+                                                           errors.PeerIdInvalidError)):
+                await entity_cache.forget(acc.phone, task.target_chat)
+            notifier.notify(admin_user_id,
+                            f"❌ Ошибка в задаче <code>{task.id}</code>: {html.escape(str(e))}. Подробности в логах.")
 
         finally:
+            metrics.tasks_finished.inc(status=task.status)
+            if task.started_at:
+                metrics.task_duration.observe((task.finished_at or time.monotonic()) - task.started_at)
             self.running_tasks_count -= 1
             if task.id in self.running_tasks:
                 del self.running_tasks[task.id]
 
-            if client and client.is_connected():
-                await client.disconnect()
             if acc:
                 await account_mgr.release(acc)
 
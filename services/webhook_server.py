@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import secrets
+from typing import Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiohttp import web
+
+import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Приём апдейтов через вебхук вместо long polling.
+    Запрос с неверным секретом отклоняется, остальные подтверждаются сразу, а апдейт обрабатывается
+    в фоне: одновременно не больше max_concurrent обработчиков. Если в работе уже max_pending апдейтов,
+    сервер отвечает 503 и Telegram повторит доставку позже.
+    """
+
+    def __init__(self, host: str = config.WEBHOOK_HOST, port: int = config.WEBHOOK_PORT,
+                 path: str = config.WEBHOOK_PATH, secret: Optional[str] = config.WEBHOOK_SECRET,
+                 max_concurrent: int = config.WEBHOOK_MAX_CONCURRENT_UPDATES,
+                 max_pending: int = config.WEBHOOK_MAX_PENDING_UPDATES):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._pending: Set[asyncio.Task] = set()
+        self._runner: Optional[web.AppRunner] = None
+        self._dp: Optional[Dispatcher] = None
+        self._bot: Optional[Bot] = None
+
+    async def start(self, dp: Dispatcher, bot: Bot, url: Optional[str] = config.WEBHOOK_URL):
+        self._dp = dp
+        self._bot = bot
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Webhook server listening on http://{self.host}:{self.port}{self.path}")
+
+        if url:
+            await bot.set_webhook(url, secret_token=self.secret, allowed_updates=dp.resolve_used_update_types())
+            logger.info(f"Webhook registered at {url}")
+        else:
+            logger.warning("WEBHOOK_URL не задан: вебхук не зарегистрирован в Telegram, "
+                           "сервер принимает только локальные запросы.")
+
+    async def stop(self, timeout: float = config.WEBHOOK_SHUTDOWN_TIMEOUT_SEC):
+        """
+        Перестаёт принимать запросы и ждёт начатые обработчики не дольше timeout.
+        Вебхук в Telegram остаётся: пока бот перезапускается, апдейты копятся на стороне Telegram.
+        """
+        if self._runner is None:
+            return
+        await self._runner.cleanup()
+        self._runner = None
+        if self._pending:
+            _, unfinished = await asyncio.wait(set(self._pending), timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                logger.warning(f"Прервано {len(unfinished)} обработчиков апдейтов при остановке.")
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        await self._dp.emit_shutdown(bot=self._bot, dispatcher=self._dp)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            logger.warning(f"Webhook request from {request.remote} rejected: bad secret token")
+            return web.Response(status=401)
+        if len(self._pending) >= self.max_pending:
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        try:
+            update = await request.json(loads=self._bot.session.json_loads)
+        except ValueError:
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._process(update))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return web.Response()
+
+    async def _process(self, update: dict):
+        async with self._semaphore:
+            try:
+                result = await self._dp.feed_raw_update(self._bot, update)
+                if isinstance(result, TelegramMethod):
+                    await self._dp.silent_call_request(self._bot, result)
+            except Exception:
+                logger.exception(f"Ошибка обработки апдейта {update.get('update_id')}")
+
+
+webhook_server = WebhookServer()